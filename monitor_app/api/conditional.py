@@ -0,0 +1,39 @@
+"""条件付き GET(ETag / If-None-Match)の補助。
+
+ポーリングするクライアントは前回の ETag を ``If-None-Match`` で送る。内容が
+変わっていなければ本文を作らず 304 を返し、JSON 生成と転送を省く。
+"""
+
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+from ..services.serialization import dumps
+
+
+def make_etag(*parts: Any) -> str:
+    """部品(文字列またはJSON化できる値)から強い ETag を作る。"""
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = dumps(part, sort_keys=True)
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return f'"{h.hexdigest()[:32]}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """``If-None-Match`` が ``etag`` に一致すれば 304 レスポンスを返す。
+
+    If-None-Match は弱い比較なので ``W/`` 付きのタグも一致とみなす。
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
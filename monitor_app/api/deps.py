@@ -4,7 +4,7 @@ from __future__ import annotations
 
 import secrets
 
-from fastapi import Depends, Request, Security
+from fastapi import Depends, Request, Security, WebSocket
 from fastapi.security import APIKeyHeader
 
 from ..services.crud_service import CrudService
@@ -41,6 +41,41 @@ def get_kpi_service(request: Request):
     return request.app.state.kpi_service
 
 
+def get_kpi_history(request: Request):
+    """KPI の値の履歴(KpiHistory)を返す。"""
+    return request.app.state.kpi_history
+
+
+def get_stream_hub(request: Request):
+    """ビュー SSE の共有ポーラー(StreamHub)を返す。"""
+    return request.app.state.stream_hub
+
+
+def get_kpi_hub(request: Request):
+    """KPI の共有ポーラー(StreamHub)を返す。"""
+    return request.app.state.kpi_hub
+
+
+def get_alert_hub(request: Request):
+    """アラートの共有ポーラー(StreamHub)を返す。"""
+    return request.app.state.alert_hub
+
+
+def get_series_service(request: Request):
+    """時刻バケット集計の SeriesService を返す。"""
+    return request.app.state.series_service
+
+
+def get_spc_service(request: Request):
+    """SPC 管理限界の SpcService を返す。"""
+    return request.app.state.spc_service
+
+
+def get_ws_clients(request: Request):
+    """接続中の WebSocket クライアントの送信バッファ(ラグ計測用)を返す。"""
+    return request.app.state.ws_clients
+
+
 def get_audit_service(request: Request):
     """AuditService を返す(フェーズ4・G)。"""
     return request.app.state.audit_service
@@ -86,3 +121,17 @@ def require_read_auth(
     """読み取り系。protect_reads=True かつ api_key 設定時のみ検証。"""
     if settings.protect_reads:
         _check_key(settings, provided)
+
+
+def ws_read_authorized(websocket: WebSocket) -> bool:
+    """WebSocket の読み取り認証(:func:`require_read_auth` と同じ条件)。
+
+    ブラウザの WebSocket はヘッダを付けられないので ``?api_key=`` も受け付ける。
+    """
+    settings: AppSettings = websocket.app.state.settings
+    if not settings.protect_reads or settings.api_key is None:
+        return True
+    provided = websocket.headers.get("x-api-key") or websocket.query_params.get(
+        "api_key"
+    )
+    return bool(provided) and secrets.compare_digest(provided, settings.api_key)
@@ -0,0 +1,21 @@
+"""大きなペイロード向けの JSON レスポンス。"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from ..services.serialization import dumps_bytes
+
+
+class FastJSONResponse(JSONResponse):
+    """:mod:`~monitor_app.services.serialization` で本文を作る JSONResponse。
+
+    エンドポイントがこれを直接返すと、FastAPI の ``jsonable_encoder`` と
+    ``response_model`` の検証(全行の走査)を通らない。``response_model`` は
+    OpenAPI の記述用として残せる。
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
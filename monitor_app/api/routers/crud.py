@@ -2,9 +2,10 @@
 
 from __future__ import annotations
 
+import re
 from typing import Any, Dict
 
-from fastapi import APIRouter, Body, Depends
+from fastapi import APIRouter, Body, Depends, Query, Request
 
 from ..deps import (
     get_actor,
@@ -17,18 +18,51 @@ from ...services.crud_service import CrudService
 
 router = APIRouter(prefix="/api/tables", tags=["CRUD"])
 
+#: 列フィルタのクエリパラメータ(``filter[列]`` / ``filter[列__演算子]``)。
+#: それ以外の未知のパラメータ(キャッシュ避けの ``?_=123`` など)は無視する。
+_FILTER_PARAM = re.compile(r"filter\[(.+)\]")
+
 
 @router.get("/{table_name}", response_model=TableDataResponse)
 def list_records(
     table_name: str,
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=10000),
+    after: str | None = None,
+    order_by: str | None = None,
+    desc: bool = False,
     service: CrudService = Depends(get_crud_service),
     _: None = Depends(require_read_auth),
 ):
-    """テーブルの全レコードを取得する。"""
-    rows = service.list_records(table_name)
+    """テーブルのレコードを取得する。
+
+    ``limit`` を付けると主キー(または ``order_by`` 列 + 主キー)のキーセットで
+    ページングし、続きは ``next_cursor`` を ``after`` に渡して取得する。
+    カーソルは同じ ``order_by`` / ``desc`` でだけ使える。
+    列フィルタは ``filter[...]``: ``?filter[line]=A``・``?filter[qty__gte]=10``・
+    ``?filter[id__in]=1,2,3``(eq / ne / gt / gte / lt / lte / in)。
+    ``limit`` を省略すると従来どおり全件を返す。
+    """
+    filters = [
+        (match.group(1), value)
+        for key, value in request.query_params.multi_items()
+        if (match := _FILTER_PARAM.fullmatch(key))
+    ]
+    rows, next_cursor = service.list_page(
+        table_name,
+        limit=limit,
+        after=after,
+        order_by=order_by,
+        descending=desc,
+        filters=filters,
+    )
     columns = service.config.tables[table_name].column_names
     return TableDataResponse(
-        table_name=table_name, columns=columns, data=rows, count=len(rows)
+        table_name=table_name,
+        columns=columns,
+        data=rows,
+        count=len(rows),
+        next_cursor=next_cursor,
     )
 
 
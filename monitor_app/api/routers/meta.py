@@ -2,15 +2,25 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends
+import datetime as _dt
 
+from fastapi import APIRouter, Depends, Query, Request
+
+from ..conditional import make_etag, not_modified
 from ..deps import (
+    get_alert_hub,
     get_crud_service,
+    get_kpi_history,
+    get_kpi_hub,
     get_kpi_service,
+    get_stream_hub,
+    get_ws_clients,
     require_read_auth,
 )
+from ..responses import FastJSONResponse
 from ..schemas import SchemaResponse
 from ...services.crud_service import CrudService
+from ...services.kpi_service import kpi_signature
 
 router = APIRouter(prefix="/api", tags=["Meta"])
 
@@ -26,11 +36,65 @@ def get_schema(
 
 @router.get("/kpis")
 def get_kpis(
+    request: Request,
     service=Depends(get_kpi_service),
     _: None = Depends(require_read_auth),
 ):
-    """全 KPI カードを評価して返す(フェーズ2・E)。"""
-    return {"kpis": service.evaluate_all()}
+    """全 KPI カードの値を返す(フェーズ2・E)。
+
+    値はカードごとの ``refresh_seconds`` で評価し直した共有の結果で、評価時刻
+    ``updated_at`` と経過秒数 ``age`` が付く。値・状態が前回と同じなら
+    (``If-None-Match`` が ETag に一致)304 を返す。
+    """
+    kpis = service.snapshot()
+    etag = make_etag([kpi_signature(k) for k in kpis])
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return FastJSONResponse({"kpis": kpis}, headers={"ETag": etag})
+
+
+@router.get("/kpis/history")
+def get_kpi_history_series(
+    keys: str | None = None,
+    start: _dt.datetime | None = None,
+    end: _dt.datetime | None = None,
+    hours: float = Query(default=24.0, gt=0),
+    points: int = Query(default=60, ge=2, le=1000),
+    history=Depends(get_kpi_history),
+    _: None = Depends(require_read_auth),
+):
+    """KPI の値の履歴をスパークライン用に間引いて返す(``?keys=oee&hours=8``)。
+
+    ``keys``(カンマ区切り)を省略すると全カード。カードごとに ``data``
+    (``[バケット開始時刻, 平均]``)と、期間の平均 ``current``・直前の同じ長さの
+    期間の平均 ``previous``・差 ``delta`` / ``delta_pct`` を返す。
+    """
+    wanted = [k for k in (keys or "").split(",") if k]
+    return FastJSONResponse(
+        history.series(wanted, start=start, end=end, hours=hours, points=points)
+    )
+
+
+@router.get("/streams")
+def get_streams(
+    hub=Depends(get_stream_hub),
+    kpi_hub=Depends(get_kpi_hub),
+    alert_hub=Depends(get_alert_hub),
+    ws_clients=Depends(get_ws_clients),
+    _: None = Depends(require_read_auth),
+):
+    """稼働中の SSE ポーラー数と購読者数(ビュー別)を返す。
+
+    ``kpis`` / ``alerts`` は多重化ストリームの KPI・アラート用ポーラーの内訳。
+    ``websockets`` は WebSocket 接続ごとの配信数・畳み込み数・ラグ。
+    """
+    return {
+        **hub.stats(),
+        "kpis": kpi_hub.stats(),
+        "alerts": alert_hub.stats(),
+        "websockets": [client.stats() for client in ws_clients],
+    }
 
 
 @router.get("/health")
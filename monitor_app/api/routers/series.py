@@ -0,0 +1,89 @@
+"""時刻バケット集計エンドポイント(グラフの横軸用)。
+
+``/api/series/views/{view}`` と ``/api/series/tables/{table}`` は、時刻列 ``x`` を
+バケットに区切って ``y`` の列を集計した列指向のペイロードを返す。全行を
+ブラウザへ送らずに、長い期間のトレンドを描画幅ぶんの点で表示できる。
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+
+from fastapi import APIRouter, Depends, Query
+
+from ..deps import get_series_service, require_read_auth
+from ..responses import FastJSONResponse
+from ...services.series_service import SeriesService
+
+router = APIRouter(prefix="/api/series", tags=["Series"])
+
+
+def _split(value: str | None) -> list[str]:
+    return [v for v in (value or "").split(",") if v]
+
+
+def _aggregate(service: SeriesService, kind: str, name: str, **params):
+    params["y"] = _split(params["y"])
+    params["aggs"] = _split(params.pop("agg"))
+    return FastJSONResponse(service.aggregate(kind, name, **params))
+
+
+@router.get("/views/{view_name}")
+def view_series(
+    view_name: str,
+    x: str | None = None,
+    y: str | None = None,
+    agg: str = "avg",
+    start: _dt.datetime | None = None,
+    end: _dt.datetime | None = None,
+    width: int = Query(default=1000, ge=10, le=5000),
+    bucket: int | None = Query(default=None, ge=1),
+    service: SeriesService = Depends(get_series_service),
+    _: None = Depends(require_read_auth),
+):
+    """ビューを時刻バケットで集計する(``?agg=min,max,avg&width=800``)。
+
+    ``x`` / ``y``(カンマ区切り)を省略するとビューの ``chart`` 設定を使う。
+    ``agg`` は ``min`` / ``max`` / ``avg`` / ``count`` / ``last`` のカンマ区切り。
+    ``bucket``(秒)を省略すると ``start``〜``end`` と ``width``(描画幅)から選ぶ。
+    """
+    return _aggregate(
+        service,
+        "view",
+        view_name,
+        x=x,
+        y=y,
+        agg=agg,
+        start=start,
+        end=end,
+        width=width,
+        bucket=bucket,
+    )
+
+
+@router.get("/tables/{table_name}")
+def table_series(
+    table_name: str,
+    x: str,
+    y: str,
+    agg: str = "avg",
+    start: _dt.datetime | None = None,
+    end: _dt.datetime | None = None,
+    width: int = Query(default=1000, ge=10, le=5000),
+    bucket: int | None = Query(default=None, ge=1),
+    service: SeriesService = Depends(get_series_service),
+    _: None = Depends(require_read_auth),
+):
+    """テーブルを時刻バケットで集計する。パラメータはビュー版と同じ(``x`` / ``y`` は必須)。"""
+    return _aggregate(
+        service,
+        "table",
+        table_name,
+        x=x,
+        y=y,
+        agg=agg,
+        start=start,
+        end=end,
+        width=width,
+        bucket=bucket,
+    )
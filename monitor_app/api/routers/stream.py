@@ -0,0 +1,285 @@
+"""ダッシュボード用の多重化 SSE。
+
+1 本の接続で複数ビュー・KPI・アラートを購読し、リソースごとに型付きの
+イベントを受け取る。クエリはリソースごとの共有ポーラー(:class:`StreamHub`)が
+全クライアント分まとめて 1 回だけ実行する。
+
+イベント:
+
+- ``view``   … ビューのスナップショット(``view_name`` で区別)
+- ``kpis``   … ``{"kpis": [...]}``(``GET /api/kpis`` と同じ形。いずれかのカードの
+  値・状態が変わったときだけ送る)
+- ``alerts`` … ``{"alerts": [...]}``(``GET /api/alerts`` と同じ形)
+
+イベントの ``id`` は購読中の全リソースの位置(``kind:name=<epoch>-<seq>`` を
+``,`` で連結)。再接続時の ``Last-Event-ID`` から、受信済みのリソースは送り直さない。
+
+同じ購読を WebSocket(``/api/ws``)でも受け取れる。こちらはクライアントごとに
+送信バッファ(:class:`LatestWinsBuffer`)を持ち、送信が詰まったクライアントには
+途中のスナップショットを飛ばして最新だけを送る。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from contextlib import AsyncExitStack
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Request, WebSocket, status
+from sse_starlette.sse import EventSourceResponse
+
+from ..deps import (
+    get_alert_hub,
+    get_kpi_hub,
+    get_settings,
+    get_stream_hub,
+    get_view_service,
+    require_read_auth,
+    ws_read_authorized,
+)
+from ...exceptions import InvalidPayloadError, MonitorAppError, ViewNotFoundError
+from ...settings.runtime import AppSettings
+from ...services.kpi_service import kpi_signature
+from ...services.serialization import dumps
+from ...services.stream_hub import (
+    LatestWinsBuffer,
+    StreamHub,
+    Subscriber,
+    ViewEvent,
+    merge,
+    payload_hash,
+)
+from ...services.view_service import ViewService
+from .views import build_payload
+
+router = APIRouter(prefix="/api", tags=["Stream"])
+
+#: KPI・アラートのハブ上の購読名(ハブごとにリソースは 1 つ)。
+KPIS = "kpis"
+ALERTS = "alerts"
+
+
+def kpi_payload(service, _name: str) -> dict:
+    """KPI ハブのローダー。共有の結果を読むだけで、期限前のカードはクエリしない。"""
+    return {"kpis": service.snapshot()}
+
+
+def kpi_digest(payload: dict) -> str:
+    """KPI ハブの変化検出。``updated_at`` / ``age`` だけの変化では配信しない。"""
+    return payload_hash({"kpis": [kpi_signature(k) for k in payload["kpis"]]})
+
+
+def alert_payload(service: ViewService, engine, _name: str) -> dict:
+    """アラートハブのローダー。現在のアラート一覧を返す。
+
+    バックグラウンド評価が止まっているときは、ルールのあるビューをここで評価する。
+    ビューの結果はキャッシュ経由なので、同じビューを配信中のポーラーや
+    ポーリングとクエリを共有する。
+    """
+    if not engine.scheduled:
+        for view_name in engine.watched_views:
+            if view_name in service.config.views:
+                build_payload(service, engine, view_name, columnar=True)
+    return {"alerts": engine.active_alerts()}
+
+
+def _view_names(
+    service: ViewService, views: str, kpis: bool, alerts: bool
+) -> List[str]:
+    names = list(dict.fromkeys(v for v in views.split(",") if v))
+    for name in names:
+        if name not in service.config.views:
+            raise ViewNotFoundError(f"ビュー '{name}' は定義されていません")
+    if not (names or kpis or alerts):
+        raise InvalidPayloadError("購読するリソース(views / kpis / alerts)がありません")
+    return names
+
+
+def _wanted(
+    names: List[str],
+    kpis: bool,
+    alerts: bool,
+    view_hub: StreamHub,
+    kpi_hub: StreamHub,
+    alert_hub: StreamHub,
+) -> List[Tuple[str, StreamHub, str]]:
+    """購読するリソースの (イベント名, ハブ, リソース名) の一覧。"""
+    wanted = [("view", view_hub, name) for name in names]
+    if kpis:
+        wanted.append(("kpis", kpi_hub, KPIS))
+    if alerts:
+        wanted.append(("alerts", alert_hub, ALERTS))
+    return wanted
+
+
+def _parse_positions(event_id: Optional[str]) -> Dict[Hashable, str]:
+    """多重化ストリームの ``Last-Event-ID`` を ``{(kind, name): イベントID}`` にする。"""
+    positions: Dict[Hashable, str] = {}
+    for part in (event_id or "").split(","):
+        resource, sep, position = part.strip().rpartition("=")
+        kind, _, name = resource.partition(":")
+        if sep and name:
+            positions[(kind, name)] = position
+    return positions
+
+
+def _format_positions(positions: Dict[Hashable, str]) -> str:
+    return ",".join(f"{kind}:{name}={pos}" for (kind, name), pos in positions.items())
+
+
+async def _subscribe(
+    stack: AsyncExitStack,
+    wanted: List[Tuple[str, StreamHub, str]],
+    positions: Optional[Dict[Hashable, str]] = None,
+) -> Dict[Hashable, Subscriber]:
+    # キーは (イベント名, リソース名)。stack を抜けるとまとめて購読解除する。
+    positions = positions or {}
+    return {
+        (kind, name): await stack.enter_async_context(
+            hub.subscribe(name, positions.get((kind, name)))
+        )
+        for kind, hub, name in wanted
+    }
+
+
+@router.get("/stream")
+async def dashboard_stream(
+    request: Request,
+    views: str = "",
+    kpis: bool = False,
+    alerts: bool = False,
+    format: str = "records",
+    service: ViewService = Depends(get_view_service),
+    view_hub: StreamHub = Depends(get_stream_hub),
+    kpi_hub: StreamHub = Depends(get_kpi_hub),
+    alert_hub: StreamHub = Depends(get_alert_hub),
+    settings: AppSettings = Depends(get_settings),
+    _: None = Depends(require_read_auth),
+):
+    """複数リソースを 1 本の SSE で配信する(``?views=a,b&kpis=1&alerts=1``)。
+
+    各リソースは購読直後に最新のスナップショットを 1 回送り、以降は変化した
+    ときだけ送る。``format=columnar`` はビューの行を値の配列で送る。
+    再接続時は ``Last-Event-ID`` の時点から変わったリソースだけを送る。
+    """
+    names = _view_names(service, views, kpis, alerts)
+    columnar = format == "columnar"
+    wanted = _wanted(names, kpis, alerts, view_hub, kpi_hub, alert_hub)
+    resumed = _parse_positions(request.headers.get("last-event-id"))
+
+    async def event_generator():
+        async with AsyncExitStack() as stack:
+            subs = await _subscribe(stack, wanted, resumed)
+            positions = {
+                key: resumed[key]
+                for key, sub in subs.items()
+                if sub.resume_seq is not None
+            }
+            async for key, event in merge(subs):
+                kind = key[0]
+                if kind == "view" and columnar:
+                    data = event.encoded_columnar
+                else:
+                    data = event.encoded
+                positions[key] = event.id
+                yield {"event": kind, "data": data, "id": _format_positions(positions)}
+
+    return EventSourceResponse(event_generator(), ping=settings.stream_heartbeat)
+
+
+def _frame(kind: str, name: str, data: str) -> str:
+    # 共有の JSON 文字列をそのまま埋め込み、クライアントごとに再エンコードしない。
+    if kind == "delta":
+        return f'{{"type":"delta","view":{dumps(name)},"data":{data}}}'
+    return f'{{"type":"{kind}","data":{data}}}'
+
+
+@router.websocket("/ws")
+async def dashboard_ws(
+    websocket: WebSocket,
+    views: str = "",
+    kpis: bool = False,
+    alerts: bool = False,
+    delta: bool = False,
+    format: str = "records",
+):
+    """``/api/stream`` と同じ購読を WebSocket で配信する。
+
+    メッセージは ``{"type": "view" | "delta" | "kpis" | "alerts", "data": ...}``
+    (``delta`` には ``view`` も付く)。送信が追いつかないクライアントには、
+    リソースごとに最新のスナップショットだけを送る(latest-wins)。差分は
+    直前に送ったイベントと連続しているときだけ使う。``ws_send_timeout`` 秒
+    送れなければ切断する。接続ごとのラグは ``GET /api/streams`` で見られる。
+    """
+    state = websocket.app.state
+    if not ws_read_authorized(websocket):
+        await websocket.close(status.WS_1008_POLICY_VIOLATION, "API キーが無効です")
+        return
+    try:
+        names = _view_names(state.view_service, views, kpis, alerts)
+    except MonitorAppError as exc:
+        await websocket.close(status.WS_1008_POLICY_VIOLATION, exc.message)
+        return
+    wanted = _wanted(
+        names, kpis, alerts, state.stream_hub, state.kpi_hub, state.alert_hub
+    )
+    columnar = format == "columnar"
+    timeout = state.settings.ws_send_timeout
+
+    await websocket.accept()
+    client = websocket.client
+    buffer = LatestWinsBuffer(
+        client=f"{client.host}:{client.port}" if client else "",
+        resources=[f"{kind}:{name}" for kind, _hub, name in wanted],
+    )
+
+    def message(kind: str, name: str, event: ViewEvent, last: int | None) -> str:
+        if kind != "view":
+            return _frame(kind, name, event.encoded)
+        if delta and event.delta is not None and last == event.seq - 1:
+            data = event.encoded_delta_columnar if columnar else event.encoded_delta
+            return _frame("delta", name, data)
+        return _frame(kind, name, event.encoded_columnar if columnar else event.encoded)
+
+    async def pump(subs: Dict[Hashable, Subscriber]) -> None:
+        async for key, event in merge(subs):
+            buffer.offer(key, event)
+
+    async def send() -> None:
+        last_seq: Dict[Hashable, int] = {}
+        while True:
+            key, event = await buffer.get()
+            kind, name = key
+            await asyncio.wait_for(
+                websocket.send_text(message(kind, name, event, last_seq.get(key))),
+                timeout,
+            )
+            last_seq[key] = event.seq
+            buffer.sent(event)
+
+    async def receive() -> None:
+        # クライアントからのメッセージは使わない。切断の検出だけを行う。
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    state.ws_clients.add(buffer)
+    try:
+        async with AsyncExitStack() as stack:
+            subs = await _subscribe(stack, wanted)
+            tasks = [asyncio.ensure_future(c) for c in (pump(subs), send(), receive())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # gather だと子タスクの CancelledError が呼び出し側のキャンセルとして
+                # 伝わるので、wait で終了だけを待ち、例外は個別に回収する。
+                await asyncio.wait(tasks)
+                for task in tasks:
+                    if not task.cancelled():
+                        task.exception()
+        with contextlib.suppress(Exception):
+            await websocket.close()
+    finally:
+        state.ws_clients.discard(buffer)
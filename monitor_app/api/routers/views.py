@@ -1,45 +1,131 @@
 """ビュー表示エンドポイント。一括取得と SSE ストリーム。
 
-データ取得のたびにアラートエンジンで閾値を評価し(フェーズ1・A)、現在アクティブな
-アラートを payload に付与する。常時表示の Kiosk / ダッシュボードがこの評価を駆動する。
+取得したデータには現在アクティブなアラートを付与する(フェーズ1・A)。ルールの
+評価はバックグラウンドの :class:`AlertScheduler` が行い、動いていない場合
+(``MONITOR_ALERT_INTERVAL=0`` など)だけデータ取得のたびにここで評価する。
+SSE のクエリはビューごとの共有ポーラー(:class:`StreamHub`)が 1 回だけ実行する。
 """
 
 from __future__ import annotations
 
-import csv
-import io
-import json
+from typing import Optional
 
 import anyio
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import Response, StreamingResponse
+
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 
-from ..deps import get_alert_engine, get_config, get_view_service, require_read_auth
+from ..conditional import make_etag, not_modified
+from ..deps import (
+    get_alert_engine,
+    get_settings,
+    get_spc_service,
+    get_stream_hub,
+    get_view_service,
+    require_read_auth,
+)
+from ..responses import FastJSONResponse
 from ..schemas import ViewDataResponse
+from ...exceptions import InvalidPayloadError, ViewNotFoundError
+from ...settings.runtime import AppSettings
+from ...services.downsample import downsample_payload
+from ...services.export import (
+    XLSX_MEDIA_TYPE,
+    csv_chunks,
+    file_chunks,
+    ndjson_chunks,
+    write_xlsx,
+    xlsx_available,
+)
+from ...services.serialization import dumps
+from ...services.spc import SpcService
+from ...services.stream_hub import StreamHub
 from ...services.view_service import ViewService
-from ...settings.declarative import MonitorConfig
 
 router = APIRouter(prefix="/api/views", tags=["Views"])
 
 
-def _build_payload(service: ViewService, engine, view_name: str) -> dict:
-    """ビューデータを取得し、アラートを評価して付与する。"""
-    payload = service.get_view(view_name)
-    engine.evaluate_view(view_name, payload["data"])
-    payload["alerts"] = engine.active_alerts()
+def build_payload(
+    service: ViewService, engine, view_name: str, columnar: bool = False
+) -> dict:
+    """ビューデータを取得し、アラートを付与する(必要なら評価する)。"""
+    payload = service.get_view(view_name, columnar=columnar)
+    _evaluate(engine, view_name, payload)
     return payload
 
 
+def _evaluate(engine, view_name: str, payload: dict) -> None:
+    if not engine.scheduled:
+        columns = payload["columns"] if payload.get("format") == "columnar" else None
+        engine.evaluate_view(view_name, payload["data"], columns)
+    payload["alerts"] = engine.active_alerts()
+
+
 @router.get("/{view_name}", response_model=ViewDataResponse)
 def get_view(
     view_name: str,
+    request: Request,
+    format: str = "records",
     service: ViewService = Depends(get_view_service),
     engine=Depends(get_alert_engine),
     _: None = Depends(require_read_auth),
 ):
-    """ビューを一度だけ取得する(ポーリング用)。"""
-    return _build_payload(service, engine, view_name)
+    """ビューを一度だけ取得する(ポーリング用)。
+
+    ``format=columnar`` なら ``data`` は行ごとの値の配列(列順は ``columns``)で、
+    列名の繰り返しがないぶん小さい。
+
+    ETag は行データのハッシュとアラート・表示設定から作る。``If-None-Match`` が
+    一致すれば 304 を返す。本文は :class:`FastJSONResponse` で直接返し、全行を
+    ``response_model`` で検証し直さない(モデルは OpenAPI 用)。
+    """
+    payload, digest = service.get_view_with_digest(
+        view_name, columnar=format == "columnar"
+    )
+    _evaluate(engine, view_name, payload)
+    etag = make_etag(digest, {k: v for k, v in payload.items() if k != "data"})
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return FastJSONResponse(payload, headers={"ETag": etag})
+
+
+@router.get("/{view_name}/chart")
+def get_chart(
+    view_name: str,
+    request: Request,
+    max_points: int | None = Query(default=None, ge=3),
+    service: ViewService = Depends(get_view_service),
+    spc: SpcService = Depends(get_spc_service),
+    _: None = Depends(require_read_auth),
+):
+    """グラフ用のデータ(``x`` と ``y`` の列だけ、列指向)を返す。
+
+    ``ChartDef.max_points``(または ``?max_points=``)を超える行数なら、系列ごとに
+    LTTB で間引く。極値と ``ucl`` / ``lcl`` をまたぐ点は必ず残す。
+    ``total_rows`` は間引く前の行数。ETag は :func:`get_view` と同様。
+
+    ``chart.spc`` があれば、計算した管理限界を ``limits`` に付け、``ucl`` / ``lcl``
+    の代わりに使う(間引きで残す逸脱点の判定も同じ限界で行う)。
+    """
+    payload, digest = service.get_view_with_digest(view_name, columnar=True)
+    chart = service.config.views[view_name].chart
+    if chart is None:
+        raise ViewNotFoundError(f"ビュー '{view_name}' にはグラフ定義がありません")
+    if max_points is not None:
+        chart = chart.model_copy(update={"max_points": max_points})
+    limits = spc.limits(view_name, payload, digest)
+    if limits is not None and limits["ucl"] is not None:
+        chart = chart.model_copy(update={"ucl": limits["ucl"], "lcl": limits["lcl"]})
+    etag = make_etag(digest, chart.model_dump(), limits)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    body = downsample_payload(payload, chart)
+    if limits is not None:
+        body["limits"] = limits
+    return FastJSONResponse(body, headers={"ETag": etag})
 
 
 @router.get("/{view_name}/export")
@@ -47,47 +133,41 @@ def export_view(
     view_name: str,
     format: str = "csv",
     service: ViewService = Depends(get_view_service),
+    settings: AppSettings = Depends(get_settings),
     _: None = Depends(require_read_auth),
 ):
-    """ビューを CSV または Excel(xlsx)でダウンロードする(フェーズ4・H)。
+    """ビューを CSV・NDJSON・Excel(xlsx)でダウンロードする(フェーズ4・H)。
 
+    どの形式もサーバーサイドカーソルから読んだ行を順に書き出すため、行数が
+    多くてもメモリを消費しない。CSV と NDJSON はそのままストリーミングし、
+    xlsx は write-only モードで一時ファイルに書いてから送る(大きいシートは
+    ``export_sheet_rows`` 行ごとに分割)。
     xlsx は openpyxl が導入されている場合のみ。未導入なら CSV にフォールバックする。
+    同時実行数(``export_concurrency``、超えると 503)と 1 回あたりの秒数
+    (``export_timeout``)に上限がある。
     """
-    payload = service.get_view(view_name)
-    columns = payload["columns"]
-    rows = payload["data"]
+    if format == "xlsx" and not xlsx_available():
+        format = "csv"  # openpyxl 未導入なら CSV へ
 
+    batches = service.stream_rows(view_name)
+    columns = next(batches)  # ここでクエリを実行する(失敗はレスポンス前に例外になる)
     if format == "xlsx":
-        try:
-            from openpyxl import Workbook
-        except ImportError:
-            format = "csv"  # openpyxl 未導入なら CSV へ
-        else:
-            wb = Workbook()
-            ws = wb.active
-            ws.append(columns)
-            for row in rows:
-                ws.append([row.get(c) for c in columns])
-            buf = io.BytesIO()
-            wb.save(buf)
-            return Response(
-                content=buf.getvalue(),
-                media_type=(
-                    "application/vnd.openxmlformats-officedocument."
-                    "spreadsheetml.sheet"
-                ),
-                headers={
-                    "Content-Disposition": f'attachment; filename="{view_name}.xlsx"'
-                },
-            )
-
-    buf = io.StringIO()
-    writer = csv.DictWriter(buf, fieldnames=columns)
-    writer.writeheader()
-    for row in rows:
-        writer.writerow({c: row.get(c) for c in columns})
+        fp = write_xlsx(columns, batches, view_name, settings.export_sheet_rows)
+        return StreamingResponse(
+            file_chunks(fp),
+            media_type=XLSX_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{view_name}.xlsx"'},
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            ndjson_chunks(columns, batches),
+            media_type="application/x-ndjson",
+            headers={
+                "Content-Disposition": f'attachment; filename="{view_name}.ndjson"'
+            },
+        )
     return StreamingResponse(
-        iter([buf.getvalue()]),
+        csv_chunks(columns, batches),
         media_type="text/csv",
         headers={"Content-Disposition": f'attachment; filename="{view_name}.csv"'},
     )
@@ -97,30 +177,111 @@ def export_view(
 async def stream_view(
     view_name: str,
     request: Request,
+    delta: bool = False,
+    append: bool = False,
+    format: str = "records",
     service: ViewService = Depends(get_view_service),
-    engine=Depends(get_alert_engine),
-    config: MonitorConfig = Depends(get_config),
+    hub: StreamHub = Depends(get_stream_hub),
+    settings: AppSettings = Depends(get_settings),
+    spc: SpcService = Depends(get_spc_service),
     _: None = Depends(require_read_auth),
 ):
     """ビューデータを Server-Sent Events で配信する。
 
-    ``refresh_interval_ms`` ごとに再クエリし、内容のハッシュが変化したときだけ
-    ``message`` イベントを送る。差分がなければ送信しない。
+    クエリはビューごとの共有ポーラーが ``refresh_interval_ms`` ごとに 1 回だけ
+    実行し、内容のハッシュが変化したときだけ全購読者へ ``message`` イベントを送る。
+
+    ``delta=true`` かつビューに ``key_column`` があれば、初回だけスナップショット
+    (``message``)を送り、以降は追加・更新・削除された行だけを ``delta`` イベントで
+    送る。取りこぼし(キュー溢れ)や差分で表せない変化のときはスナップショットに戻る。
+
+    ``format=columnar`` ならスナップショットも差分も行を値の配列で送る。
+
+    ``append=true`` は時系列グラフ用の追記モード。初回のスナップショットの後は、
+    グラフの ``x`` 列が前回送った最大値より大きい行だけを ``append`` イベント
+    (``{"columns", "data"}``、``x`` の昇順)で送る。送った位置は購読者ごとに
+    サーバーが覚えるので、1 回の配信は新しい行の数に比例する。既存の行の更新や
+    削除は送らない(追記専用の表示向け)。``chart.spc`` があれば、管理限界が
+    変わるたびに ``limits`` イベントも送る。
+
+    各イベントには ``id`` が付く。ブラウザが再接続時に送る ``Last-Event-ID`` が
+    有効なら、受信済みの内容は送り直さず、取りこぼした差分だけを送る。
+    ``stream_heartbeat`` 秒ごとにコメント行を送り、無通信の接続がプロキシに
+    切られないようにする。
     """
-    interval = max(config.refresh_interval_ms, 250) / 1000.0
+    if view_name not in service.config.views:
+        raise ViewNotFoundError(f"ビュー '{view_name}' は定義されていません")
 
-    async def event_generator():
-        last_hash: str | None = None
-        while True:
-            if await request.is_disconnected():
-                break
-            payload = await anyio.to_thread.run_sync(
-                _build_payload, service, engine, view_name
+    columnar = format == "columnar"
+    last_event_id = request.headers.get("last-event-id")
+    if append:
+        chart = service.config.views[view_name].chart
+        if chart is None:
+            raise InvalidPayloadError(
+                f"ビュー '{view_name}' にはグラフ定義がないため追記モードは使えません"
             )
-            current = ViewService.data_hash(payload)
-            if current != last_hash:
-                last_hash = current
-                yield {"event": "message", "data": json.dumps(payload, default=str)}
-            await anyio.sleep(interval)
+        return EventSourceResponse(
+            _append_events(hub, view_name, chart.x, columnar, spc),
+            ping=settings.stream_heartbeat,
+        )
+
+    async def event_generator():
+        # 切断時は sse-starlette がこのジェネレータをキャンセルし、購読が解除される。
+        async with hub.subscribe(view_name, last_event_id, replay=delta) as sub:
+            last_seq = sub.resume_seq
+            while True:
+                event = await sub.get()
+                contiguous = last_seq is not None and event.seq == last_seq + 1
+                if delta and contiguous and event.delta is not None:
+                    data = (
+                        event.encoded_delta_columnar
+                        if columnar
+                        else event.encoded_delta
+                    )
+                    yield {"event": "delta", "data": data, "id": event.id}
+                elif event.has_snapshot:
+                    data = event.encoded_columnar if columnar else event.encoded
+                    yield {"event": "message", "data": data, "id": event.id}
+                else:
+                    continue  # 再送用の差分が途切れた。後続のスナップショットを待つ
+                last_seq = event.seq
+
+    return EventSourceResponse(event_generator(), ping=settings.stream_heartbeat)
 
-    return EventSourceResponse(event_generator())
+
+async def _append_events(
+    hub: StreamHub,
+    view_name: str,
+    x: str,
+    columnar: bool,
+    spc: Optional[SpcService] = None,
+):
+    """追記モードの SSE イベント。購読者ごとに送った ``x`` の最大値を覚えておく。"""
+    async with hub.subscribe(view_name) as sub:
+        last_x = None
+        snapshot = True
+        sent_limits = None
+        while True:
+            event = await sub.get()
+            picked = None if snapshot else event.rows_after(x, last_x)
+            if picked is None:
+                # 初回、または x を比較できない行が来た: スナップショットから始め直す。
+                data = event.encoded_columnar if columnar else event.encoded
+                yield {"event": "message", "data": data}
+                after = event.rows_after(x)
+                snapshot = after is None
+                last_x = after[1] if after else None
+            else:
+                rows, last_x = picked
+                if rows:
+                    data = event.encode_rows(rows, columnar)
+                    yield {"event": "append", "data": data}
+            limits = None
+            if spc is not None:
+                # ロックを取り全行を並べ替えるので、イベントループの外で計算する。
+                limits = await anyio.to_thread.run_sync(
+                    spc.limits, view_name, event.payload, event.digest
+                )
+            if limits is not None and limits != sent_limits:
+                yield {"event": "limits", "data": dumps(limits)}
+                sent_limits = limits
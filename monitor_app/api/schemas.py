@@ -6,7 +6,7 @@
 
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Literal
 
 from pydantic import BaseModel
 
@@ -16,6 +16,7 @@ class TableDataResponse(BaseModel):
     columns: List[str]
     data: List[Dict[str, Any]]
     count: int
+    next_cursor: str | None = None  # 次ページの after。最終ページなら None
 
 
 class RecordResponse(BaseModel):
@@ -33,8 +34,11 @@ class ViewDataResponse(BaseModel):
     title: str
     description: str
     columns: List[str]
-    data: List[Dict[str, Any]]
+    # 既定は行ごとの dict。format=columnar のときは行ごとの値の配列(列順は columns)。
+    data: List[Dict[str, Any]] | List[List[Any]]
     cell_styles: Dict[str, Dict[str, Any]]
+    key_column: str | None = None  # 行の識別列(SSE の差分配信で使う)
+    format: Literal["records", "columnar"] = "records"
     alerts: List[Dict[str, Any]] = []  # 現在アクティブなアラート(フェーズ1・A)
 
 
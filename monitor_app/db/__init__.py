@@ -1,7 +1,8 @@
 """DB 層。エンジン管理・テーブル構築・CRUD を担う。"""
 
+from .changes import ChangeTracker
 from .engine import Database
 from .registry import TableRegistry
 from .repository import TableRepository
 
-__all__ = ["Database", "TableRegistry", "TableRepository"]
+__all__ = ["ChangeTracker", "Database", "TableRegistry", "TableRepository"]
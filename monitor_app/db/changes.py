@@ -0,0 +1,58 @@
+"""テーブル変更の通知。
+
+アプリ内の書き込み経路(:class:`TableRepository`・CSV 取り込み)はコミット後に
+:meth:`ChangeTracker.mark` を呼ぶ。ビューのキャッシュなど、テーブルの内容に
+依存する側はリスナーを登録して無効化に使う。
+
+通知されるのは同一プロセス内の書き込みだけ。外部プロセスが DB に直接書く場合は
+検知できないため、利用側は TTL などの保険を併用すること。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List
+
+logger = logging.getLogger("monitor_app.db")
+
+#: 変更されたテーブル名の集合を受け取るコールバック。
+ChangeListener = Callable[[frozenset], None]
+
+
+class ChangeTracker:
+    """テーブルごとの書き込み回数を数え、リスナーへ変更を通知する。
+
+    リスナーは書き込んだスレッド上で同期的に呼ばれるため、軽い処理に限る。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._listeners: List[ChangeListener] = []
+
+    def add_listener(self, listener: ChangeListener) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def mark(self, *tables: str) -> None:
+        """``tables`` が変更されたことを記録し、リスナーへ通知する。"""
+        changed = frozenset(tables)
+        if not changed:
+            return
+        with self._lock:
+            for name in changed:
+                self._versions[name] = self._versions.get(name, 0) + 1
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(changed)
+            except Exception:  # noqa: BLE001 - 通知の失敗で書き込みを失敗させない
+                logger.exception("変更通知の処理に失敗しました")
+
+    def version(self, table: str) -> int:
+        """テーブルの書き込み回数(プロセス内)。"""
+        return self._versions.get(table, 0)
+
+    def versions(self, tables: Iterable[str]) -> Dict[str, int]:
+        return {name: self._versions.get(name, 0) for name in tables}
@@ -2,19 +2,32 @@
 
 from __future__ import annotations
 
+import time
 from contextlib import contextmanager
 from typing import Iterator
 
-from sqlalchemy import Connection, create_engine, text
+from sqlalchemy import Connection, create_engine, event, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.pool import StaticPool
 
+from .changes import ChangeTracker
+
+
+def _enable_wal(dbapi_conn, _record) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    finally:
+        cursor.close()
+
 
 class Database:
     """接続 URL を受け取り、エンジンとコネクションを供給する薄いラッパ。
 
     monitor-app は同期 SQLAlchemy を使う。FastAPI のスレッドプール上で
     十分な性能が出るうえ、非同期 DB ドライバよりデバッグが容易なため。
+
+    ``changes`` は同じ DB を共有する書き込み経路とキャッシュをつなぐ変更通知。
     """
 
     def __init__(self, url: str, echo: bool = False) -> None:
@@ -31,6 +44,12 @@ class Database:
         self.engine: Engine = create_engine(
             url, echo=echo, future=True, connect_args=connect_args, **engine_kwargs
         )
+        if url.startswith("sqlite") and "poolclass" not in engine_kwargs:
+            # ファイルの SQLite は WAL にする。既定のロールバックジャーナルでは、
+            # 読み取り中(エクスポートのカーソルなど)の共有ロックが書き込みを
+            # "database is locked" で止める。WAL なら読み取りと書き込みが並行できる。
+            event.listen(self.engine, "connect", _enable_wal)
+        self.changes = ChangeTracker()
 
     @contextmanager
     def connect(self) -> Iterator[Connection]:
@@ -56,5 +75,38 @@ class Database:
                 if self.url.startswith("sqlite"):
                     conn.execute(text("PRAGMA query_only = OFF"))
 
+    @contextmanager
+    def statement_timeout(self, conn: Connection, seconds: float) -> Iterator[None]:
+        """この間に ``conn`` で実行する文を ``seconds`` 秒で打ち切る(0 以下は無制限)。
+
+        SQLite は進捗ハンドラ、PostgreSQL は ``statement_timeout``(トランザクション
+        内のみ)、MySQL は ``MAX_EXECUTION_TIME``(SELECT のみ)で打ち切り、文は
+        ``OperationalError`` などになる。その他の DB では打ち切らない。
+        """
+        dialect = conn.dialect.name
+        ms = max(1, int(seconds * 1000))
+        if seconds <= 0:
+            yield
+        elif dialect == "sqlite":
+            raw = conn.connection.driver_connection
+            deadline = time.monotonic() + seconds
+            # 1000 命令ごとに呼ばれ、真を返すと実行中の文が中断される。
+            raw.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+            try:
+                yield
+            finally:
+                raw.set_progress_handler(None, 0)
+        elif dialect == "postgresql":
+            conn.execute(text(f"SET LOCAL statement_timeout = {ms}"))
+            yield
+        elif dialect == "mysql":
+            conn.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {ms}"))
+            try:
+                yield
+            finally:
+                conn.execute(text("SET SESSION MAX_EXECUTION_TIME = 0"))
+        else:
+            yield
+
     def dispose(self) -> None:
         self.engine.dispose()
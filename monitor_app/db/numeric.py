@@ -0,0 +1,57 @@
+"""値を数値として読む SQLAlchemy 構文(アラート判定の SQL 化用)。
+
+:class:`as_number` は列の値を浮動小数点数にする。数値として読めない値
+(``'abc'`` や空文字)は ``NULL`` になるので、Python 側の ``float()`` で失敗した
+値を飛ばすのと同じ結果になる。文字列で保存された数値(``str`` 列の ``'90'``)も
+数値として扱う。
+
+- SQLite:     ``CASE WHEN CAST(x AS NUMERIC) = x THEN CAST(x AS REAL) END``
+  (比較で x に NUMERIC 親和性が適用され、整形式の数値の文字列だけが一致する)
+- PostgreSQL: 文字列にしてから正規表現で数値の形かを確かめ、``DOUBLE PRECISION``
+  に変換する
+
+``nan`` / ``inf`` や ``1_000`` のような Python 固有の表記は数値として扱わない。
+MySQL は文字列と数値の比較を黙って変換する(``'abc'`` が 0 になる)ため対象外。
+"""
+
+from __future__ import annotations
+
+from sqlalchemy import Float
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+#: :class:`as_number` を SQL にできる方言。
+NUMERIC_DIALECTS = ("sqlite", "postgresql")
+
+_PG_NUMBER = r"^\s*[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?\s*$"
+
+
+class as_number(FunctionElement):
+    """列の値を数値にしたもの(数値として読めなければ ``NULL``)。"""
+
+    type = Float()
+    name = "as_number"
+    inherit_cache = True
+
+
+def _arg(element, compiler, **kw) -> str:
+    return compiler.process(list(element.clauses)[0], **kw)
+
+
+@compiles(as_number)
+def _number_default(element, compiler, **kw):
+    raise NotImplementedError(
+        f"as_number は {compiler.dialect.name} では使えません({NUMERIC_DIALECTS})"
+    )
+
+
+@compiles(as_number, "sqlite")
+def _number_sqlite(element, compiler, **kw):
+    arg = _arg(element, compiler, **kw)
+    return f"CASE WHEN CAST({arg} AS NUMERIC) = {arg} THEN CAST({arg} AS REAL) END"
+
+
+@compiles(as_number, "postgresql")
+def _number_postgresql(element, compiler, **kw):
+    arg = f"CAST({_arg(element, compiler, **kw)} AS TEXT)"
+    return f"CASE WHEN {arg} ~ '{_PG_NUMBER}' THEN CAST({arg} AS DOUBLE PRECISION) END"
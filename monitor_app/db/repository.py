@@ -2,17 +2,34 @@
 
 文字列連結による SQL を一切作らないため、列名・テーブル名は :class:`TableRegistry`
 に登録済みのオブジェクト経由でしか参照できない。
+
+書き込みはコミット後に ``db.changes`` へ通知し、ビューのキャッシュを無効化させる。
 """
 
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import operator
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
-from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy import and_, delete, func, insert, or_, select, update
 
 from .engine import Database
 from .registry import TableRegistry
 
+#: 一覧取得の列フィルタ。値は呼び出し側で列の論理型に変換済みであること。
+FILTER_OPS: Dict[str, Callable[[Any, Any], Any]] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": lambda col, values: col.in_(values),
+}
+
+#: (列名, 演算子, 値) のフィルタ。
+Filter = Tuple[str, str, Any]
+
 
 class TableRepository:
     def __init__(self, db: Database, registry: TableRegistry) -> None:
@@ -25,6 +42,63 @@ class TableRepository:
             result = conn.execute(select(table))
             return [dict(row) for row in result.mappings()]
 
+    def list_page(
+        self,
+        table_name: str,
+        *,
+        limit: Optional[int] = None,
+        order_by: Optional[str] = None,
+        descending: bool = False,
+        after: Optional[Tuple[Any, Any]] = None,
+        filters: Sequence[Filter] = (),
+    ) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Any, Any]]]:
+        """キーセット方式のページ取得。``(行, 次ページの位置)`` を返す。
+
+        並びは ``(order_by, 主キー)``。``after`` は直前ページ末尾の
+        ``(order_by の値, 主キー)`` で、OFFSET を使わないため深いページでも
+        コストが一定。``order_by`` 列の NULL は方向によらず末尾に並ぶ。
+        ``limit`` が None なら全件を返し、次ページの位置は常に None。
+        """
+        table = self.registry.get(table_name)
+        pk_name = self.registry.primary_key(table_name)
+        pk = table.c[pk_name]
+        col = table.c[order_by] if order_by else pk
+        stmt = select(table)
+        for name, op, value in filters:
+            stmt = stmt.where(FILTER_OPS[op](table.c[name], value))
+
+        beyond = operator.lt if descending else operator.gt
+        direction = (lambda c: c.desc()) if descending else (lambda c: c.asc())
+        if col is pk:
+            stmt = stmt.order_by(direction(pk))
+            if after is not None:
+                stmt = stmt.where(beyond(pk, after[1]))
+        else:
+            stmt = stmt.order_by(col.is_(None), direction(col), direction(pk))
+            if after is not None:
+                last_value, last_pk = after
+                if last_value is None:
+                    stmt = stmt.where(and_(col.is_(None), beyond(pk, last_pk)))
+                else:
+                    stmt = stmt.where(
+                        or_(
+                            col.is_(None),
+                            beyond(col, last_value),
+                            and_(col == last_value, beyond(pk, last_pk)),
+                        )
+                    )
+        if limit is not None:
+            # 1 行多く読み、次ページの有無を判定する。
+            stmt = stmt.limit(limit + 1)
+
+        with self.db.readonly() as conn:
+            rows = [dict(r) for r in conn.execute(stmt).mappings()]
+        if limit is None or len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, (last[col.name], last[pk_name])
+
     def get(self, table_name: str, record_id: Any) -> Optional[Dict[str, Any]]:
         table = self.registry.get(table_name)
         pk = table.c[self.registry.primary_key(table_name)]
@@ -40,6 +114,7 @@ class TableRepository:
         table = self.registry.get(table_name)
         with self.db.connect() as conn:
             conn.execute(insert(table), rows)
+        self.db.changes.mark(table_name)
         return len(rows)
 
     def insert(self, table_name: str, values: Dict[str, Any]) -> Dict[str, Any]:
@@ -55,7 +130,8 @@ class TableRepository:
                 .mappings()
                 .first()
             )
-            return dict(row) if row else {pk_name: new_id, **values}
+        self.db.changes.mark(table_name)
+        return dict(row) if row else {pk_name: new_id, **values}
 
     def update(
         self, table_name: str, record_id: Any, values: Dict[str, Any]
@@ -67,14 +143,18 @@ class TableRepository:
             if result.rowcount == 0:
                 return None
             row = conn.execute(select(table).where(pk == record_id)).mappings().first()
-            return dict(row) if row else None
+        self.db.changes.mark(table_name)
+        return dict(row) if row else None
 
     def delete(self, table_name: str, record_id: Any) -> bool:
         table = self.registry.get(table_name)
         pk = table.c[self.registry.primary_key(table_name)]
         with self.db.connect() as conn:
             result = conn.execute(delete(table).where(pk == record_id))
-            return result.rowcount > 0
+        if result.rowcount == 0:
+            return False
+        self.db.changes.mark(table_name)
+        return True
 
     def exists(self, table_name: str, record_id: Any) -> bool:
         table = self.registry.get(table_name)
@@ -0,0 +1,82 @@
+"""時刻のバケット化を方言ごとの SQL にする SQLAlchemy 構文。
+
+時刻列を UNIX 秒(タイムゾーンなしの値を UTC とみなす)に変換する
+:class:`epoch_seconds` と、それを ``seconds`` 幅で切り捨てる :class:`time_bucket` を
+提供する。SQLite・MySQL・PostgreSQL でそれぞれ次の SQL になる:
+
+- SQLite:     ``CAST(strftime('%s', ts) AS INTEGER) / 60 * 60``
+- MySQL:      ``FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', ts) / 60) * 60``
+- PostgreSQL: ``FLOOR(EXTRACT(EPOCH FROM ts) / 60) * 60``
+
+MySQL の ``UNIX_TIMESTAMP()`` はセッションのタイムゾーンで解釈するため使わない。
+"""
+
+from __future__ import annotations
+
+from sqlalchemy import Integer, String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+
+class epoch_seconds(FunctionElement):
+    """時刻列の UNIX 秒。"""
+
+    type = Integer()
+    name = "epoch_seconds"
+    inherit_cache = True
+
+
+class time_bucket(FunctionElement):
+    """時刻列を ``seconds`` 秒幅のバケットに切り捨てた UNIX 秒(バケットの開始時刻)。"""
+
+    type = Integer()
+    name = "time_bucket"
+    inherit_cache = True
+    # 幅はリテラルとして SQL に埋め込むので、文のキャッシュキーにも含める。
+    _traverse_internals = FunctionElement._traverse_internals + [
+        ("seconds", InternalTraversal.dp_plain_obj)
+    ]
+
+    def __init__(self, expr, seconds: int) -> None:
+        self.seconds = int(seconds)
+        super().__init__(expr)
+
+
+def _arg(element, compiler, **kw) -> str:
+    return compiler.process(list(element.clauses)[0], **kw)
+
+
+@compiles(epoch_seconds)
+def _epoch_default(element, compiler, **kw):
+    arg = _arg(element, compiler, **kw)
+    # 文字列で保存した時刻(テーブルの str 列)は TIMESTAMP にしてから取り出す。
+    if isinstance(list(element.clauses)[0].type, String):
+        arg = f"CAST({arg} AS TIMESTAMP)"
+    return f"EXTRACT(EPOCH FROM {arg})"
+
+
+@compiles(epoch_seconds, "sqlite")
+def _epoch_sqlite(element, compiler, **kw):
+    return f"CAST(strftime('%s', {_arg(element, compiler, **kw)}) AS INTEGER)"
+
+
+@compiles(epoch_seconds, "mysql")
+def _epoch_mysql(element, compiler, **kw):
+    return (
+        f"TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', {_arg(element, compiler, **kw)})"
+    )
+
+
+@compiles(time_bucket)
+def _bucket_default(element, compiler, **kw):
+    epoch = compiler.process(epoch_seconds(*element.clauses), **kw)
+    return f"FLOOR({epoch} / {element.seconds}) * {element.seconds}"
+
+
+@compiles(time_bucket, "sqlite")
+def _bucket_sqlite(element, compiler, **kw):
+    # 整数同士の除算は切り捨て(1970 年以降なら FLOOR と同じ)。SQLite の FLOOR は
+    # 数学関数付きでビルドされた場合にしか使えない。
+    epoch = compiler.process(epoch_seconds(*element.clauses), **kw)
+    return f"({epoch} / {element.seconds}) * {element.seconds}"
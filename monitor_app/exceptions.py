@@ -40,3 +40,8 @@ class InvalidPayloadError(MonitorAppError):
 class QueryExecutionError(MonitorAppError):
     code = "QUERY_EXECUTION_ERROR"
     status_code = 500
+
+
+class ServiceBusyError(MonitorAppError):
+    code = "SERVICE_BUSY"
+    status_code = 503
@@ -9,6 +9,7 @@ from __future__ import annotations
 import importlib.resources as resources
 import os
 from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
 from typing import Optional
 
@@ -18,16 +19,34 @@ from fastapi.templating import Jinja2Templates
 from starlette.middleware.cors import CORSMiddleware
 
 from .api.errors import register_exception_handlers
-from .api.routers import alerts, audit, crud, ingest, meta, pages, views
+from .api.routers import (
+    alerts,
+    audit,
+    crud,
+    ingest,
+    meta,
+    pages,
+    series,
+    stream,
+    views,
+)
 from .db.engine import Database
 from .db.registry import TableRegistry
 from .db.repository import TableRepository
+from .services.alert_pushdown import ThresholdPushdown
+from .services.alert_scheduler import AlertScheduler
 from .services.alert_service import AlertEngine
 from .services.audit_service import AuditService
 from .services.crud_service import CrudService
 from .services.importer import CsvImporter
 from .services.ingest_watcher import IngestWatcher
+from .services.kpi_history import KpiHistory
+from .services.kpi_refresher import KpiRefresher
 from .services.kpi_service import KpiService
+from .services.series_service import SeriesService
+from .services.spc import SpcService
+from .services.stream_hub import StreamHub, payload_hash
+from .services.view_cache import ViewCache
 from .services.view_service import ViewService
 from .settings.declarative import MonitorConfig
 from .settings.runtime import AppSettings
@@ -60,12 +79,22 @@ def create_app(
         )
 
     @asynccontextmanager
-    async def lifespan(_app: FastAPI):
+    async def lifespan(app_: FastAPI):
         if watcher:
             watcher.start()
+        if config.kpis:
+            app_.state.kpi_refresher.start()
+        if config.alerts and settings.alert_interval > 0:
+            app_.state.alert_scheduler.start()
         try:
             yield
         finally:
+            await app_.state.alert_scheduler.stop()
+            await app_.state.kpi_refresher.stop()
+            await app_.state.stream_hub.close()
+            await app_.state.kpi_hub.close()
+            await app_.state.alert_hub.close()
+            app_.state.kpi_service.close()
             if watcher:
                 await watcher.stop()
 
@@ -84,9 +113,102 @@ def create_app(
     audit_svc = AuditService(db, settings.audit_enabled)
     app.state.audit_service = audit_svc
     app.state.crud_service = CrudService(config, registry, repository, audit_svc)
-    app.state.view_service = ViewService(config, db)
+    view_cache = (
+        ViewCache(settings.view_cache_ttl, settings.view_cache_size)
+        if settings.view_cache_ttl > 0
+        else None
+    )
+    app.state.view_service = ViewService(
+        config,
+        db,
+        view_cache,
+        export_slots=settings.export_concurrency,
+        export_timeout=settings.export_timeout,
+    )
     app.state.alert_engine = AlertEngine(config, settings)
-    app.state.kpi_service = KpiService(config, db)
+    interval = max(config.refresh_interval_ms, 250) / 1000.0
+    app.state.kpi_history = KpiHistory(
+        config,
+        db,
+        settings.kpi_history_days,
+        interval=settings.kpi_history_interval,
+        create=init_db,
+    )
+    app.state.kpi_service = KpiService(
+        config,
+        db,
+        workers=settings.kpi_workers,
+        timeout=settings.kpi_timeout,
+        refresh=interval,
+        history=app.state.kpi_history,
+    )
+    # KPI は共有の結果を期限ごとに評価し直す。書き込みがあれば依存カードを失効させる。
+    db.changes.add_listener(app.state.kpi_service.invalidate)
+    app.state.series_service = SeriesService(config, db, registry)
+    app.state.spc_service = SpcService(config)
+    # SSE はビューごとに 1 つのポーラーを全クライアントで共有する。依存テーブルに
+    # 書き込みがない tick はクエリを省き、外部からの書き込みはキャッシュ TTL で拾う。
+    coalesce = settings.stream_coalesce_ms / 1000.0
+    app.state.stream_hub = StreamHub(
+        partial(
+            views.build_payload,
+            app.state.view_service,
+            app.state.alert_engine,
+            columnar=True,
+        ),
+        interval=interval,
+        key_columns={
+            name: v.key_column for name, v in config.views.items() if v.key_column
+        },
+        token=app.state.view_service.change_token,
+        max_idle=settings.view_cache_ttl,
+        coalesce=coalesce,
+        replay=settings.stream_replay_size,
+        linger=settings.stream_linger,
+    )
+    # 多重化ストリーム(/api/stream)用。KPI とアラートも同じ仕組みで共有する。
+    app.state.kpi_hub = StreamHub(
+        partial(stream.kpi_payload, app.state.kpi_service),
+        interval=interval,
+        digest=stream.kpi_digest,
+        coalesce=coalesce,
+        linger=settings.stream_linger,
+    )
+    app.state.kpi_refresher = KpiRefresher(
+        app.state.kpi_service,
+        on_change=partial(app.state.kpi_hub.notify, [stream.KPIS]),
+    )
+    app.state.alert_hub = StreamHub(
+        partial(stream.alert_payload, app.state.view_service, app.state.alert_engine),
+        interval=interval,
+        digest=payload_hash,
+        coalesce=coalesce,
+        linger=settings.stream_linger,
+    )
+    # アラートは表示中の画面の有無によらずバックグラウンドで評価する。
+    app.state.alert_scheduler = AlertScheduler(
+        app.state.view_service,
+        app.state.alert_engine,
+        settings.alert_interval,
+        on_change=partial(app.state.alert_hub.notify, [stream.ALERTS]),
+        pushdown=ThresholdPushdown(config, db) if settings.alert_pushdown else None,
+        max_idle=settings.view_cache_ttl,
+    )
+    if settings.stream_push:
+        # アプリ内の書き込みは通知で即座に配信へ反映し、ポーリングは保険にする。
+        view_service = app.state.view_service
+        kpi_tables = frozenset().union(*app.state.kpi_service.dependencies.values())
+        alert_tables = frozenset().union(
+            *(
+                view_service.dependencies.get(v, ())
+                for v in app.state.alert_engine.watched_views
+            )
+        )
+        app.state.stream_hub.watch(db.changes, view_service.dependencies)
+        app.state.kpi_hub.watch(db.changes, {stream.KPIS: kpi_tables})
+        app.state.alert_hub.watch(db.changes, {stream.ALERTS: alert_tables})
+        app.state.alert_scheduler.watch(db.changes, alert_tables)
+    app.state.ws_clients = set()  # 接続中の WebSocket の送信バッファ(/api/ws)
 
     # --- ビュー(HTML)とアセット ---
     web = _web_dir()
@@ -104,6 +226,8 @@ def create_app(
     register_exception_handlers(app)
     app.include_router(crud.router)
     app.include_router(views.router)
+    app.include_router(stream.router)
+    app.include_router(series.router)
     app.include_router(ingest.router)
     app.include_router(alerts.router)
     app.include_router(audit.router)
@@ -24,7 +24,7 @@ config = MonitorConfig(
     header_text="📊 Monitor Dashboard",
     footer_text="© 2026 Monitor App",
     refresh_interval_ms=2000,
-    refresh_mode="sse",  # "sse"(差分配信)または "polling"
+    refresh_mode="sse",  # "sse"(差分配信)/ "websocket" / "polling"
     # ---- CRUD 対象テーブル ----
     # columns は ["id", "name"](命名規則で型推論)でも
     # {"id": "int", "name": "str"}(明示)でも書ける。
@@ -65,6 +65,9 @@ config = MonitorConfig(
                 ),
             },
             # グラフ表示(管理限界線つき)。表とグラフの両方が出る。
+            # 点数の多い時系列は max_points=1000 などでサーバー側で間引ける。
+            # 追記だけの時系列は window=500 で直近 500 点を新しい行の追記だけで更新する。
+            # spc="imr"(または "xbar_r", subgroup_size=5)で管理限界をデータから計算する。
             chart=ChartDef(type="bar", x="name", y="price", ucl=5000, target=1000),
         ),
         "orders_summary": ViewDef(
@@ -0,0 +1,89 @@
+"""閾値アラートの違反数を DB 側で数える(SQL プッシュダウン)。
+
+ビューの閾値ルールをまとめて 1 本の集計クエリにする::
+
+    SELECT SUM(CASE WHEN as_number(t) > 80 THEN 1 ELSE 0 END) AS r0, ...
+    FROM (<ビューの SQL>) AS src
+
+行をアプリへ転送せず、ルールの数によらず 1 往復で全ルールの違反数が返る。
+値は :class:`~monitor_app.db.numeric.as_number` で数値にしてから比べるので、
+数値として読めない値を飛ばす Python 側の判定と同じ件数になる。
+
+``as_number`` を使えない方言(MySQL)では使わない。クエリが失敗したビュー
+(列名の誤りなど)は ``RETRY_SECONDS`` の間プッシュダウンせず、行を取得して
+Python で判定する。
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import case, column, func, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..db.engine import Database
+from ..db.numeric import NUMERIC_DIALECTS, as_number
+from ..settings.declarative import AlertRule, MonitorConfig
+from .alert_service import ALERT_OPS, AlertEngine
+
+logger = logging.getLogger("monitor_app.alerts")
+
+#: SQL にできなかったビューで、再びプッシュダウンを試すまでの秒数。
+RETRY_SECONDS = 600.0
+
+
+class ThresholdPushdown:
+    def __init__(self, config: MonitorConfig, db: Database) -> None:
+        self.config = config
+        self.db = db
+        self.enabled = db.engine.dialect.name in NUMERIC_DIALECTS
+        self.queries = 0
+        #: SQL にできなかったビューと、その時刻(しばらく Python で判定する)。
+        self._unsafe: Dict[str, float] = {}
+
+    def supports(self, view_name: str, rules: Sequence[AlertRule]) -> bool:
+        """ビューのルールをすべて SQL で数えられるか(閾値ルールだけのビュー)。"""
+        if not (self.enabled and rules and view_name in self.config.views):
+            return False
+        failed = self._unsafe.get(view_name)
+        if failed is not None and time.monotonic() - failed < RETRY_SECONDS:
+            return False
+        return all(rule.kind == "threshold" for rule in rules)
+
+    def statement(self, view_name: str, rules: Sequence[AlertRule]):
+        vdef = self.config.views[view_name]
+        names = list(dict.fromkeys(rule.column for rule in rules))
+        src = text(vdef.query).columns(*(column(c) for c in names)).subquery("src")
+        counts = [
+            func.sum(
+                case(
+                    (ALERT_OPS[rule.op](as_number(src.c[rule.column]), rule.value), 1),
+                    else_=0,
+                )
+            ).label(f"r{i}")
+            for i, rule in enumerate(rules)
+        ]
+        return select(*counts).select_from(src)
+
+    def counts(
+        self, view_name: str, rules: Sequence[AlertRule]
+    ) -> Optional[Dict[str, int]]:
+        """ルールのキーごとの違反数。SQL で数えられなければ ``None``。"""
+        if not self.supports(view_name, rules):
+            return None
+        self.queries += 1
+        try:
+            with self.db.readonly() as conn:
+                row = conn.execute(self.statement(view_name, rules)).one()
+        except SQLAlchemyError:
+            logger.warning(
+                "ビュー '%s' のアラート判定を SQL にできません。行を取得して判定します",
+                view_name,
+                exc_info=True,
+            )
+            self._unsafe[view_name] = time.monotonic()
+            return None
+        keys: List[str] = [AlertEngine.rule_key(rule) for rule in rules]
+        return {key: int(n or 0) for key, n in zip(keys, row)}
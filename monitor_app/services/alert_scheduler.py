@@ -0,0 +1,167 @@
+"""アラートルールのバックグラウンド評価。
+
+ルールのあるビューを ``interval`` 秒ごとに取得して :class:`AlertEngine` で評価する。
+画面を開いている人がいなくても発火・復帰の通知が届き、同じビューを何台で
+表示していても評価は tick ごとに 1 回になる。
+
+ビューの取得は :class:`ViewService` 経由(結果キャッシュを表示側と共有する)で、
+行データのハッシュが前回と同じビューは評価を省く(閾値ルールの結果は変わらず、
+Nelson ルールには新しい行がない)。閾値ルールだけのビューは、行を取得せずに
+違反数を DB 側で数える(:class:`ThresholdPushdown`)。依存テーブルへの書き込みが
+なく ``max_idle`` 秒以内に数えたビューはクエリも省く。動作中は ``engine.scheduled`` が True になり、
+HTTP ハンドラや配信は評価せずに現在のアラート状態を読むだけになる。止まって
+いれば従来どおりビューの取得時に評価する。
+
+:meth:`AlertScheduler.watch` でテーブルの変更通知につなぐと、依存テーブルへの
+アプリ内の書き込みで次の評価を前倒しする。
+
+FastAPI の lifespan から asyncio タスクとして起動・停止する。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from ..db.changes import ChangeTracker
+from ..exceptions import MonitorAppError
+from .alert_pushdown import ThresholdPushdown
+from .alert_service import AlertEngine
+from .view_service import ViewService
+
+logger = logging.getLogger("monitor_app.alerts")
+
+
+class AlertScheduler:
+    def __init__(
+        self,
+        service: ViewService,
+        engine: AlertEngine,
+        interval: float,
+        on_change: Optional[Callable[[], None]] = None,
+        pushdown: Optional[ThresholdPushdown] = None,
+        max_idle: float = 0.0,
+    ) -> None:
+        self.service = service
+        self.engine = engine
+        self.interval = max(interval, 0.25)
+        self.on_change = on_change
+        self.pushdown = pushdown
+        self.max_idle = max_idle
+        self.runs = 0
+        self.evaluations = 0
+        self._digests: Dict[str, str] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._tokens: Dict[str, Tuple[Any, float]] = {}
+        self._failing: set = set()
+        self._tables: FrozenSet[str] = frozenset()
+        self._woken: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: asyncio.Task | None = None
+
+    def watch(self, changes: ChangeTracker, tables: FrozenSet[str]) -> None:
+        """``tables`` への書き込みで次の評価を前倒しする。"""
+        self._tables = frozenset(tables)
+        changes.add_listener(self._on_tables_changed)
+
+    def _on_tables_changed(self, tables: FrozenSet[str]) -> None:
+        # 書き込み側のスレッドから呼ばれる。
+        loop, woken = self._loop, self._woken
+        if loop is None or woken is None or not (tables & self._tables):
+            return
+        with contextlib.suppress(RuntimeError):  # 終了処理中でループが閉じている
+            loop.call_soon_threadsafe(woken.set)
+
+    def evaluate_once(self) -> List[str]:
+        """ルールのある全ビューを 1 回評価し、内容が変わって評価したビューを返す。"""
+        self.runs += 1
+        before = self.engine.active_alerts()
+        evaluated = []
+        for view_name in self.engine.watched_views:
+            if view_name not in self.service.config.views:
+                continue
+            counted = self._evaluate_counts(view_name)
+            if counted is not None:
+                if counted:
+                    evaluated.append(view_name)
+                continue
+            try:
+                payload, digest = self.service.get_view_with_digest(
+                    view_name, columnar=True
+                )
+            except MonitorAppError as exc:
+                # 一時的な DB 障害で評価を止めない。ログは状態遷移時のみ。
+                if view_name not in self._failing:
+                    logger.warning("alert scheduler '%s': %s", view_name, exc.message)
+                self._failing.add(view_name)
+                continue
+            self._failing.discard(view_name)
+            if self._digests.get(view_name) == digest:
+                continue
+            self._digests[view_name] = digest
+            self.engine.evaluate_view(view_name, payload["data"], payload["columns"])
+            evaluated.append(view_name)
+        self.evaluations += len(evaluated)
+        if evaluated and self.on_change is not None:
+            if self.engine.active_alerts() != before:
+                self.on_change()
+        return evaluated
+
+    def _evaluate_counts(self, view_name: str) -> Optional[bool]:
+        """違反数を DB 側で数えて評価する。数えられなければ ``None``。
+
+        違反数が前回と同じなら評価を省く(False を返す)。
+        """
+        rules = self.engine.rules_for(view_name)
+        if self.pushdown is None or not self.pushdown.supports(view_name, rules):
+            return None
+        token = self.service.change_token(view_name)
+        last = self._tokens.get(view_name)
+        now = time.monotonic()
+        if token is not None and last is not None and last[0] == token:
+            if now - last[1] < self.max_idle:
+                return False  # 書き込みがなく、数えてから間もない
+        counts = self.pushdown.counts(view_name, rules)
+        if counts is None:
+            return None
+        self._tokens[view_name] = (token, now)
+        if self._counts.get(view_name) == counts:
+            return False
+        self._counts[view_name] = counts
+        self.engine.evaluate_view(view_name, [], counts=counts)
+        return True
+
+    async def _run(self) -> None:
+        logger.info("alert scheduler started (interval=%.1fs)", self.interval)
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(self.evaluate_once)
+                except Exception:  # noqa: BLE001 - 1 回の失敗で評価を止めない
+                    logger.exception("アラートの評価に失敗しました")
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._woken.wait(), self.interval)
+                self._woken.clear()
+        except asyncio.CancelledError:
+            logger.info("alert scheduler stopped")
+            raise
+
+    def start(self) -> None:
+        self.engine.scheduled = True
+        self._loop = asyncio.get_running_loop()
+        self._woken = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+        self.engine.scheduled = False
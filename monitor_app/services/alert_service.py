@@ -3,22 +3,47 @@
 各ビューのデータに対しルールを評価し、違反を検出する。発火中アラートの集合を
 保持し、新規発火(OFF→ON)と復帰(ON→OFF)のときだけ通知することで、
 連続通知を抑制する。
+
+``kind="nelson"`` のルールはルールごとに判定状態(:class:`NelsonSeries`)を持ち、
+前回より ``order_by`` が新しい行だけを判定する。新しい行にルールが成立した点が
+あれば発火、なければ復帰とし、新しい行がなければ状態を変えない。
+
+閾値ルールは列単位で 1 回だけ評価する。ルールが参照する列をそれぞれ 1 度だけ
+浮動小数点数の配列(NumPy があれば ``ndarray``、なければ ``array('d')``)にし、
+数値として読めない値・欠損は NaN として違反に数えない。各ルールの比較はその
+配列に対して行うので、手間は「行数 × ルール数」ではなく「行数 × 参照列数」で
+増える(NumPy では比較もベクトル演算)。
+
+評価は通常 :class:`~monitor_app.services.alert_scheduler.AlertScheduler` が
+バックグラウンドで行う(``scheduled`` が True の間)。止まっているときはビューの
+取得時に評価する。
 """
 
 from __future__ import annotations
 
 import logging
+import math
 import operator
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass, field
-from typing import Callable, Dict, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from ..settings.declarative import AlertRule, MonitorConfig
 from ..settings.runtime import AppSettings
+from .nelson import NelsonSeries
 from .notifiers import build_notifiers, dispatch
+from .view_service import row_values, sort_rows
+
+try:  # 任意依存: pip install "monitor-app[fast]"
+    import numpy as np
+except ImportError:  # pragma: no cover - 導入状況に依存
+    np = None
 
 logger = logging.getLogger("monitor_app.alerts")
 
-_OPS: Dict[str, Callable[[float, float], bool]] = {
+#: 閾値ルールの比較演算子(SQL の列式にもそのまま使える)。
+ALERT_OPS: Dict[str, Callable[[Any, Any], Any]] = {
     ">": operator.gt,
     ">=": operator.ge,
     "<": operator.lt,
@@ -28,6 +53,43 @@ _OPS: Dict[str, Callable[[float, float], bool]] = {
 }
 
 
+def _to_float(raw: Any) -> float:
+    if raw is None:
+        return math.nan
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def float_column(values: Iterable[Any]) -> Any:
+    """列の値を浮動小数点数の配列にする。数値として読めない値・欠損は NaN。
+
+    NumPy があれば ``ndarray``(全値がそのまま変換できれば一括で)、なければ
+    ``array('d')``。
+    """
+    values = list(values)
+    if np is not None:
+        try:
+            column = np.asarray(values, dtype=float)
+            if column.ndim == 1:
+                return column
+        except (TypeError, ValueError):
+            pass
+        return np.fromiter(map(_to_float, values), dtype=float, count=len(values))
+    return array("d", map(_to_float, values))
+
+
+def count_violations(op: str, column: Any, value: float) -> int:
+    """``column``(:func:`float_column`)のうち ``値 op value`` を満たす数(NaN は除く)。"""
+    compare = ALERT_OPS[op]
+    if np is not None and isinstance(column, np.ndarray):
+        with np.errstate(invalid="ignore"):
+            hits = compare(column, value) & ~np.isnan(column)
+        return int(np.count_nonzero(hits))
+    return sum(1 for x in column if x == x and compare(x, value))
+
+
 @dataclass
 class ActiveAlert:
     key: str
@@ -43,6 +105,9 @@ class AlertEngine:
     config: MonitorConfig
     settings: AppSettings
     _active: Dict[str, ActiveAlert] = field(default_factory=dict)
+    _series: Dict[str, NelsonSeries] = field(default_factory=dict)
+    #: バックグラウンド評価が動いていれば True(表示側は状態を読むだけにする)。
+    scheduled: bool = False
 
     def __post_init__(self) -> None:
         self._notifiers = build_notifiers(self.settings)
@@ -51,42 +116,108 @@ class AlertEngine:
         for rule in self.config.alerts:
             self._by_view.setdefault(rule.view, []).append(rule)
 
+    @property
+    def watched_views(self) -> List[str]:
+        """ルールが 1 つ以上あるビュー名。"""
+        return list(self._by_view)
+
+    def rules_for(self, view_name: str) -> List[AlertRule]:
+        """ビューに紐づくルール。"""
+        return list(self._by_view.get(view_name, []))
+
     @staticmethod
-    def _rule_key(rule: AlertRule) -> str:
+    def rule_key(rule: AlertRule) -> str:
+        if rule.kind == "nelson":
+            # 並び順・中心線・σ が違えば別の系列として判定する。
+            rules = ",".join(map(str, rule.rules))
+            params = f"{rule.order_by or ''}:{rule.center}:{rule.sigma}"
+            return f"{rule.view}:{rule.column}:nelson:{rules}:{params}"
         return f"{rule.view}:{rule.column}:{rule.op}:{rule.value}"
 
-    def _evaluate_rule(self, rule: AlertRule, rows: List[dict]) -> int:
-        """ルールに違反する行数を返す。"""
-        compare = _OPS[rule.op]
-        violations = 0
-        for row in rows:
-            raw = row.get(rule.column)
-            if raw is None:
-                continue
+    def _evaluate_nelson(
+        self,
+        rule: AlertRule,
+        key: str,
+        rows: Sequence[Any],
+        columns: Optional[List[str]],
+    ) -> Optional[Tuple[int, str]]:
+        """前回より新しい行を Nelson ルールで判定する。新しい行がなければ ``None``。"""
+        series = self._series.get(key)
+        if series is None:
+            series = self._series.setdefault(key, NelsonSeries(rule))
+        order_by = rule.order_by or self.config.views[rule.view].chart.x
+        if columns is None:
+            payload = {"columns": list(rows[0]) if rows else [], "data": rows}
+        else:
+            payload = {"columns": columns, "data": rows, "format": "columnar"}
+        index = sort_rows(payload, order_by)
+        if index is None:
+            return None
+        keys, ordered = index
+        # 表示側の評価はスレッドプールで並行しうる(スケジューラ停止時)。
+        with series.lock:
+            last_x = series.last_x
             try:
-                if compare(float(raw), rule.value):
-                    violations += 1
-            except (TypeError, ValueError):
-                continue
-        return violations
+                start = 0 if last_x is None else bisect_right(keys, last_x)
+            except TypeError:
+                return None
+            if start == len(keys):
+                return None
+            series.last_x = keys[-1]
+            values = list(row_values(ordered[start:], rule.column, columns))
+            count, fired = series.observe(values)
+        numbers = ", ".join(map(str, sorted(fired)))
+        return count, f"{rule.describe()}: ルール {numbers}"
 
-    def evaluate_view(self, view_name: str, rows: List[dict]) -> List[ActiveAlert]:
+    def evaluate_view(
+        self,
+        view_name: str,
+        rows: Sequence[Any],
+        columns: Optional[List[str]] = None,
+        counts: Optional[Dict[str, int]] = None,
+    ) -> List[ActiveAlert]:
         """1 つのビューのデータを評価し、発火/復帰時に通知する。
 
-        返り値はこのビューに紐づく現在アクティブなアラート。
+        ``rows`` は行ごとの dict。``columns`` を渡した場合は列順の値の並び
+        (列指向ペイロードの ``data``)。``counts``(ルールのキー -> 違反数)に
+        ある閾値ルールは、行を見ずにその件数を使う(DB 側で数えた結果,
+        :mod:`~monitor_app.services.alert_pushdown`)。返り値はこのビューに紐づく
+        現在アクティブなアラート。
         """
         results: List[ActiveAlert] = []
-        for rule in self._by_view.get(view_name, []):
-            key = self._rule_key(rule)
-            count = self._evaluate_rule(rule, rows)
+        rules = self._by_view.get(view_name, [])
+        # 閾値ルールが参照する列を 1 度ずつ数値の配列にする(ルール間で共有)。
+        arrays = {
+            rule.column: None
+            for rule in rules
+            if rule.kind == "threshold"
+            and (counts is None or self.rule_key(rule) not in counts)
+        }
+        for col in arrays:
+            arrays[col] = float_column(row_values(rows, col, columns))
+        for rule in rules:
+            key = self.rule_key(rule)
             was_active = key in self._active
+            if rule.kind == "nelson":
+                result = self._evaluate_nelson(rule, key, rows, columns)
+                if result is None:  # 新しい行がない: 状態はそのまま
+                    if was_active:
+                        results.append(self._active[key])
+                    continue
+                count, message = result
+            elif counts is not None and key in counts:
+                count, message = counts[key], rule.describe()
+            else:
+                column = arrays[rule.column]
+                count = count_violations(rule.op, column, rule.value)
+                message = rule.describe()
             if count > 0:
                 alert = ActiveAlert(
                     key=key,
                     view=rule.view,
                     column=rule.column,
                     level=rule.level,
-                    message=rule.describe(),
+                    message=message,
                     count=count,
                 )
                 self._active[key] = alert
@@ -126,5 +257,5 @@ class AlertEngine:
                 "message": a.message,
                 "count": a.count,
             }
-            for a in self._active.values()
+            for a in list(self._active.values())  # 評価スレッドと並行して読む
         ]
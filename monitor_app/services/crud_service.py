@@ -2,14 +2,16 @@
 
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import base64
+import json
+from typing import Any, Dict, List, Sequence, Tuple
 
 from typing import Optional
 
 from ..exceptions import InvalidPayloadError, RecordNotFoundError, TableNotFoundError
 from ..settings.declarative import MonitorConfig
 from ..db.registry import TableRegistry
-from ..db.repository import TableRepository
+from ..db.repository import FILTER_OPS, Filter, TableRepository
 from .audit_service import AuditService
 from .coercion import CoercionError, coerce
 
@@ -66,6 +68,92 @@ class CrudService:
         self._require_table(table_name)
         return self.repo.list(table_name)
 
+    def list_page(
+        self,
+        table_name: str,
+        *,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        order_by: Optional[str] = None,
+        descending: bool = False,
+        filters: Sequence[Tuple[str, str]] = (),
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """絞り込み・並び替え付きでレコードを取得する。``(行, 次カーソル)`` を返す。
+
+        ``filters`` はクエリ文字列の ``(キー, 値)``。キーは ``列`` または
+        ``列__演算子``(eq / ne / gt / gte / lt / lte / in)で、``in`` の値は
+        カンマ区切り。値は列の論理型に変換してから式に渡す。
+        """
+        self._require_table(table_name)
+        tdef = self.config.tables[table_name]
+        if order_by is not None and order_by not in tdef.column_names:
+            raise InvalidPayloadError(f"並び替え列 '{order_by}' は存在しません")
+        rows, last = self.repo.list_page(
+            table_name,
+            limit=limit,
+            order_by=order_by,
+            descending=descending,
+            after=(
+                self._decode_cursor(table_name, order_by, descending, after)
+                if after
+                else None
+            ),
+            filters=[self._parse_filter(table_name, k, v) for k, v in filters],
+        )
+        if last is None:
+            return rows, None
+        return rows, self._encode_cursor(order_by, descending, last)
+
+    def _coerce_value(self, table_name: str, column: str, value: Any) -> Any:
+        try:
+            return coerce(value, self.config.tables[table_name].column_type(column))
+        except CoercionError as exc:
+            raise InvalidPayloadError(str(exc)) from exc
+
+    def _parse_filter(self, table_name: str, key: str, raw: str) -> Filter:
+        column, _, op = key.partition("__")
+        op = op or "eq"
+        if column not in self.config.tables[table_name].column_names:
+            raise InvalidPayloadError(f"フィルタ列 '{column}' は存在しません")
+        if op not in FILTER_OPS:
+            raise InvalidPayloadError(f"フィルタ演算子 '{op}' は使えません")
+        if op == "in":
+            values = [self._coerce_value(table_name, column, v) for v in raw.split(",")]
+            return column, op, values
+        return column, op, self._coerce_value(table_name, column, raw)
+
+    @staticmethod
+    def _encode_cursor(
+        order_by: Optional[str], descending: bool, last: Tuple[Any, Any]
+    ) -> str:
+        # 並び順もカーソルに入れ、別の並び順で使い回されたら拒否する。
+        blob = json.dumps([order_by, descending, *last], default=str).encode("utf-8")
+        return base64.urlsafe_b64encode(blob).decode("ascii").rstrip("=")
+
+    def _decode_cursor(
+        self,
+        table_name: str,
+        order_by: Optional[str],
+        descending: bool,
+        cursor: str,
+    ) -> Tuple[Any, Any]:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            cur_order, cur_desc, value, pk_value = json.loads(
+                base64.urlsafe_b64decode(padded)
+            )
+        except (ValueError, TypeError) as exc:
+            raise InvalidPayloadError("カーソルが不正です") from exc
+        if cur_order != order_by or cur_desc != descending:
+            raise InvalidPayloadError(
+                "カーソルは別の並び順(order_by / desc)で発行されたものです"
+            )
+        pk = self.config.tables[table_name].primary_key
+        return (
+            self._coerce_value(table_name, order_by or pk, value),
+            self._coerce_value(table_name, pk, pk_value),
+        )
+
     def get_record(self, table_name: str, record_id: Any) -> Dict[str, Any]:
         self._require_table(table_name)
         row = self.repo.get(table_name, record_id)
@@ -0,0 +1,224 @@
+"""グラフ用の間引き(Largest-Triangle-Three-Buckets)。
+
+``ChartDef.max_points`` を超える行数のビューは、系列ごとに LTTB で代表点を選び、
+選ばれた行だけをブラウザへ送る。LTTB は各バケットから直前の採用点・次バケットの
+平均と作る三角形が最大の点を選ぶので、山や谷の形が残りやすい。さらに次の点は
+必ず残す:
+
+- 各系列の最大値・最小値(視覚上の極値)
+- ``ucl`` / ``lcl`` をまたいだ点(管理限界の逸脱と復帰)
+
+NumPy があればバケット境界・次バケット平均・三角形の面積をベクトル演算で
+求める(``pip install "monitor-app[fast]"``)。なければ同じ結果を純 Python で計算する。
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+from ..settings.declarative import ChartDef
+from .view_service import as_columnar
+
+try:  # 任意依存: pip install "monitor-app[fast]"
+    import numpy as np
+except ImportError:  # pragma: no cover - 導入状況に依存
+    np = None
+
+
+def _number(value: Any) -> float:
+    """グラフ上の値にする。数値にできないもの(None など)は NaN。"""
+    if isinstance(value, (_dt.datetime, _dt.date)):
+        if not isinstance(value, _dt.datetime):
+            value = _dt.datetime.combine(value, _dt.time())
+        return value.timestamp()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _x_number(value: Any) -> float:
+    if isinstance(value, str):  # SQLite は日時を ISO 8601 文字列で返す
+        try:
+            return _number(_dt.datetime.fromisoformat(value))
+        except ValueError:
+            pass
+    return _number(value)
+
+
+def x_positions(values: Sequence[Any]) -> List[float]:
+    """横軸の座標。数値・日時ならその値、それ以外(文字列ラベル等)は行番号。"""
+    xs = [_x_number(v) for v in values]
+    if any(math.isnan(x) for x in xs):
+        return [float(i) for i in range(len(values))]
+    return xs
+
+
+def _bounds(n: int, threshold: int) -> List[int]:
+    """先頭・末尾を除く ``threshold - 2`` 個のバケットの境界(長さ threshold - 1)。"""
+    every = (n - 2) / (threshold - 2)
+    return [int(i * every) + 1 for i in range(threshold - 2)] + [n - 1]
+
+
+def lttb(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    """LTTB で選んだ点の添字(昇順)。``threshold`` 以下の点数ならすべて返す。
+
+    ``y`` の NaN は選ばれない(次バケットの平均からも除く)。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    if np is not None:
+        return _lttb_numpy(x, y, threshold)
+    return _lttb_python(x, y, threshold)
+
+
+def _lttb_python(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    bounds = _bounds(len(y), threshold)
+    picked = [0]
+    a = 0
+    for b in range(threshold - 2):
+        start, end = bounds[b], bounds[b + 1]
+        # 次のバケット(最後は末尾の点)の平均
+        nstart, nend = end, bounds[b + 2] if b + 2 < len(bounds) else len(y)
+        pts = [(x[i], y[i]) for i in range(nstart, nend) if not math.isnan(y[i])]
+        if pts:
+            cx = sum(p[0] for p in pts) / len(pts)
+            cy = sum(p[1] for p in pts) / len(pts)
+        else:
+            cx, cy = x[nstart], y[a]
+        ax, ay = x[a], y[a]
+        best, best_area = start, -1.0
+        for i in range(start, end):
+            area = abs((ax - cx) * (y[i] - ay) - (ax - x[i]) * (cy - ay))
+            if not math.isnan(area) and area > best_area:
+                best, best_area = i, area
+        picked.append(best)
+        a = best
+    picked.append(len(y) - 1)
+    return picked
+
+
+def _lttb_numpy(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    xs = np.asarray(x, dtype=float)
+    ys = np.asarray(y, dtype=float)
+    bounds = np.asarray(_bounds(len(ys), threshold))
+    # 次バケットの平均をまとめて求める(バケット b の「次」は b + 1、最後は末尾の点)。
+    valid = ~np.isnan(ys)
+    starts = np.append(bounds[1:-1], len(ys) - 1)
+    counts = np.add.reduceat(valid, starts).astype(float)
+    sum_x = np.add.reduceat(np.where(valid, xs, 0.0), starts)
+    sum_y = np.add.reduceat(np.where(valid, ys, 0.0), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_x = np.where(counts > 0, sum_x / counts, xs[starts])
+        avg_y = sum_y / counts
+    picked = [0]
+    a = 0
+    for b in range(threshold - 2):
+        start, end = bounds[b], bounds[b + 1]
+        ax, ay = xs[a], ys[a]
+        cy = avg_y[b] if counts[b] > 0 else ay
+        area = np.abs(
+            (ax - avg_x[b]) * (ys[start:end] - ay) - (ax - xs[start:end]) * (cy - ay)
+        )
+        area = np.nan_to_num(area, nan=-1.0)
+        a = start + int(np.argmax(area))
+        picked.append(a)
+    picked.append(len(ys) - 1)
+    return picked
+
+
+def keep_points(
+    y: Sequence[float], ucl: Optional[float], lcl: Optional[float], limit: int
+) -> List[int]:
+    """LTTB に加えて残す点: 最大値・最小値と、管理限界をまたいだ前後の点。
+
+    またぎが ``limit`` を超えるほど多い(限界付近で振動している)ときは等間隔に
+    間引く。
+    """
+    if np is not None:
+        keep, crossings = _keep_numpy(y, ucl, lcl)
+    else:
+        keep, crossings = _keep_python(y, ucl, lcl)
+    if len(crossings) > limit:
+        step = len(crossings) / limit
+        crossings = [crossings[int(k * step)] for k in range(limit)]
+    keep.update(crossings)
+    return sorted(keep)
+
+
+def _keep_python(y, ucl, lcl):
+    values = [(v, i) for i, v in enumerate(y) if not math.isnan(v)]
+    if not values:
+        return set(), []
+    keep = {min(values)[1], max(values)[1]}
+    crossings: List[int] = []
+    for limit_value, above in ((ucl, True), (lcl, False)):
+        if limit_value is None:
+            continue
+        prev = None
+        for i, v in enumerate(y):
+            if math.isnan(v):
+                continue
+            out = v > limit_value if above else v < limit_value
+            if prev is not None and out != prev[1]:
+                crossings.extend((prev[0], i))
+            prev = (i, out)
+    return keep, crossings
+
+
+def _keep_numpy(y, ucl, lcl):
+    ys = np.asarray(y, dtype=float)
+    idx = np.flatnonzero(~np.isnan(ys))  # NaN を飛ばして隣り合う点を比べる
+    if idx.size == 0:
+        return set(), []
+    vals = ys[idx]
+    keep = {int(idx[np.argmin(vals)]), int(idx[np.argmax(vals)])}
+    crossings: List[int] = []
+    for limit_value, above in ((ucl, True), (lcl, False)):
+        if limit_value is None:
+            continue
+        out = vals > limit_value if above else vals < limit_value
+        at = np.flatnonzero(out[1:] != out[:-1])
+        pairs = np.column_stack((idx[at], idx[at + 1])).ravel()
+        crossings.extend(int(i) for i in pairs)
+    return keep, crossings
+
+
+def downsample_payload(payload: Dict[str, Any], chart: ChartDef) -> Dict[str, Any]:
+    """ビューのペイロードをグラフ用に間引いた列指向のペイロードにする。
+
+    列は ``x`` と ``y_columns`` だけに絞る。系列ごとに選んだ点の和集合を送るので、
+    行数は最大で ``max_points`` × 系列数(+ 極値・またぎ)になる。
+    """
+    payload = as_columnar(payload)
+    columns = payload["columns"]
+    wanted = [c for c in [chart.x, *chart.y_columns] if c in columns]
+    positions = [columns.index(c) for c in wanted]
+    rows = payload["data"]
+    total = len(rows)
+
+    picked = range(total)
+    if chart.max_points and total > chart.max_points:
+        if chart.x in columns:
+            xi = columns.index(chart.x)
+            x = x_positions([row[xi] for row in rows])
+        else:
+            x = [float(i) for i in range(total)]
+        keep: set = set()
+        for col in chart.y_columns:
+            if col not in columns:
+                continue
+            i = columns.index(col)
+            y = [_number(row[i]) for row in rows]
+            keep.update(lttb(x, y, chart.max_points))
+            keep.update(keep_points(y, chart.ucl, chart.lcl, chart.max_points))
+        picked = sorted(keep)
+
+    out = {k: v for k, v in payload.items() if k not in ("columns", "data")}
+    out["columns"] = wanted
+    out["data"] = [[rows[r][p] for p in positions] for r in picked]
+    out["total_rows"] = total
+    return out
@@ -0,0 +1,118 @@
+"""ビューのエクスポート形式(フェーズ4・H)。
+
+:meth:`ViewService.stream_rows` が返す行バッチを受け取り、届いた順にチャンクへ
+書き出すジェネレータを提供する。全行をメモリに載せないため、ピークメモリは
+行数によらずバッチサイズで決まる。
+
+xlsx は openpyxl の write-only モードで書き、完成したファイルを
+:class:`~tempfile.SpooledTemporaryFile` 経由で送る(小さければメモリ、大きければ
+ディスク)。
+"""
+
+from __future__ import annotations
+
+import csv
+import importlib.util
+import io
+import re
+import tempfile
+from typing import IO, Iterator, List, Sequence
+
+from .serialization import dumps
+
+#: 行バッチのイテレータ。要素は行(タプル互換)のリスト。
+Batches = Iterator[List[Sequence]]
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+#: Excel の 1 シートの最大行数(ヘッダ行を含む)。
+XLSX_MAX_ROWS = 1_048_576
+# これを超えた xlsx はメモリではなく一時ファイルに置く。
+_SPOOL_BYTES = 8 * 1024 * 1024
+_CHUNK_BYTES = 64 * 1024
+# シート名に使えない文字。名前は 31 文字までなので連番の分を残して切り詰める。
+_SHEET_INVALID = re.compile(r"[\[\]:*?/\\]")
+_SHEET_TITLE_LEN = 24
+
+
+def csv_chunks(columns: List[str], batches: Batches) -> Iterator[str]:
+    """ヘッダ行を先に送り、以降はバッチごとに CSV テキストを返す。"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    try:
+        yield buf.getvalue()
+        for batch in batches:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows(batch)
+            yield buf.getvalue()
+    finally:
+        # クライアント切断時もカーソル(接続)を確実に返す。
+        batches.close()
+
+
+def ndjson_chunks(columns: List[str], batches: Batches) -> Iterator[str]:
+    """1 行 1 オブジェクトの NDJSON をバッチごとに返す。"""
+    try:
+        for batch in batches:
+            yield "".join(dumps(dict(zip(columns, row))) + "\n" for row in batch)
+    finally:
+        batches.close()
+
+
+def xlsx_available() -> bool:
+    return importlib.util.find_spec("openpyxl") is not None
+
+
+def write_xlsx(
+    columns: List[str], batches: Batches, title: str, rows_per_sheet: int
+) -> IO[bytes]:
+    """行を write-only ワークシートへ流し込み、先頭に巻き戻した一時ファイルを返す。
+
+    ``rows_per_sheet`` 行ごとに新しいシートを作り、各シートにヘッダ行を付ける。
+    """
+    from openpyxl import Workbook
+
+    rows_per_sheet = max(1, min(rows_per_sheet, XLSX_MAX_ROWS - 1))
+    base = _SHEET_INVALID.sub("_", title)[:_SHEET_TITLE_LEN] or "Sheet"
+    wb = Workbook(write_only=True)
+    sheets = 0
+    filled = rows_per_sheet  # 最初の行で 1 枚目のシートを作る
+
+    def new_sheet():
+        nonlocal sheets, filled
+        sheets += 1
+        ws = wb.create_sheet(base if sheets == 1 else f"{base} ({sheets})")
+        ws.append(columns)
+        filled = 0
+        return ws
+
+    try:
+        for batch in batches:
+            for row in batch:
+                if filled >= rows_per_sheet:
+                    ws = new_sheet()
+                ws.append(list(row))
+                filled += 1
+    finally:
+        batches.close()
+    if sheets == 0:
+        new_sheet()  # 0 行でもヘッダだけのシートを出す
+
+    out = tempfile.SpooledTemporaryFile(max_size=_SPOOL_BYTES)
+    try:
+        wb.save(out)
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+def file_chunks(fp: IO[bytes], chunk_size: int = _CHUNK_BYTES) -> Iterator[bytes]:
+    """ファイルを先頭から少しずつ返し、読み終えたら(切断時も)閉じる。"""
+    try:
+        while chunk := fp.read(chunk_size):
+            yield chunk
+    finally:
+        fp.close()
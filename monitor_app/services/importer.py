@@ -104,6 +104,7 @@ class CsvImporter:
                 conn.execute(delete(table))
             if rows:
                 conn.execute(insert(table), rows)
+        self.db.changes.mark(table_name)
         result.inserted = len(rows)
         logger.info(
             "imported %s: %d rows (skipped %d)",
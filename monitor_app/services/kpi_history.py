@@ -0,0 +1,225 @@
+"""KPI の値の履歴(トレンド・スパークライン用)。
+
+:class:`~monitor_app.services.kpi_service.KpiService` が評価した値を内部メタテーブル
+``_kpi_history`` に追記する(時刻は UTC)。``(kpi_key, ts)`` の索引で期間を
+切り出し、:meth:`KpiHistory.series` が時刻バケットごとの平均(スパークライン用)と、
+期間全体の平均・直前の同じ長さの期間の平均との差を返す。元のテーブルを
+集計し直さずに「今日の OEE の推移」を描ける。
+
+カードの評価は数秒ごとに行われるが、履歴はカードごとに ``interval`` 秒に 1 行まで
+しか記録しない(既定 60 秒。20 枚でも 1 日 3 万行弱)。保持期間(``retention_days``)
+を過ぎた行は、記録のついでに 1 時間に 1 回まとめて削除する。``retention_days`` が
+0 なら何も記録しない(no-op)。
+
+テーブルは ``create=True`` のときだけ作る(``create_app(init_db=False)`` では作らない)。
+作らない設定でテーブルがなければ、起動時に :class:`RuntimeError` にする。
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+)
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..db.engine import Database
+from ..db.timebucket import time_bucket
+from ..exceptions import InvalidPayloadError, QueryExecutionError
+from ..settings.declarative import MonitorConfig
+from .series_service import bucket_seconds
+
+logger = logging.getLogger("monitor_app.kpi")
+
+#: 古い行を削除する間隔(秒)。
+PRUNE_INTERVAL = 3600.0
+
+
+def _utcnow() -> _dt.datetime:
+    # タイムゾーンなしの UTC で保存する(db.timebucket の扱いと揃える)。
+    return _dt.datetime.now(_dt.timezone.utc).replace(tzinfo=None)
+
+
+def _naive_utc(value: _dt.datetime) -> _dt.datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(_dt.timezone.utc).replace(tzinfo=None)
+
+
+def _iso(epoch: Any) -> str:
+    moment = _dt.datetime.fromtimestamp(int(epoch), _dt.timezone.utc)
+    return moment.replace(tzinfo=None).isoformat()
+
+
+class KpiHistory:
+    def __init__(
+        self,
+        config: MonitorConfig,
+        db: Database,
+        retention_days: float,
+        interval: float = 60.0,
+        create: bool = True,
+    ) -> None:
+        self.config = config
+        self.db = db
+        self.retention_days = retention_days
+        self.interval = interval
+        self.enabled = retention_days > 0
+        self._metadata = MetaData()
+        self.table = Table(
+            "_kpi_history",
+            self._metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("kpi_key", String(255), nullable=False),
+            Column("ts", DateTime, nullable=False),
+            Column("value", Float, nullable=False),
+            Index("ix__kpi_history_key_ts", "kpi_key", "ts"),
+        )
+        self._pruned = 0.0
+        #: カードごとの最後に記録した時刻(monotonic)。
+        self._recorded: Dict[str, float] = {}
+        if not self.enabled:
+            return
+        if create:
+            self._metadata.create_all(db.engine)
+        elif not inspect(db.engine).has_table(self.table.name):
+            raise RuntimeError(
+                f"KPI 履歴のテーブル '{self.table.name}' がありません。"
+                "init_db=True で起動して作成するか、MONITOR_KPI_HISTORY_DAYS=0 で"
+                "履歴を無効にしてください"
+            )
+
+    def record(self, results: Sequence[Dict[str, Any]]) -> None:
+        """評価結果を追記する。値のないもの・stale なもの(前回の値)は記録しない。
+
+        前回の記録から ``interval`` 秒たっていないカードも記録しない。
+        """
+        if not self.enabled:
+            return
+        ts = _utcnow()
+        now = time.monotonic()
+        rows = [
+            {"kpi_key": r["key"], "ts": ts, "value": r["value"]}
+            for r in results
+            if r["value"] is not None
+            and not r.get("stale")
+            and self._due(r["key"], now)
+        ]
+        if not rows:
+            return
+        try:
+            with self.db.connect() as conn:
+                conn.execute(insert(self.table), rows)
+                self._recorded.update((row["kpi_key"], now) for row in rows)
+                if time.monotonic() - self._pruned >= PRUNE_INTERVAL:
+                    self._pruned = time.monotonic()
+                    cutoff = ts - _dt.timedelta(days=self.retention_days)
+                    conn.execute(delete(self.table).where(self.table.c.ts < cutoff))
+        except SQLAlchemyError:  # 履歴の失敗で KPI の表示を止めない
+            logger.exception("KPI 履歴の記録に失敗しました")
+
+    def _due(self, key: str, now: float) -> bool:
+        last = self._recorded.get(key)
+        return last is None or now - last >= self.interval
+
+    def series(
+        self,
+        keys: Sequence[str] = (),
+        start: Optional[_dt.datetime] = None,
+        end: Optional[_dt.datetime] = None,
+        hours: float = 24.0,
+        points: int = 60,
+    ) -> Dict[str, Any]:
+        """``start`` 以上 ``end`` 未満の履歴を ``points`` 程度のバケットに間引いて返す。
+
+        ``end`` の省略時は現在、``start`` の省略時は ``end`` の ``hours`` 時間前。
+        カードごとに ``data``(``[バケット開始時刻, 平均]`` の列)、期間の平均
+        ``current``、直前の同じ長さの期間の平均 ``previous`` とその差 ``delta`` /
+        ``delta_pct``(%)を返す。
+        """
+        keys = list(keys) or list(self.config.kpis)
+        unknown = [k for k in keys if k not in self.config.kpis]
+        if unknown:
+            raise InvalidPayloadError(f"KPI {unknown} は定義されていません")
+        end = _naive_utc(end) if end is not None else _utcnow()
+        if start is None:
+            start = end - _dt.timedelta(hours=hours)
+        start = _naive_utc(start)
+        if start >= end:
+            raise InvalidPayloadError("start は end より前にしてください")
+        span = end - start
+        seconds = bucket_seconds(span.total_seconds(), points)
+
+        cards: Dict[str, Dict[str, Any]] = {
+            key: {
+                "key": key,
+                "title": self.config.kpis[key].title,
+                "data": [],
+                "current": None,
+                "previous": None,
+                "delta": None,
+                "delta_pct": None,
+            }
+            for key in keys
+        }
+        if self.enabled:
+            try:
+                with self.db.readonly() as conn:
+                    self._fill(conn, cards, start, end, seconds)
+            except SQLAlchemyError as exc:
+                raise QueryExecutionError("KPI 履歴の取得に失敗しました") from exc
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "bucket_seconds": seconds,
+            "columns": ["bucket", "value"],
+            "kpis": list(cards.values()),
+        }
+
+    def _fill(self, conn, cards, start, end, seconds) -> None:
+        t = self.table
+        in_keys = t.c.kpi_key.in_(list(cards))
+        bucket = time_bucket(t.c.ts, seconds)
+        stmt = (
+            select(t.c.kpi_key, bucket, func.avg(t.c.value))
+            .where(in_keys, t.c.ts >= start, t.c.ts < end)
+            .group_by(t.c.kpi_key, bucket)
+            .order_by(t.c.kpi_key, bucket)
+        )
+        for key, epoch, value in conn.execute(stmt):
+            cards[key]["data"].append([_iso(epoch), value])
+
+        for name, lo, hi in (
+            ("current", start, end),
+            ("previous", start - (end - start), start),
+        ):
+            stmt = (
+                select(t.c.kpi_key, func.avg(t.c.value))
+                .where(in_keys, t.c.ts >= lo, t.c.ts < hi)
+                .group_by(t.c.kpi_key)
+            )
+            for key, value in conn.execute(stmt):
+                cards[key][name] = value
+
+        for card in cards.values():
+            current, previous = card["current"], card["previous"]
+            if current is not None and previous is not None:
+                card["delta"] = current - previous
+                if previous:
+                    card["delta_pct"] = (current - previous) / abs(previous) * 100
@@ -0,0 +1,90 @@
+"""KPI カードのバックグラウンド評価。
+
+各カードを ``refresh_seconds`` ごとに評価して :class:`KpiService` の共有の結果を
+更新する。``GET /api/kpis`` と KPI ストリームはその結果を読むだけなので、閲覧者が
+何人いてもカードのクエリは期限ごとに 1 回になる。値・状態が変わったカードが
+あれば ``on_change`` を呼ぶ(KPI ハブを起こして即座に配信する)。
+
+書き込みで :meth:`KpiService.invalidate` されたカードがあれば、次の期限を待たずに
+すぐ評価し直す。
+
+FastAPI の lifespan から asyncio タスクとして起動・停止する。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import Callable, Optional
+
+from .kpi_service import KpiService
+
+logger = logging.getLogger("monitor_app.kpi")
+
+#: 期限の確認間隔の上限(秒)。アプリ外の要因で期限が変わっても、この間隔で拾う。
+MAX_WAIT = 5.0
+
+
+class KpiRefresher:
+    def __init__(
+        self,
+        service: KpiService,
+        on_change: Optional[Callable[[], None]] = None,
+        max_wait: float = MAX_WAIT,
+    ) -> None:
+        self.service = service
+        self.on_change = on_change
+        self.max_wait = max_wait
+        self.runs = 0
+        self._woken: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: asyncio.Task | None = None
+        service.add_invalidate_listener(self._on_invalidated)
+
+    def _on_invalidated(self) -> None:
+        # 書き込み側のスレッドから呼ばれる。
+        loop, woken = self._loop, self._woken
+        if loop is None or woken is None:
+            return
+        with contextlib.suppress(RuntimeError):  # 終了処理中でループが閉じている
+            loop.call_soon_threadsafe(woken.set)
+
+    async def refresh_once(self) -> list[str]:
+        """期限の来たカードを 1 回評価し、値・状態が変わったカードを返す。"""
+        changed = await asyncio.to_thread(self.service.refresh_due)
+        self.runs += 1
+        if changed and self.on_change is not None:
+            self.on_change()
+        return changed
+
+    async def _run(self) -> None:
+        logger.info("KPI refresher started (%d cards)", len(self.service.config.kpis))
+        try:
+            while True:
+                try:
+                    await self.refresh_once()
+                except Exception:  # noqa: BLE001 - 1 回の失敗で評価を止めない
+                    logger.exception("KPI の評価に失敗しました")
+                wait = min(self.service.next_due(), self.max_wait)
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._woken.wait(), max(wait, 0.05))
+                self._woken.clear()
+        except asyncio.CancelledError:
+            logger.info("KPI refresher stopped")
+            raise
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._woken = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
@@ -2,38 +2,108 @@
 
 各カードはスカラー 1 値を返す SELECT を持つ。読み取り専用接続で実行し、
 目標との比較で状態(good / bad / neutral)を付けて返す。
+
+全カードを 1 本の読み取り接続で順に評価する(接続の取得と SQLite の PRAGMA の
+切り替えは 1 回だけ)。``workers`` が 2 以上ならサーバー型 DB ではスレッドプールで
+並列に評価し、合計の待ち時間を最も遅いカード程度に抑える。
+
+各カードのクエリは ``timeout`` 秒で打ち切る。打ち切られた・失敗したカードは
+前回の値に ``stale: true`` を付けて返し、他のカードの表示を止めない。
+
+``GET /api/kpis`` と KPI ストリームは :meth:`KpiService.snapshot` の共有結果を返す。
+各カードは ``refresh_seconds``(省略時は ``refresh``)秒ごとに評価し直し、
+それまでは前回の結果を ``updated_at`` / ``age`` 付きで使い回す。評価は通常
+:class:`~monitor_app.services.kpi_refresher.KpiRefresher` がバックグラウンドで
+行うので、DB の負荷は閲覧者数ではなくカード数で決まる。依存テーブルへの
+書き込み(:meth:`KpiService.invalidate`)では期限を待たずに評価し直す。
+評価した値は ``history``(:class:`~monitor_app.services.kpi_history.KpiHistory`)に
+追記する。
 """
 
 from __future__ import annotations
 
+import datetime as _dt
 import logging
-from typing import Any, Dict, List
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
-from sqlalchemy import text
+from sqlalchemy import Connection, text
 from sqlalchemy.exc import SQLAlchemyError
 
 from ..settings.declarative import KpiCard, MonitorConfig
 from ..db.engine import Database
+from .kpi_history import KpiHistory
+from .view_service import query_tables
 
 logger = logging.getLogger("monitor_app.kpi")
 
+#: 変化の判定に使う項目(``updated_at`` / ``age`` は評価のたびに変わるので除く)。
+SIGNATURE_FIELDS = ("key", "value", "display", "status", "stale")
+
+
+def kpi_signature(result: Dict[str, Any]) -> Tuple[Any, ...]:
+    """KPI 1 件の表示内容。値・状態が同じなら同じになる。"""
+    return tuple(result.get(f) for f in SIGNATURE_FIELDS)
+
 
 class KpiService:
-    def __init__(self, config: MonitorConfig, db: Database) -> None:
+    def __init__(
+        self,
+        config: MonitorConfig,
+        db: Database,
+        workers: int = 1,
+        timeout: float = 0.0,
+        refresh: float = 10.0,
+        history: Optional[KpiHistory] = None,
+    ) -> None:
         self.config = config
         self.db = db
+        self.timeout = timeout
+        self.refresh = refresh
+        self.history = history
+        # SQLite は書き込みと同じファイルを直列に読むだけなので並列にしない。
+        self.workers = 1 if db.url.startswith("sqlite") else workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        #: カードごとの最後に取得できた結果(stale 表示用)。
+        self._last: Dict[str, Dict[str, Any]] = {}
+        #: 共有の評価結果と、その評価時刻(monotonic / UNIX 秒)。
+        self._snapshot: Dict[str, Dict[str, Any]] = {}
+        self._refreshed: Dict[str, float] = {}
+        self._updated_at: Dict[str, float] = {}
+        self._invalidated: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        #: :meth:`invalidate` でカードを無効化したときに呼ぶ(評価ループを起こす)。
+        self._invalidate_listeners: List[Callable[[], None]] = []
+        tables = list(config.tables)
+        #: カード -> 依存テーブル(:meth:`invalidate` 用)。
+        self.dependencies: Dict[str, FrozenSet[str]] = {
+            key: query_tables(card.query, tables) for key, card in config.kpis.items()
+        }
+
+    def _fetch(self, conn: Connection, card: KpiCard) -> float | None:
+        # PostgreSQL は失敗した文でトランザクション全体が使えなくなるので、
+        # カードごとにセーブポイントで囲んで後続のカードを守る。
+        guard = conn.begin_nested() if conn.dialect.name == "postgresql" else None
+        with guard or nullcontext(), self.db.statement_timeout(conn, self.timeout):
+            row = conn.execute(text(card.query)).first()
+        if row is None or row[0] is None:
+            return None
+        return float(row[0])
 
-    def _evaluate_one(self, key: str, card: KpiCard) -> Dict[str, Any]:
-        value: float | None = None
+    def _evaluate_one(
+        self, conn: Connection, key: str, card: KpiCard
+    ) -> Dict[str, Any]:
         try:
-            with self.db.readonly() as conn:
-                row = conn.execute(text(card.query)).first()
-                if row is not None and row[0] is not None:
-                    value = float(row[0])
+            value = self._fetch(conn, card)
         except (SQLAlchemyError, TypeError, ValueError):
             logger.exception("KPI '%s' の評価に失敗しました", key)
-
-        return {
+            return self._stale(key, card)
+        result = {
             "key": key,
             "title": card.title,
             "value": value,
@@ -41,7 +111,33 @@ class KpiService:
             "unit": card.unit,
             "target": card.target,
             "status": self._status(card, value),
+            "stale": False,
         }
+        self._last[key] = result
+        return result
+
+    def _stale(self, key: str, card: KpiCard) -> Dict[str, Any]:
+        """前回の結果(なければ値なし)に ``stale: true`` を付けたもの。"""
+        last = self._last.get(key)
+        if last is None:
+            last = {
+                "key": key,
+                "title": card.title,
+                "value": None,
+                "display": self._format(card, None),
+                "unit": card.unit,
+                "target": card.target,
+                "status": self._status(card, None),
+            }
+        return {**last, "stale": True}
+
+    def _evaluate_alone(self, key: str, card: KpiCard) -> Dict[str, Any]:
+        try:
+            with self.db.readonly() as conn:
+                return self._evaluate_one(conn, key, card)
+        except SQLAlchemyError:
+            logger.exception("KPI '%s' の評価に失敗しました", key)
+            return self._stale(key, card)
 
     @staticmethod
     def _format(card: KpiCard, value: float | None) -> str:
@@ -61,4 +157,141 @@ class KpiService:
         return "good" if meets else "bad"
 
     def evaluate_all(self) -> List[Dict[str, Any]]:
-        return [self._evaluate_one(key, card) for key, card in self.config.kpis.items()]
+        """全カードをいま評価する(共有の結果は更新しない)。"""
+        return self._evaluate_cards(list(self.config.kpis.items()))
+
+    def _evaluate_cards(self, cards) -> List[Dict[str, Any]]:
+        if self.workers > 1 and len(cards) > 1:
+            return self._evaluate_parallel(cards)
+        if not cards:
+            return []
+        try:
+            with self.db.readonly() as conn:
+                return [self._evaluate_one(conn, key, card) for key, card in cards]
+        except SQLAlchemyError:
+            logger.exception("KPI 評価用の接続に失敗しました")
+            return [self._stale(key, card) for key, card in cards]
+
+    def _evaluate_parallel(self, cards) -> List[Dict[str, Any]]:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="kpi")
+        futures = [self._pool.submit(self._evaluate_alone, k, c) for k, c in cards]
+        # DB 側の打ち切りが効かない場合の保険。キュー待ちの分だけ余裕を見る。
+        deadline = None
+        if self.timeout > 0:
+            rounds = math.ceil(len(cards) / self.workers)
+            deadline = time.monotonic() + self.timeout * (rounds + 1)
+        results = []
+        for (key, card), future in zip(cards, futures):
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                results.append(future.result(wait))
+            except FutureTimeoutError:
+                logger.warning("KPI '%s' の評価が時間内に終わりませんでした", key)
+                results.append(self._stale(key, card))
+        return results
+
+    # --- 共有の評価結果 ---
+
+    def ttl(self, card: KpiCard) -> float:
+        """カードを評価し直す間隔(秒)。"""
+        return card.refresh_seconds or self.refresh
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """評価し直す時期が来た(または一度も評価していない)カード。"""
+        now = time.monotonic() if now is None else now
+        return [
+            key
+            for key, card in self.config.kpis.items()
+            if now - self._refreshed.get(key, -math.inf) >= self.ttl(card)
+        ]
+
+    def next_due(self) -> float:
+        """次にいずれかのカードの期限が来るまでの秒数(カードがなければ ``refresh``)。"""
+        now = time.monotonic()
+        waits = [
+            self._refreshed.get(key, -math.inf) + self.ttl(card) - now
+            for key, card in self.config.kpis.items()
+        ]
+        return max(0.0, min(waits, default=self.refresh))
+
+    def refresh_due(self, keys: Optional[Iterable[str]] = None) -> List[str]:
+        """``keys``(省略時は期限の来たカード)を評価し、共有の結果を更新する。
+
+        値・状態が変わったカードのキーを返す。
+        """
+        with self._lock:
+            return self._refresh(self.due() if keys is None else list(keys))
+
+    def _refresh(self, keys: List[str]) -> List[str]:
+        cards = [(k, self.config.kpis[k]) for k in keys if k in self.config.kpis]
+        if not cards:
+            return []
+        started = time.monotonic()
+        results = self._evaluate_cards(cards)
+        if self.history is not None:
+            self.history.record(results)
+        now, wall = time.monotonic(), time.time()
+        changed = []
+        for (key, _card), result in zip(cards, results):
+            previous = self._snapshot.get(key)
+            if previous is None or kpi_signature(previous) != kpi_signature(result):
+                changed.append(key)
+            self._snapshot[key] = result
+            # 評価中に無効化されたカードは、書き込み前の値かもしれないので期限切れのままにする。
+            if self._invalidated.get(key, -math.inf) < started:
+                self._refreshed[key] = now
+            self._updated_at[key] = wall
+        return changed
+
+    def add_invalidate_listener(self, listener: Callable[[], None]) -> None:
+        """カードが無効化されたときに呼ぶ関数を登録する(書き込み側のスレッドで呼ばれる)。"""
+        self._invalidate_listeners.append(listener)
+
+    def invalidate(self, tables: FrozenSet[str]) -> None:
+        """``tables`` に依存するカードを次の読み出しで評価し直す(変更通知のリスナー)。"""
+        hit = False
+        for key, deps in self.dependencies.items():
+            if deps & tables:
+                self._invalidated[key] = time.monotonic()
+                self._refreshed.pop(key, None)
+                hit = True
+        if hit:
+            for listener in self._invalidate_listeners:
+                listener()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """全カードの共有の結果(``updated_at`` と ``age`` 秒付き)。
+
+        期限切れのカードはここで評価し直す(バックグラウンド評価が動いていない
+        場合の保険)。ただし他のスレッドが評価中なら待たずに前回の結果を返す。
+        一度も評価していないカードがあるときだけは評価を待つ。
+        """
+        missing = any(key not in self._snapshot for key in self.config.kpis)
+        if self._lock.acquire(blocking=missing):
+            try:
+                self._refresh(self.due())
+            finally:
+                self._lock.release()
+        wall = time.time()
+        out = []
+        for key in self.config.kpis:
+            result = self._snapshot.get(key)
+            if result is None:
+                continue
+            updated = self._updated_at[key]
+            moment = _dt.datetime.fromtimestamp(updated, _dt.timezone.utc)
+            out.append(
+                {
+                    **result,
+                    "updated_at": moment.isoformat(timespec="seconds"),
+                    "age": round(max(0.0, wall - updated), 1),
+                }
+            )
+        return out
+
+    def close(self) -> None:
+        """並列評価用のスレッドプールを止める(実行中のクエリは待たない)。"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
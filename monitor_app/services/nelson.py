@@ -0,0 +1,148 @@
+"""Nelson ルール(Western Electric ルールを含む)の逐次判定。
+
+値を 1 点ずつ :meth:`NelsonDetector.push` し、その点で成立したルール番号を得る。
+状態は連続数と直近数点の判定だけなので、1 点あたりの手間は一定。
+
+1. 1 点が 3σ を超える
+2. 9 点連続で中心線の同じ側
+3. 6 点連続で増加または減少
+4. 14 点連続で交互に増減
+5. 3 点中 2 点が同じ側の 2σ を超える
+6. 5 点中 4 点が同じ側の 1σ を超える
+7. 15 点連続で 1σ 以内
+8. 8 点連続で 1σ の外(中心線の両側にまたがる)
+
+Western Electric ルールは 1・5・6 と、2 の 8 点版にあたる。
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import deque
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from ..settings.declarative import AlertRule
+from .spc import MR_D2, SpcAccumulator
+
+
+def _sign(x: float) -> int:
+    return (x > 0) - (x < 0)
+
+
+class NelsonDetector:
+    """1 系列分の Nelson ルールの判定状態。"""
+
+    def __init__(self, rules: Iterable[int] = range(1, 9)) -> None:
+        self.rules = frozenset(rules)
+        self._prev: Optional[float] = None
+        self._side = 0  # 中心線の同じ側の連続数(上側は正、下側は負)
+        self._trend = 0  # 同じ向きの増減の連続数(増加は正、減少は負)
+        self._last_step = 0
+        self._alternating = 0  # 向きが交互に変わる増減の連続数
+        self._beyond2: deque = deque(maxlen=3)  # 各点が 2σ を超えた側(+1 / -1 / 0)
+        self._beyond1: deque = deque(maxlen=5)
+        self._inside = 0  # 1σ 以内の連続数
+        self._outside = 0  # 1σ の外の連続数
+        self._outside_sides: Set[int] = set()  # その連続に現れた側(+1 / -1)
+
+    def push(self, value: float, center: float, sigma: float) -> Set[int]:
+        """1 点を加え、この点で成立したルール番号を返す。"""
+        z = (value - center) / sigma
+        side = _sign(z)
+        fired: Set[int] = set()
+
+        if abs(z) > 3:
+            fired.add(1)
+
+        self._side = self._side + side if side and side == _sign(self._side) else side
+        if abs(self._side) >= 9:
+            fired.add(2)
+
+        if self._prev is not None:
+            step = _sign(value - self._prev)
+            same = step and step == _sign(self._trend)
+            self._trend = self._trend + step if same else step
+            if step and step == -self._last_step:
+                self._alternating += 1
+            else:
+                self._alternating = 1 if step else 0
+            self._last_step = step
+        self._prev = value
+        if abs(self._trend) >= 5:  # 6 点 = 5 回の増減
+            fired.add(3)
+        if self._alternating >= 13:  # 14 点 = 13 回の増減
+            fired.add(4)
+
+        self._beyond2.append(side if abs(z) > 2 else 0)
+        self._beyond1.append(side if abs(z) > 1 else 0)
+        if max(self._beyond2.count(1), self._beyond2.count(-1)) >= 2:
+            fired.add(5)
+        if max(self._beyond1.count(1), self._beyond1.count(-1)) >= 4:
+            fired.add(6)
+
+        self._inside = self._inside + 1 if abs(z) < 1 else 0
+        if abs(z) > 1:
+            self._outside += 1
+            self._outside_sides.add(side)
+        else:
+            self._outside = 0
+            self._outside_sides.clear()
+        if self._inside >= 15:
+            fired.add(7)
+        # 片側だけの連続はルール 2・6 にあたるので、両側に現れたときだけ成立とする。
+        if self._outside >= 8 and len(self._outside_sides) == 2:
+            fired.add(8)
+        return fired & self.rules
+
+
+class NelsonSeries:
+    """アラートルール 1 つ分の判定状態。新しい値だけを受け取って判定する。
+
+    ``center`` / ``sigma`` を省略したルールでは、最初に受け取った値で推定してから
+    判定を始め、以降は判定した値も推定(平均と平均移動範囲)に加えていく。
+    """
+
+    def __init__(self, rule: AlertRule) -> None:
+        self.rule = rule
+        self.detector = NelsonDetector(rule.rules)
+        self.last_x: Any = None
+        #: 同じルールを複数のスレッドから評価しても同じ行を 2 度判定しないためのロック。
+        self.lock = threading.Lock()
+        self._estimate = SpcAccumulator("imr")
+
+    def _params(self) -> Tuple[Optional[float], Optional[float]]:
+        limits = self._estimate.limits()
+        center = self.rule.center
+        if center is None:
+            center = limits["center"]
+        sigma = self.rule.sigma
+        if sigma is None and limits["range"]["center"] is not None:
+            sigma = limits["range"]["center"] / MR_D2
+        return center, sigma
+
+    def observe(self, values: List[Any]) -> Tuple[int, Set[int]]:
+        """値(順序どおり)を判定し、ルールが成立した点の数と成立したルールを返す。"""
+        points = []
+        for raw in values:
+            try:
+                v = float(raw)
+            except (TypeError, ValueError):
+                continue
+            if not math.isnan(v):
+                points.append(v)
+        estimating = self.rule.center is None or self.rule.sigma is None
+        if estimating and not self._estimate.spread_count:
+            self._estimate.extend(points)  # 最初の値で中心線と σ を決める
+            estimating = False
+        center, sigma = self._params()
+        flagged, fired = 0, set()
+        if center is not None and sigma:
+            for v in points:
+                hit = self.detector.push(v, center, sigma)
+                if hit:
+                    flagged += 1
+                    fired |= hit
+        if estimating:
+            self._estimate.extend(points)
+        return flagged, fired
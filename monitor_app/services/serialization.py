@@ -0,0 +1,89 @@
+"""JSON シリアライズ(API・SSE のホットパス用)。
+
+orjson が導入されていればそれを使い、なければ標準の :mod:`json` に
+フォールバックする。出力はどちらでも同じになるよう、型の扱いを揃える:
+
+- ``datetime`` / ``date`` / ``time`` は ISO 8601 文字列
+- ``Decimal`` は数値(float)
+- タプルは配列
+- NaN / ±Infinity は ``null``(JSON に表せないため。orjson の扱いに揃える)
+- 64 ビットを超える整数はそのままの数値(orjson は扱えないので、その値を含む
+  ときだけ標準の :mod:`json` で書き出す)
+- それ以外の未知の型は ``str()``
+
+同じ値は実装によらず同じバイト列になるので、``data_hash`` や ETag も変わらない。
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import math
+from decimal import Decimal
+from typing import Any
+
+try:  # 任意依存: pip install "monitor-app[fast]"
+    import orjson
+except ImportError:  # pragma: no cover - 導入状況に依存
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (_dt.datetime, _dt.date, _dt.time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def _finite(obj: Any) -> Any:
+    """NaN / ±Infinity(float・Decimal)を ``None`` に置き換えたコピー。"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, Decimal):
+        return obj if obj.is_finite() else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+def _dumps_json(obj: Any, sort_keys: bool) -> bytes:
+    def encode(value: Any, allow_nan: bool) -> bytes:
+        return json.dumps(
+            value,
+            default=_default,
+            sort_keys=sort_keys,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            allow_nan=allow_nan,
+        ).encode("utf-8")
+
+    try:
+        return encode(obj, allow_nan=False)
+    except ValueError:  # NaN / Infinity を含む(まれなので、そのときだけ置き換える)
+        return encode(_finite(obj), allow_nan=True)
+
+
+def backend() -> str:
+    """使用中の実装名("orjson" または "json")。"""
+    return "orjson" if orjson is not None else "json"
+
+
+def dumps_bytes(obj: Any, sort_keys: bool = False) -> bytes:
+    """UTF-8 の JSON バイト列にする(レスポンス本文・ハッシュ用)。"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=_default, option=option)
+        except orjson.JSONEncodeError:
+            pass  # 64 ビットを超える整数など。標準の json で書き出す
+    return _dumps_json(obj, sort_keys)
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """JSON 文字列にする(SSE の ``data`` など)。"""
+    return dumps_bytes(obj, sort_keys).decode("utf-8")
@@ -0,0 +1,272 @@
+"""時刻バケットでの集計(グラフの横軸用)。
+
+ビューまたはテーブルを時刻列のバケットで GROUP BY し、系列ごとに
+``min`` / ``max`` / ``avg`` / ``count`` / ``last`` を DB 側で計算する。SQL は
+SQLAlchemy の式で組み立て、バケット化だけを方言ごとの構文
+(:mod:`monitor_app.db.timebucket`)に任せる。
+
+範囲の条件は列を関数で包まずに比べる(時刻列の索引が効く)。文字列で保存した
+時刻は同じ書式(ISO 8601)で揃っていることを前提にする。
+
+バケット幅は表示範囲と描画幅(ピクセル)から、1 バケットがおよそ 1 ピクセルに
+なる切りのよい幅(1 秒・1 分・1 時間など)を選ぶ。
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Date, String, case, column, func, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import FromClause
+
+from ..db.engine import Database
+from ..db.registry import TableRegistry
+from ..db.timebucket import epoch_seconds, time_bucket
+from ..exceptions import (
+    InvalidPayloadError,
+    QueryExecutionError,
+    TableNotFoundError,
+    ViewNotFoundError,
+)
+from ..settings.declarative import MonitorConfig
+
+#: 使える集計関数。
+AGGREGATES = ("min", "max", "avg", "count", "last")
+#: 自動で選ぶバケット幅(秒)。これより広い場合は日単位で切り上げる。
+NICE_SECONDS = (
+    1,
+    2,
+    5,
+    10,
+    15,
+    30,
+    60,
+    120,
+    300,
+    600,
+    900,
+    1800,
+    3600,
+    7200,
+    10800,
+    21600,
+    43200,
+    86400,
+    604800,
+)
+#: 1 回の集計で返すバケット数の上限(明示したバケット幅が狭すぎる場合に拒否する)。
+MAX_BUCKETS = 10_000
+
+
+def bucket_seconds(span: float, width: int) -> int:
+    """``span`` 秒を ``width`` ピクセルに描くときのバケット幅。"""
+    target = span / max(width, 1)
+    for seconds in NICE_SECONDS:
+        if seconds >= target:
+            return seconds
+    return math.ceil(target / 86400) * 86400
+
+
+def _epoch(value: _dt.datetime) -> int:
+    # タイムゾーンなしの時刻は UTC とみなす(db.timebucket と同じ扱い)。
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=_dt.timezone.utc)
+    return int(value.timestamp())
+
+
+def _naive_utc(value: _dt.datetime) -> _dt.datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(_dt.timezone.utc).replace(tzinfo=None)
+
+
+def _ceil_date(value: _dt.datetime) -> _dt.date:
+    # 日付列との比較用。時刻があれば翌日に切り上げる(>= / < の意味を保つ)。
+    day = value.date()
+    return day if value.time() == _dt.time() else day + _dt.timedelta(days=1)
+
+
+def _text_bound(value: _dt.datetime, sample: str) -> str:
+    """``value`` を、列に入っている時刻文字列 ``sample`` と同じ書式の ISO 8601 にする。
+
+    ISO 8601 の文字列は書式が揃っていれば辞書順が時刻順になるので、列を関数で
+    包まずに比べられる(索引が効く)。日付だけの列は日付に切り上げる。
+    """
+    if len(sample) == 10:
+        return _ceil_date(value).isoformat()
+    sep = sample[10] if len(sample) > 10 and sample[10] in "T " else " "
+    return value.isoformat(sep)
+
+
+def _iso(epoch: Any) -> Optional[str]:
+    if epoch is None:
+        return None
+    moment = _dt.datetime.fromtimestamp(int(epoch), _dt.timezone.utc)
+    return moment.replace(tzinfo=None).isoformat()
+
+
+class SeriesService:
+    def __init__(
+        self, config: MonitorConfig, db: Database, registry: TableRegistry
+    ) -> None:
+        self.config = config
+        self.db = db
+        self.registry = registry
+
+    def _columns(
+        self, kind: str, name: str, x: Optional[str], y: Sequence[str]
+    ) -> Tuple[str, List[str]]:
+        """時刻列と系列の列。ビューでは省略時に ``ChartDef`` の ``x`` / ``y`` を使う。"""
+        chart = self.config.views[name].chart if kind == "view" else None
+        x = x or (chart.x if chart else None)
+        ys = list(y) or (chart.y_columns if chart else [])
+        if not x or not ys:
+            raise InvalidPayloadError("時刻列 x と集計する列 y を指定してください")
+        return x, ys
+
+    def _source(self, kind: str, name: str, x: str, ys: List[str]) -> FromClause:
+        if kind == "view":
+            vdef = self.config.views[name]
+            # ビューの SQL をサブクエリとして包む(列は実行時に DB が解決する)。
+            # 時刻は str 列に文字列で保存されるので、時刻列は String として扱い
+            # epoch_seconds に TIMESTAMP へのキャストを付けさせる。
+            cols = [column(c) for c in dict.fromkeys(ys) if c != x]
+            return text(vdef.query).columns(column(x, String), *cols).subquery("src")
+        if not self.registry.has(name):
+            raise TableNotFoundError(f"テーブル '{name}' は定義されていません")
+        table = self.registry.get(name)
+        missing = [c for c in [x, *ys] if c not in table.c]
+        if missing:
+            raise InvalidPayloadError(f"テーブル '{name}' に列 {missing} がありません")
+        return table
+
+    def aggregate(
+        self,
+        kind: str,
+        name: str,
+        x: Optional[str] = None,
+        y: Sequence[str] = (),
+        aggs: Sequence[str] = ("avg",),
+        start: Optional[_dt.datetime] = None,
+        end: Optional[_dt.datetime] = None,
+        width: int = 1000,
+        bucket: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """``kind``("view" / "table")の ``name`` を時刻バケットで集計する。
+
+        ``start`` 以上 ``end`` 未満の行が対象。省略した側はデータの最小・最大時刻。
+        ``bucket`` を省略すると範囲と ``width`` から幅を選ぶ。結果は列指向で、
+        列は ``bucket``(バケット開始時刻)と ``<列>_<集計>``。
+        """
+        if kind == "view" and name not in self.config.views:
+            raise ViewNotFoundError(f"ビュー '{name}' は定義されていません")
+        bad = [a for a in aggs if a not in AGGREGATES]
+        if bad or not aggs:
+            raise InvalidPayloadError(
+                f"集計は {', '.join(AGGREGATES)} から選んでください: {bad}"
+            )
+        x, ys = self._columns(kind, name, x, y)
+        src = self._source(kind, name, x, ys)
+        ts = src.c[x]
+
+        try:
+            with self.db.readonly() as conn:
+                filters = self._filters(conn, ts, start, end)
+                lo, hi = self._range(conn, ts, filters, start, end)
+                seconds = bucket or bucket_seconds(hi - lo, width)
+                if (hi - lo) / seconds > MAX_BUCKETS:
+                    raise InvalidPayloadError(
+                        f"バケット数が上限({MAX_BUCKETS})を超えます。"
+                        "bucket を広げてください"
+                    )
+                rows = []
+                if hi > lo:
+                    stmt = self._statement(ts, src, ys, aggs, seconds, filters)
+                    rows = conn.execute(stmt).all()
+        except SQLAlchemyError as exc:
+            raise QueryExecutionError(f"'{name}' の集計に失敗しました") from exc
+
+        columns = ["bucket"] + [f"{col}_{agg}" for col in ys for agg in aggs]
+        return {
+            "source": name,
+            "x": x,
+            "bucket_seconds": seconds,
+            "start": _iso(lo) if hi > lo else None,
+            "end": _iso(hi) if hi > lo else None,
+            "columns": columns,
+            "data": [[_iso(row[0]), *row[1:]] for row in rows],
+            "format": "columnar",
+        }
+
+    @staticmethod
+    def _filters(conn, ts, start, end) -> List[Any]:
+        """``start`` 以上 ``end`` 未満の条件。
+
+        列を関数で包むと ``ts`` の索引が使えないので、境界の方を列の型に合わせる:
+        文字列の列は列の値と同じ書式の ISO 8601 文字列、日付の列は日付、それ以外は
+        タイムゾーンなしの UTC の日時と比べる。
+        """
+        filters = [ts.isnot(None)]
+        bounds = [
+            (op, _naive_utc(value))
+            for op, value in ((ts.__ge__, start), (ts.__lt__, end))
+            if value is not None
+        ]
+        if not bounds:
+            return filters
+        if isinstance(ts.type, String):
+            sample = conn.execute(select(ts).where(ts.isnot(None)).limit(1)).scalar()
+            if sample is None:
+                return filters + [ts.is_(None)]  # 行がない
+            filters += [op(_text_bound(value, str(sample))) for op, value in bounds]
+        elif isinstance(ts.type, Date):
+            filters += [op(_ceil_date(value)) for op, value in bounds]
+        else:
+            filters += [op(value) for op, value in bounds]
+        return filters
+
+    @staticmethod
+    def _range(conn, ts, filters, start, end) -> Tuple[int, int]:
+        """集計範囲の UNIX 秒 ``[lo, hi)``。省略した側はデータの最小・最大時刻。"""
+        lo = _epoch(start) if start is not None else None
+        hi = _epoch(end) if end is not None else None
+        if lo is None or hi is None:
+            # 列の MIN / MAX を取ってから秒に直す(索引の端を読むだけで済む)。
+            stmt = select(
+                epoch_seconds(func.min(ts)), epoch_seconds(func.max(ts))
+            ).where(*filters)
+            first, last = conn.execute(stmt).one()
+            if first is None:  # 対象の行がない(空の範囲を返す)
+                edge = lo if lo is not None else (hi or 0)
+                return edge, edge
+            lo = int(first) if lo is None else lo
+            hi = int(last) + 1 if hi is None else hi
+        return lo, max(lo, hi)
+
+    @staticmethod
+    def _statement(ts, src, ys, aggs, seconds, filters):
+        inner_cols = [time_bucket(ts, seconds).label("bucket")]
+        inner_cols += [src.c[col].label(f"v{i}") for i, col in enumerate(ys)]
+        if "last" in aggs:
+            # バケット内で時刻が最も新しい行に 1 を振る(ウィンドウ関数は 3 方言とも対応)。
+            rank = func.row_number().over(
+                partition_by=time_bucket(ts, seconds), order_by=ts.desc()
+            )
+            inner_cols.append(rank.label("rn"))
+        inner = select(*inner_cols).select_from(src).where(*filters).subquery("b")
+
+        outs = [inner.c.bucket]
+        for i, col in enumerate(ys):
+            v = inner.c[f"v{i}"]
+            exprs = {
+                "min": lambda: func.min(v),
+                "max": lambda: func.max(v),
+                "avg": lambda: func.avg(v),
+                "count": lambda: func.count(v),
+                "last": lambda: func.max(case((inner.c.rn == 1, v))),
+            }
+            outs += [exprs[agg]().label(f"{col}_{agg}") for agg in aggs]
+        return select(*outs).group_by(inner.c.bucket).order_by(inner.c.bucket)
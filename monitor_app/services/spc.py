@@ -0,0 +1,230 @@
+"""SPC 管理限界の自動計算(I-MR / X̄-R)。
+
+``ChartDef(spc="imr")`` は個別値・移動範囲(I-MR)管理図、``spc="xbar_r"`` は
+``subgroup_size`` 個ずつの群の X̄-R 管理図の限界を、ビューのデータ(先頭の ``y`` 列)
+から計算する。
+
+ビューごとに :class:`SpcAccumulator` が合計と件数を持ち、前回より ``x`` が新しい行
+だけを足し込む(全件を計算し直さない)。行数が減ったり ``x`` の最大値が戻ったり
+(行の削除・置き換え)したときは、その時点の行から作り直す。``baseline`` を指定すると直近その点数
+(X̄-R は群の数)だけを基準にし、古い寄与を合計から引く。足し込みは NumPy が
+あれば塊ごとのベクトル演算、なければ純 Python で行う。
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from bisect import bisect_right
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..settings.declarative import ChartDef, MonitorConfig
+from .view_service import row_values, sort_rows
+
+try:  # 任意依存: pip install "monitor-app[fast]"
+    import numpy as np
+except ImportError:  # pragma: no cover - 導入状況に依存
+    np = None
+
+#: 群の大きさ n ごとの (A2, D3, D4)。
+XBAR_R_CONSTANTS = {
+    2: (1.880, 0.0, 3.267),
+    3: (1.023, 0.0, 2.574),
+    4: (0.729, 0.0, 2.282),
+    5: (0.577, 0.0, 2.114),
+    6: (0.483, 0.0, 2.004),
+    7: (0.419, 0.076, 1.924),
+    8: (0.373, 0.136, 1.864),
+    9: (0.337, 0.184, 1.816),
+    10: (0.308, 0.223, 1.777),
+}
+#: I-MR の係数(移動範囲は 2 点の範囲なので n = 2 の d2 = 1.128 から)。
+MR_D2 = 1.128
+E2 = 2.660
+MR_D4 = 3.267
+
+
+def _floats(values: Sequence[Any]) -> List[float]:
+    out = []
+    for v in values:
+        try:
+            f = float(v)
+        except (TypeError, ValueError):
+            continue
+        if not math.isnan(f):
+            out.append(f)
+    return out
+
+
+class SpcAccumulator:
+    """管理限界を計算するための合計と件数。新しい値を足し込んでいく。
+
+    I-MR では個別値と移動範囲、X̄-R では群平均と群範囲を「点」と「ばらつき」
+    として持つ。``baseline`` があれば両者を ``deque`` にも残し、溢れた分を
+    合計から引く。
+    """
+
+    def __init__(
+        self, method: str, subgroup_size: int = 5, baseline: Optional[int] = None
+    ) -> None:
+        self.method = method
+        self.size = subgroup_size if method == "xbar_r" else 1
+        self.baseline = baseline
+        self.count = 0  # 点(個別値 / 群)の数
+        self.total = 0.0
+        self.spread_count = 0  # 移動範囲 / 群範囲の数
+        self.spread_total = 0.0
+        self._last: Optional[float] = None  # I-MR: 直前の個別値
+        self._pending: List[float] = []  # X̄-R: まだ群になっていない値
+        self._points: deque = deque()
+        self._spreads: deque = deque()
+
+    def extend(self, values: Sequence[Any]) -> None:
+        """新しい値(``x`` の昇順)を足し込む。数値でない値は無視する。"""
+        values = _floats(values)
+        if not values:
+            return
+        if self.method == "xbar_r":
+            points, spreads = self._subgroups(values)
+        else:
+            points, spreads = self._individuals(values)
+        self._add(points, spreads)
+
+    def _individuals(self, values: List[float]) -> Tuple[Sequence, Sequence]:
+        head = [] if self._last is None else [self._last]
+        self._last = values[-1]
+        if np is not None:
+            arr = np.asarray(head + values)
+            return arr[len(head) :], np.abs(np.diff(arr))
+        chain = head + values
+        return values, [abs(b - a) for a, b in zip(chain, chain[1:])]
+
+    def _subgroups(self, values: List[float]) -> Tuple[Sequence, Sequence]:
+        values = self._pending + values
+        full = len(values) // self.size * self.size
+        self._pending = values[full:]
+        if np is not None:
+            groups = np.asarray(values[:full]).reshape(-1, self.size)
+            return groups.mean(axis=1), np.ptp(groups, axis=1)
+        groups = [values[i : i + self.size] for i in range(0, full, self.size)]
+        return [sum(g) / len(g) for g in groups], [max(g) - min(g) for g in groups]
+
+    def _add(self, points: Sequence, spreads: Sequence) -> None:
+        total = np.sum if np is not None else math.fsum
+        self.count += len(points)
+        self.total += float(total(points))
+        self.spread_count += len(spreads)
+        self.spread_total += float(total(spreads))
+        if self.baseline is None:
+            return
+        self._points.extend(map(float, points))
+        self._spreads.extend(map(float, spreads))
+        while len(self._points) > self.baseline:
+            self.total -= self._points.popleft()
+            self.count -= 1
+        while len(self._spreads) > self.baseline:
+            self.spread_total -= self._spreads.popleft()
+            self.spread_count -= 1
+
+    def limits(self) -> Dict[str, Any]:
+        """中心線と管理限界。点が足りなければ値は ``None``。
+
+        ``range`` は移動範囲(I-MR)または群範囲(X̄-R)の管理図の線。
+        """
+        out: Dict[str, Any] = {
+            "method": self.method,
+            "n": self.count,
+            "center": None,
+            "ucl": None,
+            "lcl": None,
+            "range": {"center": None, "ucl": None, "lcl": None},
+        }
+        if not self.count or not self.spread_count:
+            return out
+        center = self.total / self.count
+        spread = self.spread_total / self.spread_count
+        if self.method == "xbar_r":
+            a2, d3, d4 = XBAR_R_CONSTANTS[self.size]
+            width, r_lcl, r_ucl = a2 * spread, d3 * spread, d4 * spread
+        else:
+            width, r_lcl, r_ucl = E2 * spread, 0.0, MR_D4 * spread
+        out.update(center=center, ucl=center + width, lcl=center - width)
+        out["range"] = {"center": spread, "ucl": r_ucl, "lcl": r_lcl}
+        return out
+
+
+class _Tracker:
+    def __init__(self, chart: ChartDef) -> None:
+        self.acc = SpcAccumulator(chart.spc, chart.subgroup_size, chart.baseline)
+        self.last_x: Any = None
+        self.rows = 0  # 前回見た行数
+        self.digest: Optional[str] = None
+        self.limits = self.acc.limits()
+
+
+class SpcService:
+    """ビューごとの :class:`SpcAccumulator` を保持し、管理限界を返す。
+
+    同じ内容(``digest``)のデータに対しては前回の結果をそのまま返すので、
+    グラフ API と複数のストリーム購読者から呼ばれても足し込みは 1 回で済む。
+    """
+
+    def __init__(self, config: MonitorConfig) -> None:
+        self.config = config
+        self._trackers: Dict[str, _Tracker] = {}
+        self._lock = threading.Lock()
+
+    def chart(self, view_name: str) -> Optional[ChartDef]:
+        """SPC を計算するビューのグラフ定義(``spc`` がなければ ``None``)。"""
+        vdef = self.config.views.get(view_name)
+        chart = vdef.chart if vdef else None
+        return chart if chart is not None and chart.spc else None
+
+    def limits(
+        self, view_name: str, payload: Dict[str, Any], digest: str
+    ) -> Optional[Dict[str, Any]]:
+        """ビューの最新データで管理限界を更新して返す。SPC 対象でなければ ``None``。"""
+        chart = self.chart(view_name)
+        if chart is None:
+            return None
+        with self._lock:
+            tracker = self._trackers.get(view_name)
+            if tracker is None:
+                tracker = self._trackers[view_name] = _Tracker(chart)
+            if tracker.digest == digest:
+                return tracker.limits
+            index = sort_rows(payload, chart.x)
+            if index is not None:
+                keys, rows = index
+                if self._rewound(tracker, keys):
+                    # 行が消えた・置き換わった: 古い標本を捨てて今の行から作り直す。
+                    tracker = self._trackers[view_name] = _Tracker(chart)
+                tracker.rows = len(keys)
+                start = 0
+                if tracker.last_x is not None:
+                    try:
+                        start = bisect_right(keys, tracker.last_x)
+                    except TypeError:
+                        start = len(keys)
+                if start < len(keys):
+                    columnar = payload.get("format") == "columnar"
+                    columns = payload["columns"] if columnar else None
+                    y = chart.y_columns[0]
+                    tracker.acc.extend(list(row_values(rows[start:], y, columns)))
+                    tracker.last_x = keys[-1]
+            tracker.digest = digest
+            tracker.limits = tracker.acc.limits()
+            return tracker.limits
+
+    @staticmethod
+    def _rewound(tracker: _Tracker, keys: List[Any]) -> bool:
+        """行数が減った、または ``x`` の最大値が前回より小さくなったら True。"""
+        if tracker.last_x is None:
+            return False
+        if len(keys) < tracker.rows or not keys:
+            return True
+        try:
+            return keys[-1] < tracker.last_x
+        except TypeError:
+            return True
@@ -0,0 +1,611 @@
+"""ビュー SSE の共有ポーラー。
+
+同じビューを表示している画面が何台あっても、クエリを実行するのはビューごとに
+1 つのポーラーだけにする。ポーラーは ``refresh_interval_ms`` ごとにビューを
+取得し、内容が変わったときだけ購読者ごとのキューへ配る。最初の購読者が来た
+ときに起動し、最後の購読者が去ると停止する。
+
+``key_column`` を持つビューでは、前回との行差分(:func:`diff_rows`)も 1 回だけ
+計算してイベントに添える。差分を受け取るかどうかは購読者側が選ぶ。
+
+各 tick ではまず安価な変更トークン(依存テーブルの書き込み回数)を比べ、
+変わっていなければクエリもハッシュ計算も省く。外部プロセスの書き込みに備え、
+``max_idle`` 秒を超えたら変化がなくても再クエリする。
+
+購読者は行 dict 形式と列指向形式(``format=columnar``)を選べる。どちらの
+JSON もイベントごとに 1 回だけ、必要になったときに作る。
+
+ハブはビュー以外のリソース(KPI・アラート)にも使える。その場合は ``digest`` に
+ペイロード全体のハッシュ(:func:`payload_hash`)を渡す。複数リソースを 1 本の
+接続で配るときは :func:`merge` で購読をまとめる。
+
+:meth:`StreamHub.watch` でテーブルの変更通知(:class:`ChangeTracker`)につなぐと、
+アプリ内の書き込みで依存するポーラーを即座に起こす(push)。近接した書き込みは
+``coalesce`` 秒待ってから 1 回のクエリにまとめる。変更トークンを持つポーラーは
+通知を待つ間 ``interval`` ごとの tick をやめ、``max_idle`` ごとの再確認だけを
+行う(外部プロセスの書き込みへの保険)。
+
+イベントには ``<epoch>-<seq>`` 形式の ID が付く(epoch はポーラーの起動ごとに
+変わる)。ポーラーは差分付きのイベントを直近 ``replay`` 件だけ(行データを除いて)
+保持し、再接続したクライアントが ``Last-Event-ID`` を送れば取りこぼした差分だけを
+渡す(:meth:`StreamHub.subscribe`)。追いつけないほど離れていればスナップショットに
+戻る。最後の購読者が去っても ``linger`` 秒はポーラーを残し、短い切断からの
+再開に備える。
+
+WebSocket のように送信が詰まりうる経路では、クライアントごとに
+:class:`LatestWinsBuffer` を挟む。送れていないスナップショットはリソースごとに
+最新 1 件へ畳み込むので、遅いクライアントのメモリとラグは有界に保たれる。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import time
+from bisect import bisect_right
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import anyio
+
+from ..db.changes import ChangeTracker
+from ..exceptions import MonitorAppError
+from .serialization import dumps, dumps_bytes
+from .view_delta import delta_as_columnar, delta_as_records, diff_rows
+from .view_service import ViewService, as_columnar, as_records, sort_rows
+
+logger = logging.getLogger("monitor_app.stream")
+
+#: ビュー名を受け取り、配信用ペイロード(アラート付き)を返す同期関数。
+PayloadLoader = Callable[[str], Dict[str, Any]]
+#: ビュー名を受け取り、依存データの変更トークンを返す。``None`` は判定不能。
+ChangeToken = Callable[[str], Optional[Hashable]]
+#: ペイロードから変化検出用のハッシュを作る。
+Digest = Callable[[Dict[str, Any]], str]
+
+
+def payload_hash(payload: Dict[str, Any]) -> str:
+    """ペイロード全体のハッシュ(ビュー以外のリソース用)。"""
+    return hashlib.sha256(dumps_bytes(payload, sort_keys=True)).hexdigest()
+
+
+def parse_event_id(event_id: Optional[str], epoch: str) -> Optional[int]:
+    """``<epoch>-<seq>`` 形式の ID から seq を取り出す。epoch が違えば ``None``。"""
+    if not event_id:
+        return None
+    head, _, seq = event_id.strip().rpartition("-")
+    if head != epoch:
+        return None
+    try:
+        return int(seq)
+    except ValueError:
+        return None
+
+
+@dataclass
+class ViewEvent:
+    """ポーラーが 1 回の変化ごとに作る配信単位。全購読者で共有する。
+
+    ``delta`` は直前のイベント(``seq - 1``)からの行差分。差分で表せない
+    変化や初回は ``None``。``payload`` と ``delta`` の行はローダーが返した形式の
+    まま持ち、``encoded*`` で購読者の形式に変換する。
+    """
+
+    view: str
+    seq: int
+    payload: Dict[str, Any]
+    digest: str
+    delta: Optional[Dict[str, Any]] = None
+    #: 発行したポーラーの識別子。再接続時に seq を比べられるかの判定に使う。
+    epoch: str = ""
+    #: 作成時刻(``time.monotonic()``)。配信ラグの計測に使う。
+    created: float = field(default_factory=time.monotonic)
+    #: 列ごとの並べ替え済み索引(:meth:`rows_after` 用、必要になった列だけ作る)。
+    _sorted: Dict[str, Any] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    @property
+    def columnar(self) -> bool:
+        return self.payload.get("format") == "columnar"
+
+    @property
+    def id(self) -> str:
+        """SSE の ``id``(再接続時に ``Last-Event-ID`` として返ってくる)。"""
+        return f"{self.epoch}-{self.seq}"
+
+    @property
+    def has_snapshot(self) -> bool:
+        """行データを持つか。再送用に保持したイベントは差分しか送れない。"""
+        return "data" in self.payload
+
+    def delta_only(self) -> "ViewEvent":
+        """行データを除いたコピー(再送バッファ用。メモリを差分の分だけにする)。"""
+        payload = {k: v for k, v in self.payload.items() if k != "data"}
+        return replace(self, payload=payload)
+
+    def rows_after(
+        self, column: str, after: Any = None
+    ) -> Optional[Tuple[List[Any], Any]]:
+        """``column`` の値が ``after`` より大きい行(``column`` の昇順)とその最大値。
+
+        追記モードの購読者ごとに呼ぶ。並べ替えはイベントごとに 1 回だけ行い
+        (ORDER BY 済みの行ならほぼ線形)、購読者ごとの処理は二分探索と新しい行の
+        切り出しだけにする。列がない・値どうしを比較できないときは ``None``。
+        """
+        if column not in self._sorted:
+            self._sorted[column] = sort_rows(self.payload, column)
+        index = self._sorted[column]
+        if index is None:
+            return None
+        keys, rows = index
+        try:
+            start = 0 if after is None else bisect_right(keys, after)
+        except TypeError:
+            return None
+        return rows[start:], (keys[-1] if keys else after)
+
+    def encode_rows(self, rows: List[Any], columnar: bool) -> str:
+        """このイベントの行の一部を ``{"columns", "data"}`` の JSON にする(追記用)。"""
+        part: Dict[str, Any] = {"columns": self.payload["columns"], "data": rows}
+        if self.columnar:
+            part["format"] = "columnar"
+        return dumps(as_columnar(part) if columnar else as_records(part))
+
+    @cached_property
+    def encoded(self) -> str:
+        """SSE の ``data`` に載せる JSON。購読者数によらず 1 回だけ作る。"""
+        return dumps(as_records(self.payload))
+
+    @cached_property
+    def encoded_columnar(self) -> str:
+        return dumps(as_columnar(self.payload))
+
+    @cached_property
+    def encoded_delta(self) -> str:
+        delta = self.delta
+        if self.columnar:
+            delta = delta_as_records(delta, self.payload["columns"])
+        return dumps(delta)
+
+    @cached_property
+    def encoded_delta_columnar(self) -> str:
+        delta = self.delta
+        if not self.columnar:
+            delta = delta_as_columnar(delta, self.payload["columns"])
+        return dumps(delta)
+
+
+@dataclass(eq=False)
+class Subscriber:
+    """1 クライアント分の受信キュー。
+
+    遅いクライアントでキューが溢れたら古いイベントから捨てる。各イベントは
+    スナップショットを持つので、最新が届けば表示は正しい(差分の購読者は
+    ``seq`` の飛びを見てスナップショットに戻る)。
+    """
+
+    maxsize: int = 8
+    dropped: int = 0
+    #: 再接続したクライアントが受信済みの seq(``Last-Event-ID`` が有効な場合)。
+    resume_seq: Optional[int] = None
+    queue: asyncio.Queue = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.queue = asyncio.Queue(self.maxsize)
+
+    def offer(self, event: ViewEvent) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self) -> ViewEvent:
+        return await self.queue.get()
+
+
+class _ViewPoller:
+    def __init__(
+        self,
+        view: str,
+        loader: PayloadLoader,
+        interval: float,
+        key_column: Optional[str] = None,
+        token: Optional[ChangeToken] = None,
+        max_idle: float = 0.0,
+        digest: Digest = ViewService.data_hash,
+        push: bool = False,
+        coalesce: float = 0.0,
+        replay: int = 0,
+    ) -> None:
+        self.view = view
+        self.loader = loader
+        self.interval = interval
+        self.key_column = key_column
+        self.token = token
+        self.max_idle = max_idle
+        self.digest = digest
+        self.push = push
+        self.coalesce = coalesce
+        self.subscribers: Set[Subscriber] = set()
+        self.latest: Optional[ViewEvent] = None
+        self.ticks = 0
+        self.queries = 0
+        self.pushes = 0
+        self.epoch = f"{time.time_ns() // 1_000_000:x}"
+        #: 直近の差分付きイベント(行データなし)。seq は常に連続している。
+        self.history: deque = deque(maxlen=replay)
+        self._woken = asyncio.Event()
+        self._last_token: Optional[Hashable] = None
+        self._last_query = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            # await task だと呼び出し側自身のキャンセルまで握りつぶすので wait で待つ。
+            await asyncio.wait([self._task])
+            self._task = None
+
+    def wake(self) -> None:
+        """依存テーブルへの書き込みを受けて、次の tick を前倒しする。"""
+        self.pushes += 1
+        self._woken.set()
+
+    def _idle_wait(self) -> float:
+        # 通知で起こせるポーラーは interval ごとに tick しない。max_idle 後の
+        # 再確認(外部からの書き込み用)まで待つ。
+        if self.push and self._last_token is not None:
+            return max(self.interval, self.max_idle)
+        return self.interval
+
+    async def _sleep(self) -> None:
+        """次の tick まで待つ。通知が来たら ``coalesce`` 秒後に戻る。"""
+        try:
+            await asyncio.wait_for(self._woken.wait(), self._idle_wait())
+        except asyncio.TimeoutError:
+            return
+        if self.coalesce > 0:
+            # 直後に続く書き込み(一括投入など)を 1 回のクエリにまとめる。
+            await asyncio.sleep(self.coalesce)
+        self._woken.clear()
+
+    def backlog(
+        self, last_event_id: Optional[str], limit: int
+    ) -> Tuple[Optional[int], List[ViewEvent]]:
+        """再接続したクライアントに渡すイベントと、その受信済み seq。
+
+        取りこぼしが ``limit`` 件以内で、すべて差分で表せれば差分を返す。
+        そうでなければ最新のスナップショットだけを返す。
+        """
+        latest = self.latest
+        if latest is None:
+            return None, []
+        seq = parse_event_id(last_event_id, self.epoch)
+        if seq is None or seq > latest.seq:
+            return None, [latest]
+        if seq == latest.seq:
+            return seq, []
+        missed = [e for e in self.history if e.seq > seq]
+        if missed and missed[0].seq == seq + 1 and len(missed) <= limit:
+            return seq, missed[:-1] + [latest]
+        return seq, [latest]
+
+    def _publish(self, event: ViewEvent) -> None:
+        self.latest = event
+        if event.delta is None:
+            self.history.clear()  # 差分の連鎖が切れた
+        elif self.history.maxlen:
+            self.history.append(event.delta_only())
+        for sub in self.subscribers:
+            sub.offer(event)
+
+    def _diff(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.key_column is None or self.latest is None:
+            return None
+        delta = diff_rows(self.latest.payload, payload, self.key_column)
+        if delta is not None:
+            delta["alerts"] = payload.get("alerts", [])
+        return delta
+
+    def _unchanged(self) -> bool:
+        """前回クエリ以降、依存テーブルに書き込みがなければ True。"""
+        if self.token is None:
+            return False
+        # トークンはクエリより先に読む。クエリ中の書き込みは次の tick で拾う。
+        token = self.token(self.view)
+        now = time.monotonic()
+        fresh = now - self._last_query < self.max_idle
+        if token is not None and token == self._last_token and fresh:
+            return True
+        self._last_token = token
+        self._last_query = now
+        return False
+
+    async def _run(self) -> None:
+        seq = 0
+        failing = False
+        logger.debug("view poller started: %s", self.view)
+        try:
+            while True:
+                self.ticks += 1
+                if self._unchanged() and self.latest is not None:
+                    await self._sleep()
+                    continue
+                self.queries += 1
+                try:
+                    payload = await anyio.to_thread.run_sync(self.loader, self.view)
+                    digest = self.digest(payload)
+                    if self.latest is None or digest != self.latest.digest:
+                        delta = self._diff(payload)
+                        seq += 1
+                        self._publish(
+                            ViewEvent(
+                                self.view, seq, payload, digest, delta, self.epoch
+                            )
+                        )
+                except MonitorAppError as exc:
+                    # 一時的な DB 障害で購読者を切らない。ログは状態遷移時のみ。
+                    if not failing:
+                        logger.warning("view poller '%s': %s", self.view, exc.message)
+                    failing = True
+                    self._last_token = None  # 次の tick で再試行する
+                except Exception:  # noqa: BLE001 - 想定外の失敗でもポーラーを止めない
+                    if not failing:
+                        logger.exception("view poller '%s' failed", self.view)
+                    failing = True
+                    self._last_token = None
+                else:
+                    failing = False
+                await self._sleep()
+        except asyncio.CancelledError:
+            logger.debug("view poller stopped: %s", self.view)
+            raise
+
+
+class StreamHub:
+    """アクティブなビューごとのポーラーと、その購読者を管理する。
+
+    すべての操作はイベントループ上で行う(ロック不要)。クエリだけが
+    スレッドプールで実行される。例外は :meth:`notify` で、書き込み側の
+    スレッドから呼ばれてもよい。
+    """
+
+    def __init__(
+        self,
+        loader: PayloadLoader,
+        interval: float,
+        queue_size: int = 8,
+        key_columns: Optional[Dict[str, str]] = None,
+        token: Optional[ChangeToken] = None,
+        max_idle: float = 0.0,
+        digest: Digest = ViewService.data_hash,
+        coalesce: float = 0.0,
+        replay: int = 0,
+        linger: float = 0.0,
+    ) -> None:
+        self.loader = loader
+        self.interval = interval
+        self.queue_size = queue_size
+        self.key_columns = key_columns or {}
+        self.token = token
+        self.max_idle = max_idle
+        self.digest = digest
+        self.coalesce = coalesce
+        self.replay = replay
+        self.linger = linger
+        #: リソース名 -> 依存テーブル。:meth:`watch` で設定する。
+        self.dependencies: Dict[str, FrozenSet[str]] = {}
+        self._pollers: Dict[str, _ViewPoller] = {}
+        #: 購読者がいなくなり、停止を待っているポーラーの停止タスク。
+        self._lingering: Dict[str, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def watch(
+        self, changes: ChangeTracker, dependencies: Dict[str, FrozenSet[str]]
+    ) -> None:
+        """テーブルの変更通知を受け、依存するリソースのポーラーを起こす。"""
+        self.dependencies = dict(dependencies)
+        changes.add_listener(self._on_tables_changed)
+
+    def _on_tables_changed(self, tables: FrozenSet[str]) -> None:
+        names = [name for name, deps in self.dependencies.items() if deps & tables]
+        if names:
+            self.notify(names)
+
+    def notify(self, names: Iterable[str]) -> None:
+        """``names`` のポーラーを起こす。どのスレッドから呼んでもよい。"""
+        loop = self._loop
+        if loop is None:
+            return  # まだ誰も購読していない
+        with contextlib.suppress(RuntimeError):  # 終了処理中でループが閉じている
+            loop.call_soon_threadsafe(self._wake, list(names))
+
+    def _wake(self, names: Iterable[str]) -> None:
+        for name in names:
+            poller = self._pollers.get(name)
+            if poller is not None:
+                poller.wake()
+
+    @asynccontextmanager
+    async def subscribe(
+        self,
+        view: str,
+        last_event_id: Optional[str] = None,
+        replay: bool = False,
+    ) -> AsyncIterator[Subscriber]:
+        """ビューを購読する。抜けると購読を解除し、必要ならポーラーを止める。
+
+        ``last_event_id`` がまだ有効なら ``Subscriber.resume_seq`` に受信済みの
+        seq が入り、最新を受信済みなら何も送らない。``replay=True`` なら
+        取りこぼした差分を送る(差分を使わない購読者は最新のスナップショットだけ)。
+        """
+        self._loop = asyncio.get_running_loop()
+        lingering = self._lingering.pop(view, None)
+        if lingering is not None:
+            lingering.cancel()
+        poller = self._pollers.get(view)
+        if poller is None:
+            poller = _ViewPoller(
+                view,
+                self.loader,
+                self.interval,
+                self.key_columns.get(view),
+                self.token,
+                self.max_idle,
+                self.digest,
+                push=view in self.dependencies,
+                coalesce=self.coalesce,
+                replay=self.replay,
+            )
+            self._pollers[view] = poller
+            poller.start()
+        sub = Subscriber(self.queue_size)
+        poller.subscribers.add(sub)
+        # 途中参加のクライアントには直近のスナップショット(再接続なら取りこぼし)を
+        # 即座に渡す。再送はキューの半分までにして、直後のライブイベントで溢れさせない。
+        limit = self.queue_size // 2 if replay else 0
+        sub.resume_seq, missed = poller.backlog(last_event_id, limit)
+        for event in missed:
+            sub.offer(event)
+        try:
+            yield sub
+        finally:
+            poller.subscribers.discard(sub)
+            if not poller.subscribers and self._pollers.get(view) is poller:
+                if self.linger > 0:
+                    self._lingering[view] = asyncio.create_task(
+                        self._stop_later(view, poller)
+                    )
+                else:
+                    del self._pollers[view]
+                    await poller.stop()
+
+    async def _stop_later(self, view: str, poller: _ViewPoller) -> None:
+        await asyncio.sleep(self.linger)
+        # ここから先は中断されない(subscribe は _lingering から外れたタスクを触らない)。
+        self._lingering.pop(view, None)
+        if not poller.subscribers and self._pollers.get(view) is poller:
+            del self._pollers[view]
+            await poller.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """稼働中のポーラー数と購読者数(監視・デバッグ用)。"""
+        views = {
+            name: {
+                "subscribers": len(p.subscribers),
+                "ticks": p.ticks,
+                "queries": p.queries,
+                "pushes": p.pushes,
+                "dropped": sum(s.dropped for s in p.subscribers),
+            }
+            for name, p in self._pollers.items()
+        }
+        return {
+            "pollers": len(self._pollers),
+            "subscribers": sum(v["subscribers"] for v in views.values()),
+            "views": views,
+        }
+
+    async def close(self) -> None:
+        """全ポーラーを停止する(アプリ終了時)。"""
+        for task in self._lingering.values():
+            task.cancel()
+        self._lingering.clear()
+        pollers = list(self._pollers.values())
+        self._pollers.clear()
+        for poller in pollers:
+            await poller.stop()
+
+
+async def merge(
+    subscribers: Dict[Hashable, Subscriber],
+) -> AsyncIterator[Tuple[Hashable, ViewEvent]]:
+    """複数の購読を届いた順に 1 本にまとめ、``(キー, イベント)`` を返す。
+
+    キューは購読ごとに別なので、更新の多いリソースが他のイベントを押し出さない。
+    """
+    pending = {
+        asyncio.ensure_future(sub.get()): name for name, sub in subscribers.items()
+    }
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = pending.pop(task)
+                yield name, task.result()
+                pending[asyncio.ensure_future(subscribers[name].get())] = name
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class LatestWinsBuffer:
+    """クライアント 1 つ分の送信バッファ。リソースごとに最新のイベントだけを持つ。
+
+    送信が追いつかない間に同じリソースの新しいイベントが来たら、古い方を
+    捨てて置き換える(latest-wins)。保持数は購読リソース数で頭打ちになる。
+    送信側は :meth:`get` で取り出し、送れたら :meth:`sent` でラグを記録する。
+    """
+
+    def __init__(self, client: str = "", resources: Iterable[str] = ()) -> None:
+        self.client = client
+        self.resources = list(resources)
+        self._pending: Dict[Hashable, ViewEvent] = {}
+        self._ready = asyncio.Event()
+        self.delivered = 0
+        self.conflated = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def offer(self, key: Hashable, event: ViewEvent) -> None:
+        if key in self._pending:
+            self.conflated += 1
+        self._pending[key] = event
+        self._ready.set()
+
+    async def get(self) -> Tuple[Hashable, ViewEvent]:
+        """最も古くから待っているリソースの最新イベントを返す。"""
+        await self._ready.wait()
+        key = next(iter(self._pending))
+        event = self._pending.pop(key)
+        if not self._pending:
+            self._ready.clear()
+        return key, event
+
+    def sent(self, event: ViewEvent) -> None:
+        """イベントを送り終えたときに呼ぶ。作成から送信完了までをラグとする。"""
+        self.delivered += 1
+        self.last_lag = time.monotonic() - event.created
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client": self.client,
+            "resources": self.resources,
+            "pending": len(self._pending),
+            "delivered": self.delivered,
+            "conflated": self.conflated,
+            "lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+        }
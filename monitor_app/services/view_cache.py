@@ -0,0 +1,105 @@
+"""ビュー結果のプロセス内キャッシュ。
+
+キーはビュー名。書き込み通知(:class:`~monitor_app.db.changes.ChangeTracker`)に
+よる無効化が主で、TTL と LRU の上限は外部プロセスからの書き込みやメモリに対する
+保険として働く。同じキーへの同時要求は 1 回のクエリにまとめる(single-flight)。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+@dataclass
+class _Entry:
+    value: Any
+    stored_at: float
+
+
+@dataclass
+class _Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class ViewCache:
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int = 128,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        # 無効化の世代。読み込み中に無効化されたら結果を保存しない。
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> Any:
+        """キャッシュ済みの値を返す。なければ ``loader`` を 1 回だけ呼ぶ。
+
+        読み込み中に同じキーを要求したスレッドは、その結果(または例外)を待つ。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry.stored_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                generation = self._generations.get(key, 0)
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = loader()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        else:
+            flight.value = value
+            with self._lock:
+                if self._generations.get(key, 0) == generation:
+                    self._entries[key] = _Entry(value, self._clock())
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries) + list(self._inflight):
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
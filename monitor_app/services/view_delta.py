@@ -0,0 +1,98 @@
+"""ビューの行単位差分(SSE の delta イベント用)。
+
+:attr:`ViewDef.key_column` を行の識別子として、前回と今回の行リストから
+追加・更新・削除された行だけを求める。差分で表せない変化(列構成の変化・
+既存行の並び替え・キーの重複や欠落)のときは ``None`` を返し、呼び出し側は
+スナップショット全体を送る。
+
+行は dict でも、列指向ペイロード(``format: "columnar"``)の値の並びでもよい。
+差分の行は元のペイロードと同じ形で返る。
+"""
+
+from __future__ import annotations
+
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional
+
+_MISSING = object()
+
+
+def _index_by_key(
+    rows: List[Any], key_of: Callable[[Any], Any]
+) -> Optional[Dict[Any, int]]:
+    index: Dict[Any, int] = {}
+    for i, row in enumerate(rows):
+        k = key_of(row)
+        if k is _MISSING or k is None or k in index:
+            return None
+        index[k] = i
+    return index
+
+
+def diff_rows(
+    old: Dict[str, Any], new: Dict[str, Any], key: str
+) -> Optional[Dict[str, Any]]:
+    """2 つのビューペイロードの行差分を返す。
+
+    返り値は ``{"inserted": [{"index": i, "row": {...}}], "updated": [{...}],
+    "deleted": [key, ...]}``。``inserted`` の ``index`` は新しい行リスト上の位置で、
+    昇順に並ぶ。削除・更新を適用した後に先頭から挿入すれば新しい並びになる。
+    """
+    if old["columns"] != new["columns"] or key not in new["columns"]:
+        return None
+    if old.get("format") != new.get("format"):
+        return None
+    if new.get("format") == "columnar":
+        key_of = itemgetter(new["columns"].index(key))
+    else:
+        key_of = lambda row: row.get(key, _MISSING)
+    old_rows, new_rows = old["data"], new["data"]
+    old_index = _index_by_key(old_rows, key_of)
+    new_index = _index_by_key(new_rows, key_of)
+    if old_index is None or new_index is None:
+        return None
+
+    inserted: List[Dict[str, Any]] = []
+    updated: List[Any] = []
+    survivors: List[Any] = []
+    for i, row in enumerate(new_rows):
+        k = key_of(row)
+        j = old_index.get(k)
+        if j is None:
+            inserted.append({"index": i, "row": row})
+            continue
+        survivors.append(k)
+        if old_rows[j] != row:
+            updated.append(row)
+    old_keys = [key_of(row) for row in old_rows]
+    deleted = [k for k in old_keys if k not in new_index]
+
+    # 残った行の相対順が変わった場合(並び替え列の更新など)は差分で表さない。
+    if survivors != [k for k in old_keys if k in new_index]:
+        return None
+    # 大半が変わったならスナップショットの方が安い。
+    if len(inserted) + len(updated) > max(len(new_rows) // 2, 16):
+        return None
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
+
+
+def delta_as_records(delta: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+    """列指向の差分の行を dict にする。"""
+    out = dict(delta)
+    out["inserted"] = [
+        {"index": item["index"], "row": dict(zip(columns, item["row"]))}
+        for item in delta["inserted"]
+    ]
+    out["updated"] = [dict(zip(columns, row)) for row in delta["updated"]]
+    return out
+
+
+def delta_as_columnar(delta: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+    """dict 行の差分を列指向にする。"""
+    out = dict(delta)
+    out["inserted"] = [
+        {"index": item["index"], "row": [item["row"].get(c) for c in columns]}
+        for item in delta["inserted"]
+    ]
+    out["updated"] = [[row.get(c) for c in columns] for row in delta["updated"]]
+    return out
@@ -1,34 +1,201 @@
-"""ビュー(表示用ビュー)の実行。生 SQL を読み取り専用接続で実行する。"""
+"""ビュー(表示用ビュー)の実行。生 SQL を読み取り専用接続で実行する。
+
+:class:`ViewCache` を渡すと結果をビュー名単位でキャッシュする。各ビューが読む
+テーブル(``ViewDef.depends_on`` またはクエリ中の既知テーブル名)への書き込みが
+通知されると、該当ビューのキャッシュを捨てる。
+
+結果は列名と行タプルの列指向(``format: "columnar"``)で保持し、従来の
+``data: [{列: 値}]`` 形式は要求されたときだけ組み立てる(:func:`as_records`)。
+"""
 
 from __future__ import annotations
 
 import hashlib
-import json
-from typing import Any, Dict, List
+import re
+import threading
+import time
+from operator import itemgetter
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
 
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
-from ..exceptions import QueryExecutionError, ViewNotFoundError
-from ..settings.declarative import MonitorConfig
+from ..exceptions import QueryExecutionError, ServiceBusyError, ViewNotFoundError
+from ..settings.declarative import MonitorConfig, ViewDef
 from ..db.engine import Database
+from .serialization import dumps_bytes
+from .view_cache import ViewCache
+
+# 依存テーブル推定の前処理で取り除く、文字列リテラルとコメント。
+_STRIP = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_IDENT = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+
+
+def query_tables(query: str, tables: List[str]) -> FrozenSet[str]:
+    """クエリ中の識別子のうち ``tables`` に一致するものを返す。
+
+    列名との偶然の一致は無効化(再クエリ)が増えるだけで安全側。
+    """
+    known = {name.lower(): name for name in tables}
+    idents = _IDENT.findall(_STRIP.sub(" ", query))
+    return frozenset(known[i.lower()] for i in idents if i.lower() in known)
+
+
+def view_dependencies(vdef: ViewDef, tables: List[str]) -> FrozenSet[str]:
+    """ビューが読むテーブル名を返す。
+
+    ``depends_on`` が宣言されていればそれを使い、なければクエリから推定する
+    (:func:`query_tables`)。
+    """
+    if vdef.depends_on is not None:
+        return frozenset(vdef.depends_on)
+    return query_tables(vdef.query, tables)
+
+
+def as_records(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """列指向のペイロードを ``data: [{列: 値}]`` 形式にする(そうでなければそのまま)。"""
+    if payload.get("format") != "columnar":
+        return payload
+    columns = payload["columns"]
+    out = {k: v for k, v in payload.items() if k != "format"}
+    out["data"] = [dict(zip(columns, row)) for row in payload["data"]]
+    return out
+
+
+def as_columnar(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """``data: [{列: 値}]`` 形式のペイロードを列指向にする(そうでなければそのまま)。"""
+    if payload.get("format") == "columnar":
+        return payload
+    columns = payload["columns"]
+    out = dict(payload)
+    out["data"] = [[row.get(c) for c in columns] for row in payload["data"]]
+    out["format"] = "columnar"
+    return out
+
+
+def row_values(
+    rows: Sequence[Any], column: str, columns: Optional[List[str]] = None
+) -> Iterator[Any]:
+    """行リストから 1 列の値を取り出す。``columns`` があれば行は列順のシーケンス。"""
+    if columns is None:
+        return (row.get(column) for row in rows)
+    if column not in columns:
+        return iter(())
+    i = columns.index(column)
+    return (row[i] for row in rows)
+
+
+def sort_rows(
+    payload: Dict[str, Any], column: str
+) -> Optional[Tuple[List[Any], List[Any]]]:
+    """行を ``column`` の昇順に並べた ``(値の一覧, 行の一覧)``。値が None の行は除く。
+
+    ``bisect`` で「ある値より後の行」を切り出すための索引。ORDER BY 済みの行なら
+    並べ替えはほぼ線形。列がない・値どうしを比較できないときは ``None``。
+    """
+    columns = payload.get("columns") or []
+    if "data" not in payload or column not in columns:
+        return None
+    if payload.get("format") == "columnar":
+        value = itemgetter(columns.index(column))
+    else:
+        value = itemgetter(column)
+    pairs = [(value(row), row) for row in payload["data"]]
+    pairs = [pair for pair in pairs if pair[0] is not None]
+    try:
+        pairs.sort(key=itemgetter(0))
+    except TypeError:
+        return None
+    return [k for k, _ in pairs], [row for _, row in pairs]
 
 
 class ViewService:
-    def __init__(self, config: MonitorConfig, db: Database) -> None:
+    def __init__(
+        self,
+        config: MonitorConfig,
+        db: Database,
+        cache: Optional[ViewCache] = None,
+        export_slots: int = 0,
+        export_timeout: float = 0.0,
+    ) -> None:
         self.config = config
         self.db = db
+        self.cache = cache
+        self.export_timeout = export_timeout
+        self._export_slots = (
+            threading.BoundedSemaphore(export_slots) if export_slots else None
+        )
+        self.dependencies: Dict[str, FrozenSet[str]] = {
+            name: view_dependencies(vdef, list(config.tables))
+            for name, vdef in config.views.items()
+        }
+        # ビュー名 -> (ペイロード, data_hash)。キャッシュ済みの同じ結果を再ハッシュしない。
+        self._digests: Dict[str, Tuple[Dict[str, Any], str]] = {}
+        if cache is not None:
+            db.changes.add_listener(self._on_tables_changed)
+
+    def _on_tables_changed(self, tables: FrozenSet[str]) -> None:
+        self.cache.invalidate(
+            name for name, deps in self.dependencies.items() if deps & tables
+        )
+
+    def change_token(self, view_name: str) -> Optional[Tuple[Tuple[str, int], ...]]:
+        """依存テーブルの書き込み回数の組。変わらなければビューの結果も同じ。
 
-    def get_view(self, view_name: str) -> Dict[str, Any]:
+        依存テーブルが分からないビュー(外部テーブルのみ等)は ``None`` を返す。
+        呼び出し側は毎回再クエリすること。
+        """
+        deps = self.dependencies.get(view_name)
+        if not deps:
+            return None
+        return tuple(sorted(self.db.changes.versions(deps).items()))
+
+    def _require_view(self, view_name: str) -> None:
         if view_name not in self.config.views:
             raise ViewNotFoundError(f"ビュー '{view_name}' は定義されていません")
-        vdef = self.config.views[view_name]
 
+    def get_view(self, view_name: str, columnar: bool = False) -> Dict[str, Any]:
+        """ビューのペイロードを返す。
+
+        ``columnar=True`` なら ``data`` は行ごとの値の配列(列順は ``columns``)。
+        既定は行ごとの dict。
+        """
+        return self._shape(self._load(view_name), columnar)
+
+    def get_view_with_digest(
+        self, view_name: str, columnar: bool = False
+    ) -> Tuple[Dict[str, Any], str]:
+        """:meth:`get_view` と、その行データの :meth:`data_hash` を返す。
+
+        ハッシュは形式によらず列指向の行から作る。キャッシュから同じ結果が
+        返る間は計算し直さない(ETag 用)。
+        """
+        payload = self._load(view_name)
+        memo = self._digests.get(view_name)
+        if memo is None or memo[0] is not payload:
+            memo = (payload, self.data_hash(payload))
+            if self.cache is not None:
+                self._digests[view_name] = memo
+        return self._shape(payload, columnar), memo[1]
+
+    @staticmethod
+    def _shape(payload: Dict[str, Any], columnar: bool) -> Dict[str, Any]:
+        # 呼び出し側が alerts などを足しても共有中の値を汚さないようコピーを返す。
+        return dict(payload) if columnar else as_records(payload)
+
+    def _load(self, view_name: str) -> Dict[str, Any]:
+        self._require_view(view_name)
+        if self.cache is None:
+            return self._query(view_name)
+        return self.cache.get_or_load(view_name, lambda: self._query(view_name))
+
+    def _query(self, view_name: str) -> Dict[str, Any]:
+        vdef = self.config.views[view_name]
         try:
             with self.db.readonly() as conn:
                 result = conn.execute(text(vdef.query))
                 columns = list(result.keys())
-                rows: List[Dict[str, Any]] = [dict(r) for r in result.mappings()]
+                rows: List[Tuple[Any, ...]] = [tuple(r) for r in result]
         except SQLAlchemyError as exc:
             raise QueryExecutionError(
                 f"ビュー '{view_name}' のクエリ実行に失敗しました"
@@ -45,10 +212,57 @@ class ViewService:
             "columns": columns,
             "data": rows,
             "cell_styles": cell_styles,
+            "key_column": vdef.key_column,
+            "format": "columnar",
         }
 
+    def stream_rows(self, view_name: str, batch_size: int = 1000) -> Iterator[Any]:
+        """ビューをサーバーサイドカーソルで読み、行をバッチ単位で返す(エクスポート用)。
+
+        最初の要素は列名のリスト、以降は行(タプル互換)のリスト。最初の
+        ``next()`` でクエリを実行するので、呼び出し側はレスポンスを返す前に
+        列名を取り出し、実行エラーを HTTP エラーとして扱える。キャッシュは使わない。
+
+        読み終わるまで接続プールの接続(とトランザクション)を 1 本使い続けるので、
+        遅いクライアントがプールを使い切らないよう 2 つの上限を設ける:
+
+        - 同時に実行できるのは ``export_slots`` 本まで。空きがなければ最初の
+          ``next()`` で :class:`ServiceBusyError`(503)になる。
+        - 開始から ``export_timeout`` 秒を過ぎると、次のバッチを読む前に
+          :class:`QueryExecutionError` で打ち切る(ダウンロードは途中で切れる)。
+        """
+        self._require_view(view_name)
+        vdef = self.config.views[view_name]
+        slots = self._export_slots
+        if slots is not None and not slots.acquire(blocking=False):
+            raise ServiceBusyError(
+                "同時に実行できるエクスポートの上限に達しています。"
+                "しばらくしてから再試行してください"
+            )
+        deadline = time.monotonic() + self.export_timeout
+        try:
+            with self.db.readonly() as conn:
+                result = conn.execution_options(
+                    stream_results=True, yield_per=batch_size
+                ).execute(text(vdef.query))
+                yield list(result.keys())
+                for batch in result.partitions(batch_size):
+                    if self.export_timeout and time.monotonic() > deadline:
+                        raise QueryExecutionError(
+                            f"ビュー '{view_name}' のエクスポートが上限"
+                            f"({self.export_timeout:g} 秒)を超えたため打ち切りました"
+                        )
+                    yield batch
+        except SQLAlchemyError as exc:
+            raise QueryExecutionError(
+                f"ビュー '{view_name}' のクエリ実行に失敗しました"
+            ) from exc
+        finally:
+            if slots is not None:
+                slots.release()
+
     @staticmethod
     def data_hash(payload: Dict[str, Any]) -> str:
         """ビューデータの行内容からハッシュを作る(SSE の差分検出用)。"""
-        blob = json.dumps(payload["data"], sort_keys=True, default=str)
-        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+        blob = dumps_bytes(payload["data"], sort_keys=True)
+        return hashlib.sha256(blob).hexdigest()
@@ -58,6 +58,16 @@ class ChartDef(BaseModel):
     ucl: float | None = None  # 管理上限線(SPC)
     lcl: float | None = None  # 管理下限線(SPC)
     target: float | None = None  # 目標線
+    #: 1 系列あたりの最大点数。超えるとサーバー側で間引く(LTTB)。None で全点。
+    max_points: int | None = Field(default=None, ge=3)
+    #: ライブ表示する直近の点数。指定すると新しい行だけを受け取って追記する。
+    window: int | None = Field(default=None, ge=2)
+    #: 管理限界の自動計算(先頭の y 列)。"imr" は個別値・移動範囲、"xbar_r" は
+    #: subgroup_size 個ずつの X̄-R。計算した限界を ucl / lcl の代わりに使う。
+    spc: Literal["imr", "xbar_r"] | None = None
+    subgroup_size: int = Field(default=5, ge=2, le=10)
+    #: 管理限界の基準にする直近の点数(X̄-R は群の数)。None なら観測した全データ。
+    baseline: int | None = Field(default=None, ge=2)
 
     @property
     def y_columns(self) -> List[str]:
@@ -112,6 +122,11 @@ class ViewDef(BaseModel):
     description: str = ""
     styles: Dict[str, CellStyle] = Field(default_factory=dict)
     chart: ChartDef | None = None  # 設定するとグラフ表示になる(フェーズ2)
+    #: 行を一意に識別する列。設定すると SSE で行単位の差分(delta)を配信できる。
+    key_column: str | None = None
+    #: ビューが読むテーブル。省略時はクエリ中の既知テーブル名から推定する
+    #: (キャッシュの無効化に使う)。
+    depends_on: List[str] | None = None
 
     @model_validator(mode="after")
     def _validate_query(self) -> "ViewDef":
@@ -124,19 +139,44 @@ class ViewDef(BaseModel):
 
 
 class AlertRule(BaseModel):
-    """閾値アラートのルール(フェーズ1)。ビューの 1 列を監視する。"""
+    """アラートのルール(フェーズ1)。ビューの 1 列を監視する。
+
+    ``kind="threshold"``(既定)は ``op`` / ``value`` の閾値に違反する行を数える。
+    ``kind="nelson"`` は ``order_by`` の順に並べた値に Nelson ルール(``rules``、
+    1〜8)を適用し、連続上昇や「3 点中 2 点が 2σ 超え」などの管理外れを検出する。
+    """
 
     view: str
     column: str
-    op: Literal[">", ">=", "<", "<=", "==", "!="]
-    value: float
+    kind: Literal["threshold", "nelson"] = "threshold"
+    op: Literal[">", ">=", "<", "<=", "==", "!="] | None = None
+    value: float | None = None
     level: Literal["info", "warning", "critical"] = "warning"
     message: str = ""  # 空ならルールから自動生成
     notify: List[str] = Field(default_factory=list)  # 通知チャネル名
+    #: nelson: 行の順序を決める列。省略時はビューの chart.x。
+    order_by: str | None = None
+    #: nelson: 適用するルール番号。
+    rules: List[int] = Field(default_factory=lambda: list(range(1, 9)))
+    #: nelson: 中心線と標準偏差。省略時はデータ(平均・移動範囲)から推定する。
+    center: float | None = None
+    sigma: float | None = Field(default=None, gt=0)
+
+    @model_validator(mode="after")
+    def _validate_kind(self) -> "AlertRule":
+        if self.kind == "threshold" and (self.op is None or self.value is None):
+            raise ValueError("閾値アラートには op と value が必要です")
+        if self.kind == "nelson" and (
+            not self.rules or not set(self.rules) <= set(range(1, 9))
+        ):
+            raise ValueError("rules には 1〜8 の Nelson ルール番号を指定してください")
+        return self
 
     def describe(self) -> str:
         if self.message:
             return self.message
+        if self.kind == "nelson":
+            return f"{self.view}.{self.column} が管理外れ(Nelson ルール)"
         return f"{self.view}.{self.column} {self.op} {self.value}"
 
 
@@ -149,6 +189,8 @@ class KpiCard(BaseModel):
     target: float | None = None
     higher_is_better: bool = True
     format: str = "{:.0f}"
+    # 評価し直す間隔(秒)。省略時はダッシュボードの更新間隔。
+    refresh_seconds: float | None = Field(default=None, gt=0)
 
     @model_validator(mode="after")
     def _validate_query(self) -> "KpiCard":
@@ -176,7 +218,8 @@ class MonitorConfig(BaseModel):
     footer_text: str = "© 2026 Monitor App"
     favicon_path: str = "img/favicon.ico"
     refresh_interval_ms: int = 2000
-    refresh_mode: Literal["sse", "polling"] = "sse"
+    #: websocket は遅い回線向け(送れない間の途中スナップショットを飛ばす)。
+    refresh_mode: Literal["sse", "websocket", "polling"] = "sse"
     tables: Dict[str, TableDef] = Field(default_factory=dict)
     views: Dict[str, ViewDef] = Field(default_factory=dict)
     alerts: List[AlertRule] = Field(default_factory=list)  # フェーズ1
@@ -203,6 +246,12 @@ class MonitorConfig(BaseModel):
                 raise ValueError(
                     f"alerts[{i}]: 監視対象ビュー '{rule.view}' が views に存在しません"
                 )
+            chart = self.views[rule.view].chart
+            if rule.kind == "nelson" and not (rule.order_by or chart):
+                raise ValueError(
+                    f"alerts[{i}]: nelson ルールには order_by(またはビューの chart)が"
+                    "必要です"
+                )
         if self.kiosk:
             for v in self.kiosk.views:
                 if v not in self.views:
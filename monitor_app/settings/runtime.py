@@ -39,6 +39,47 @@ class AppSettings(BaseSettings):
     log_level: str = "INFO"
     csv_dir: Path = Path("csv")
 
+    # --- ビュー結果キャッシュ ---
+    #: キャッシュの最大保持秒数。アプリ内の書き込みでは即座に無効化されるので、
+    #: これは外部プロセスが DB に直接書く場合の反映遅れの上限になる。0 で無効。
+    view_cache_ttl: float = 5.0
+    #: キャッシュするビュー数の上限(LRU)。
+    view_cache_size: int = 128
+
+    # --- ライブ配信(SSE / WebSocket)---
+    #: アプリ内の書き込みを通知で受け、依存するビュー・KPI・アラートの配信を
+    #: 即座に更新する。無効なら refresh_interval_ms ごとのポーリングだけになる。
+    stream_push: bool = True
+    #: 書き込み通知から再クエリまでの待ち(ミリ秒)。連続した書き込みをまとめる。
+    stream_coalesce_ms: int = 20
+    #: 再接続(Last-Event-ID)で送り直せるよう、ビューごとに保持する差分の件数。
+    stream_replay_size: int = 32
+    #: 最後のクライアントが切断してからポーラーを止めるまでの秒数(再接続に備える)。
+    stream_linger: float = 30.0
+    #: SSE のハートビート(コメント行)の間隔(秒)。無通信の接続をプロキシに切らせない。
+    stream_heartbeat: int = 15
+    #: 1 メッセージの送信がこの秒数を超えたクライアントは切断する(回線断の検出)。
+    ws_send_timeout: float = 30.0
+
+    # --- KPI 評価 ---
+    #: KPI カードを並列に評価するスレッド数(サーバー型 DB 向け)。1 なら 1 本の
+    #: 接続で順に評価する。SQLite は並列にしても速くならないので常に 1 本で評価する。
+    kpi_workers: int = Field(default=1, ge=1)
+    #: KPI 1 件のクエリの上限秒数。超えたカードは前回の値を stale として返す。0 で無制限。
+    kpi_timeout: float = 5.0
+    #: 評価した KPI の値を ``_kpi_history`` に残す日数。0 なら履歴を記録しない。
+    kpi_history_days: float = Field(default=7.0, ge=0)
+    #: KPI の履歴をカードごとに記録する最短の間隔(秒)。評価のたびには記録しない。
+    kpi_history_interval: float = Field(default=60.0, ge=0)
+
+    # --- アラート評価(フェーズ1・A)---
+    #: ルールのあるビューをバックグラウンドで評価する間隔(秒)。画面を開いていなくても
+    #: 通知が届く。0 ならバックグラウンド評価をせず、ビューの表示時に評価する。
+    alert_interval: float = Field(default=5.0, ge=0)
+    #: 閾値ルールだけのビューは、行を取得せず違反数を DB 側の集計クエリで数える
+    #: (SQLite / PostgreSQL。MySQL は常に行を取得して判定する)。
+    alert_pushdown: bool = True
+
     # --- データ取り込み(フェーズ1・C)---
     #: csv/ フォルダを監視し、変更されたファイルを自動で取り込む。
     ingest_watch: bool = False
@@ -50,6 +91,16 @@ class AppSettings(BaseSettings):
     # --- 監査ログ(フェーズ4・G)---
     audit_enabled: bool = False
 
+    # --- エクスポート(フェーズ4・H)---
+    #: xlsx の 1 シートあたりのデータ行数。超えた分は「ビュー名 (2)」… の
+    #: シートに分割する。Excel の上限(1,048,575 行)を超える値は上限に丸める。
+    export_sheet_rows: int = 1_000_000
+    #: 同時に実行できるエクスポートの数。エクスポートはダウンロードの間ずっと
+    #: 接続プールの接続を 1 本使うので、超えた要求は 503 で断る。0 で無制限。
+    export_concurrency: int = Field(default=4, ge=0)
+    #: 1 回のエクスポートで接続を使い続けられる秒数。超えたら打ち切る(0 で無制限)。
+    export_timeout: float = Field(default=600.0, ge=0)
+
     # --- 通知チャネル(フェーズ1・A)。未設定のチャネルは無効 ---
     webhook_url: str | None = None  # Slack/Teams/汎用 JSON POST
     line_token: str | None = None  # LINE Notify トークン
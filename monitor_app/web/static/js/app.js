@@ -1,6 +1,10 @@
 // ビュー表示用のバニラ JavaScript(フレームワーク非依存)。
 // API からデータを取得して <table> を描画する。
 // SSE(差分配信)を優先し、使えない/切れた場合はポーリングにフォールバックする。
+// refresh_mode="websocket" なら /api/ws で同じ内容を受け取る(遅い回線では途中の
+// スナップショットが飛ばされ、最新だけが届く)。
+// ビューに key_column があれば SSE は行単位の差分(delta イベント)で届き、
+// 変わった行の <tr> だけを差し替える。
 //
 // 依存する DOM(table.html が用意する。id を変えるなら両方直すこと):
 //   #app-data[data-view-name|data-refresh-interval|data-refresh-mode] … 設定の受け取り口
@@ -8,11 +12,16 @@
 //   #status / #status-text              … 接続状態インジケータ(class を live/error に変える)
 //   #thead-row / #tbody                 … テーブルの見出し行 / データ行の挿入先
 //
-// 消費する API ペイロード(GET /api/views/<name> と SSE が返す JSON):
-//   { title, columns: string[], data: object[],
+// 消費する API ペイロード(GET /api/views/<name>?format=columnar と SSE が返す JSON):
+//   { title, columns: string[], data: any[][], format: "columnar",
+//     key_column: string|null,
 //     cell_styles: { <col>: { greater_than|less_than|equal_to: {value, class},
 //                             width, font_size, align, bold } } }
+//   data の各行は columns と同じ順の値の配列(列名を繰り返さない列指向形式)。
 //   cell_styles のルールは config.py の CellStyle に対応する。
+//
+// SSE の delta イベント(?delta=1 のとき、スナップショットの後に届く):
+//   { inserted: [{index, row}], updated: any[][], deleted: key[], alerts }
 
 (function () {
   "use strict";
@@ -41,12 +50,21 @@
   const chartCfgEl = document.getElementById("chart-config");
   const canvasEl = document.getElementById("chart");
   if (chartCfgEl && canvasEl && window.MonitorChart) {
-    chart = window.MonitorChart.create(canvasEl, JSON.parse(chartCfgEl.textContent));
+    const chartCfg = JSON.parse(chartCfgEl.textContent);
+    const base = "/api/views/" + encodeURIComponent(viewName);
+    chart = window.MonitorChart.create(canvasEl, chartCfg, base + "/chart");
+    // window 指定のグラフは新しい行だけを追記する専用ストリームで更新する。
+    if (chartCfg.window && mode !== "polling") {
+      chart.live(base + "/stream?append=1&format=columnar");
+    }
   }
 
   let columns = [];
   let pollTimer = null;
-  let source = null;
+  let source = null; // EventSource または WebSocket
+  let current = null; // 最後に描画したペイロード(data は delta で更新する)
+  let rowEls = []; // current.data と同じ順の <tr>
+  let etag = null; // ポーリングで最後に受け取った ETag
 
   function setStatus(state, text) {
     statusEl.className = "status" + (state ? " " + state : "");
@@ -81,8 +99,24 @@
     });
   }
 
+  function renderRow(row, cols, cellStyles) {
+    const tr = document.createElement("tr");
+    cols.forEach(function (col, i) {
+      const td = document.createElement("td");
+      const value = row[i];
+      td.textContent = value === null || value === undefined ? "" : value;
+      const rules = cellStyles[col];
+      const cls = cellClass(value, rules);
+      if (cls) td.className = cls;
+      applyCellStyle(td, rules);
+      tr.appendChild(td);
+    });
+    return tr;
+  }
+
   function renderBody(rows, cols, cellStyles) {
     const frag = document.createDocumentFragment();
+    rowEls = [];
     if (rows.length === 0) {
       const tr = document.createElement("tr");
       const td = document.createElement("td");
@@ -93,17 +127,8 @@
       frag.appendChild(tr);
     } else {
       rows.forEach(function (row) {
-        const tr = document.createElement("tr");
-        cols.forEach(function (col) {
-          const td = document.createElement("td");
-          const value = row[col];
-          td.textContent = value === null || value === undefined ? "" : value;
-          const rules = cellStyles[col];
-          const cls = cellClass(value, rules);
-          if (cls) td.className = cls;
-          applyCellStyle(td, rules);
-          tr.appendChild(td);
-        });
+        const tr = renderRow(row, cols, cellStyles);
+        rowEls.push(tr);
         frag.appendChild(tr);
       });
     }
@@ -111,6 +136,7 @@
   }
 
   function render(payload) {
+    current = payload;
     if (payload.title) titleEl.textContent = payload.title;
     const cols = payload.columns || [];
     if (cols.join("|") !== columns.join("|")) {
@@ -123,10 +149,68 @@
     setStatus("live", "更新中");
   }
 
+  // 行差分を current.data と <tr> に適用する。削除・更新を先に行い、
+  // 追加行は新しい並びでの位置(index 昇順)に差し込む。
+  function applyDelta(delta) {
+    if (!current || !current.key_column) return;
+    const key = columns.indexOf(current.key_column);
+    if (key < 0) return;
+    const styles = current.cell_styles || {};
+    const gone = new Set(delta.deleted || []);
+    const changed = new Map();
+    (delta.updated || []).forEach(function (row) {
+      changed.set(row[key], row);
+    });
+
+    const rows = [];
+    const els = [];
+    current.data.forEach(function (row, i) {
+      const k = row[key];
+      if (gone.has(k)) {
+        rowEls[i].remove();
+      } else if (changed.has(k)) {
+        const tr = renderRow(changed.get(k), columns, styles);
+        rowEls[i].replaceWith(tr);
+        rows.push(changed.get(k));
+        els.push(tr);
+      } else {
+        rows.push(row);
+        els.push(rowEls[i]);
+      }
+    });
+    (delta.inserted || []).forEach(function (item) {
+      const tr = renderRow(item.row, columns, styles);
+      tbody.insertBefore(tr, els[item.index] || null);
+      rows.splice(item.index, 0, item.row);
+      els.splice(item.index, 0, tr);
+    });
+
+    current.data = rows;
+    current.alerts = delta.alerts;
+    rowEls = els;
+    // 空表示の行との切り替えは全体描画に任せる。
+    if (rows.length === 0 || tbody.querySelector("td.empty")) {
+      renderBody(rows, columns, styles);
+    }
+    alertUi.update(current.alerts);
+    chart.update(current);
+    setStatus("live", "更新中");
+  }
+
   async function fetchOnce() {
     try {
-      const res = await fetch("/api/views/" + encodeURIComponent(viewName));
+      // 前回の ETag を送り、変化がなければ 304(本文なし・再描画なし)。
+      const url = "/api/views/" + encodeURIComponent(viewName) + "?format=columnar";
+      const res = await fetch(url, {
+        headers: etag ? { "If-None-Match": etag } : {},
+        cache: "no-store",
+      });
+      if (res.status === 304) {
+        setStatus("live", "更新中");
+        return;
+      }
       if (!res.ok) throw new Error("HTTP " + res.status);
+      etag = res.headers.get("ETag");
       render(await res.json());
     } catch (e) {
       setStatus("error", "取得に失敗しました");
@@ -140,16 +224,47 @@
   }
 
   function startSse() {
-    source = new EventSource("/api/views/" + encodeURIComponent(viewName) + "/stream");
+    source = new EventSource(
+      "/api/views/" + encodeURIComponent(viewName) + "/stream?delta=1&format=columnar"
+    );
     source.onmessage = function (ev) {
       render(JSON.parse(ev.data));
     };
+    source.addEventListener("delta", function (ev) {
+      applyDelta(JSON.parse(ev.data));
+    });
+    source.onopen = function () {
+      setStatus("live", "更新中");
+    };
     source.onerror = function () {
-      // SSE が使えない/切れた場合はポーリングへフォールバック
-      source.close();
+      // 一時的な切断はブラウザが Last-Event-ID 付きで自動再接続し、取りこぼした
+      // 差分だけを受け取る。接続自体を拒否された(CLOSED)ときだけポーリングへ。
+      if (source.readyState !== EventSource.CLOSED) {
+        setStatus("error", "再接続中…");
+        return;
+      }
+      source = null;
+      startPolling();
+    };
+  }
+
+  // メッセージは { type: "view" | "delta", data }。閉じたらポーリングへフォールバック。
+  function startWebSocket() {
+    const proto = location.protocol === "https:" ? "wss:" : "ws:";
+    const ws = new WebSocket(
+      proto + "//" + location.host + "/api/ws?delta=1&format=columnar&views=" +
+        encodeURIComponent(viewName)
+    );
+    ws.onmessage = function (ev) {
+      const msg = JSON.parse(ev.data);
+      if (msg.type === "view") render(msg.data);
+      else if (msg.type === "delta") applyDelta(msg.data);
+    };
+    ws.onclose = function () {
       source = null;
       startPolling();
     };
+    source = ws;
   }
 
   window.addEventListener("beforeunload", function () {
@@ -159,6 +274,8 @@
 
   if (mode === "sse" && "EventSource" in window) {
     startSse();
+  } else if (mode === "websocket" && "WebSocket" in window) {
+    startWebSocket();
   } else {
     startPolling();
   }
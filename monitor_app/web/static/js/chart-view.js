@@ -3,11 +3,24 @@
 //
 // chartConfig(config.py の ChartDef に対応):
 //   { type: "line"|"bar", x: string, y: string|string[],
-//     ucl: number|null, lcl: number|null, target: number|null }
+//     ucl: number|null, lcl: number|null, target: number|null,
+//     max_points: number|null, window: number|null, spc: "imr"|"xbar_r"|null }
 //
 // 使い方:
-//   const chart = MonitorChart.create(canvasEl, chartConfig);
+//   const chart = MonitorChart.create(canvasEl, chartConfig, chartUrl);
 //   chart.update(payload);   // payload は /api/views/<v> のレスポンス
+//                            // (行 dict 形式・format: "columnar" のどちらでもよい)
+//
+// chartConfig.max_points か spc があり chartUrl(/api/views/<v>/chart)が渡された場合は、
+// update() のたびに payload の代わりにサーバー側で間引いたデータを取得して描く。
+//
+// chartConfig.window があれば直近 window 点だけを表示する。chart.live(streamUrl)
+// (/api/views/<v>/stream?append=1)を呼ぶと、初回のスナップショットの後は新しい行
+// (append イベント)だけを既存のデータセットに追記し、古い点を先頭から捨てる。
+// 1 回の更新の手間は新しい点の数に比例する。live 中は update() を無視する。
+//
+// chartConfig.spc があれば管理限界はサーバーが計算する(/chart の limits、live では
+// limits イベント)。届いた限界で UCL / LCL と中心線(CL)を引き直す。
 
 (function () {
   "use strict";
@@ -32,43 +45,73 @@
     };
   }
 
-  function create(canvas, cfg) {
+  // 行から列の値を取り出す関数。列指向なら列の位置で引く。
+  function getter(payload, col) {
+    if (payload.format !== "columnar") return function (r) { return r[col]; };
+    const i = (payload.columns || []).indexOf(col);
+    return function (r) { return i < 0 ? undefined : r[i]; };
+  }
+
+  function create(canvas, cfg, url) {
     const ycols = asArray(cfg.y);
     let chart = null;
+    let etag = null;
+    let inflight = false;
+    let dirty = false;
+    let stream = null; // live() の EventSource
+    let limits = null; // サーバーが計算した SPC の管理限界
+
+    // 管理限界(計算済みがあればそちら、なければ設定値)。
+    function limit(key) {
+      return limits && limits[key] != null ? limits[key] : cfg[key];
+    }
+
+    // 管理限界を外れた点を赤く強調する。
+    function pointColor(v, color) {
+      const n = parseFloat(v);
+      const ucl = limit("ucl");
+      const lcl = limit("lcl");
+      if (ucl != null && n > ucl) return "#ef4444";
+      if (lcl != null && n < lcl) return "#ef4444";
+      return color;
+    }
+
+    function limitLines(length) {
+      const lines = [];
+      if (limit("ucl") != null) lines.push(constLine("UCL", limit("ucl"), "#ef4444", length));
+      if (limit("lcl") != null) lines.push(constLine("LCL", limit("lcl"), "#ef4444", length));
+      if (limits && limits.center != null)
+        lines.push(constLine("CL", limits.center, "#16a34a", length));
+      if (cfg.target != null) lines.push(constLine("目標", cfg.target, "#64748b", length));
+      return lines;
+    }
 
     function build(payload) {
-      const rows = payload.data || [];
-      const labels = rows.map(function (r) { return r[cfg.x]; });
+      if (payload.limits !== undefined) limits = payload.limits;
+      let rows = payload.data || [];
+      if (cfg.window) rows = rows.slice(-cfg.window);
+      const labels = rows.map(getter(payload, cfg.x));
 
       const datasets = ycols.map(function (col, i) {
         const color = PALETTE[i % PALETTE.length];
-        const values = rows.map(function (r) { return r[col]; });
+        const values = rows.map(getter(payload, col));
         return {
           label: col,
           data: values,
           borderColor: color,
           backgroundColor: color,
           tension: 0.2,
-          // 管理限界を外れた点を赤く強調(単一系列のときのみ)
           pointBackgroundColor: values.map(function (v) {
-            const n = parseFloat(v);
-            if (cfg.ucl != null && n > cfg.ucl) return "#ef4444";
-            if (cfg.lcl != null && n < cfg.lcl) return "#ef4444";
-            return color;
+            return pointColor(v, color);
           }),
           pointRadius: cfg.type === "line" ? 3 : 0,
         };
       });
 
-      if (cfg.ucl != null) datasets.push(constLine("UCL", cfg.ucl, "#ef4444", labels.length));
-      if (cfg.lcl != null) datasets.push(constLine("LCL", cfg.lcl, "#ef4444", labels.length));
-      if (cfg.target != null)
-        datasets.push(constLine("目標", cfg.target, "#64748b", labels.length));
-
-      return { labels: labels, datasets: datasets };
+      return { labels: labels, datasets: datasets.concat(limitLines(labels.length)) };
     }
 
-    function update(payload) {
+    function draw(payload) {
       const data = build(payload);
       if (!chart) {
         chart = new Chart(canvas.getContext("2d"), {
@@ -88,7 +131,107 @@
       }
     }
 
-    return { update: update };
+    // 間引き済みデータを取得する。取得中に更新が来たら、終わってからもう一度取る。
+    function fetchSampled() {
+      if (inflight) {
+        dirty = true;
+        return;
+      }
+      inflight = true;
+      const headers = etag ? { "If-None-Match": etag } : {};
+      fetch(url, { headers: headers, cache: "no-store" })
+        .then(function (res) {
+          if (res.status === 304 || !res.ok) return null;
+          etag = res.headers.get("ETag");
+          return res.json();
+        })
+        .then(function (payload) {
+          if (payload) draw(payload);
+        })
+        .catch(function () {})
+        .then(function () {
+          inflight = false;
+          if (dirty) {
+            dirty = false;
+            fetchSampled();
+          }
+        });
+    }
+
+    // 新しい行を末尾に足し、window を超えた分を先頭から捨てる。
+    function append(payload) {
+      if (!chart) return;
+      const data = chart.data;
+      const xOf = getter(payload, cfg.x);
+      const yOf = ycols.map(function (col) {
+        return getter(payload, col);
+      });
+      (payload.data || []).forEach(function (row) {
+        data.labels.push(xOf(row));
+        data.datasets.forEach(function (ds, i) {
+          if (i < ycols.length) {
+            const v = yOf[i](row);
+            ds.data.push(v);
+            ds.pointBackgroundColor.push(pointColor(v, ds.borderColor));
+          } else {
+            ds.data.push(ds.data[0]); // UCL / LCL / 目標の水平線
+          }
+        });
+      });
+      const extra = cfg.window ? data.labels.length - cfg.window : 0;
+      if (extra > 0) {
+        data.labels.splice(0, extra);
+        data.datasets.forEach(function (ds) {
+          ds.data.splice(0, extra);
+          if (Array.isArray(ds.pointBackgroundColor)) ds.pointBackgroundColor.splice(0, extra);
+        });
+      }
+      chart.update("none");
+    }
+
+    // 管理限界が変わったら水平線と点の色を引き直す。
+    function applyLimits(next) {
+      limits = next;
+      if (!chart) return;
+      const series = chart.data.datasets.slice(0, ycols.length);
+      series.forEach(function (ds) {
+        ds.pointBackgroundColor = ds.data.map(function (v) {
+          return pointColor(v, ds.borderColor);
+        });
+      });
+      chart.data.datasets = series.concat(limitLines(chart.data.labels.length));
+      chart.update("none");
+    }
+
+    // 追記モードの SSE を購読する。拒否された(CLOSED)ら update() での描画に戻る。
+    function live(streamUrl) {
+      if (!("EventSource" in window)) return false;
+      stream = new EventSource(streamUrl);
+      stream.onmessage = function (ev) {
+        draw(JSON.parse(ev.data));
+      };
+      stream.addEventListener("append", function (ev) {
+        append(JSON.parse(ev.data));
+      });
+      stream.addEventListener("limits", function (ev) {
+        applyLimits(JSON.parse(ev.data));
+      });
+      stream.onerror = function () {
+        if (stream.readyState === EventSource.CLOSED) stream = null;
+      };
+      window.addEventListener("beforeunload", function () {
+        if (stream) stream.close();
+      });
+      return true;
+    }
+
+    function update(payload) {
+      if (stream) return;
+      if (url && (cfg.max_points || cfg.spc)) fetchSampled();
+      else draw(payload);
+    }
+
+    return { update: update, live: live };
   }
 
   window.MonitorChart = { create: create };
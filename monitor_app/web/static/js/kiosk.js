@@ -2,6 +2,10 @@
 // 複数ビューを一定間隔で自動ローテーションし、各ビューのデータと全体ステータスを表示する。
 // アラート発生中はローテーションを止め、該当ビューに固定して強調する。
 //
+// データは多重化 SSE(/api/stream?views=...&alerts=1&format=columnar)で全ビュー分を
+// 受け取り続けるので、ローテーション時は手元の最新データを即座に表示できる。
+// SSE が使えない/切れた場合は現在ビューのポーリング(ETag 付き)にフォールバックする。
+//
 // 依存する DOM(kiosk.html):
 //   #kiosk[data-views|data-rotate-seconds|data-refresh-interval]
 //   #kiosk-title #kiosk-clock #status-light #alert-banner
@@ -28,6 +32,10 @@
   let current = 0;
   let pinned = false; // アラートで固定中か
   let columns = [];
+  const latest = {}; // ビュー名 -> 最新ペイロード(列指向)
+  const etags = {}; // ビュー名 -> ポーリングで受け取った ETag
+  let source = null;
+  let pollTimer = null;
 
   // 下部のローテーションドットを構築
   views.forEach(function (_v, i) {
@@ -63,10 +71,10 @@
     const frag = document.createDocumentFragment();
     (payload.data || []).forEach(function (row) {
       const tr = document.createElement("tr");
-      cols.forEach(function (col) {
+      cols.forEach(function (col, i) {
         const td = document.createElement("td");
         const styles = (payload.cell_styles || {})[col];
-        const value = row[col];
+        const value = row[i];
         td.textContent = value === null || value === undefined ? "" : value;
         if (styles) applyStyle(td, value, styles);
         tr.appendChild(td);
@@ -87,30 +95,80 @@
     if (rules.bold) td.style.fontWeight = "bold";
   }
 
+  function show(name, payload) {
+    titleEl.textContent = payload.title || name;
+    renderTable(payload);
+    markDot();
+  }
+
+  function applyAlerts(alerts) {
+    alertUi.update(alerts);
+    // critical があれば現在のビューに固定。なければローテーション再開。
+    pinned = setLight(alerts) === "critical";
+  }
+
+  function showCurrent() {
+    const name = views[current];
+    if (latest[name]) show(name, latest[name]);
+    // ポーリング中は最新を取り直す。ストリーム接続中で未着なら届いた時点で描画される。
+    if (!source) loadCurrent();
+  }
+
+  // ポーリング時の取得。変化がなければ 304 で手元のデータを使う。
   async function loadCurrent() {
     const name = views[current];
     if (!name) return;
     try {
-      const res = await fetch("/api/views/" + encodeURIComponent(name));
-      if (!res.ok) throw new Error("HTTP " + res.status);
-      const payload = await res.json();
-      titleEl.textContent = payload.title || name;
-      renderTable(payload);
-      const alerts = payload.alerts || [];
-      alertUi.update(alerts);
-      const level = setLight(alerts);
-      // critical のビューがあればそこに固定。なければローテーション再開。
-      pinned = level === "critical";
-      markDot();
+      const url = "/api/views/" + encodeURIComponent(name) + "?format=columnar";
+      const res = await fetch(url, {
+        headers: etags[name] && latest[name] ? { "If-None-Match": etags[name] } : {},
+        cache: "no-store",
+      });
+      if (res.status !== 304) {
+        if (!res.ok) throw new Error("HTTP " + res.status);
+        latest[name] = await res.json();
+        etags[name] = res.headers.get("ETag");
+      }
+      show(name, latest[name]);
+      applyAlerts(latest[name].alerts || []);
     } catch (e) {
       lightEl.className = "status-light";
     }
   }
 
+  function startPolling() {
+    if (pollTimer) return;
+    loadCurrent();
+    pollTimer = setInterval(loadCurrent, refreshMs); // 現在ビューのデータ更新
+  }
+
+  function startStream() {
+    if (!window.EventSource) return false;
+    source = new EventSource(
+      "/api/stream?alerts=1&format=columnar&views=" +
+        views.map(encodeURIComponent).join(",")
+    );
+    source.addEventListener("view", function (ev) {
+      const payload = JSON.parse(ev.data);
+      latest[payload.view_name] = payload;
+      if (payload.view_name === views[current]) show(payload.view_name, payload);
+    });
+    source.addEventListener("alerts", function (ev) {
+      applyAlerts(JSON.parse(ev.data).alerts || []);
+    });
+    source.onerror = function () {
+      // 一時的な切断は自動再接続に任せる(Last-Event-ID で変化分だけ届く)。
+      if (source.readyState !== EventSource.CLOSED) return;
+      source = null;
+      startPolling();
+    };
+    return true;
+  }
+
   function rotate() {
     if (pinned || views.length <= 1) return;
     current = (current + 1) % views.length;
-    loadCurrent();
+    showCurrent();
   }
 
   function tickClock() {
@@ -125,7 +183,7 @@
 
   tickClock();
   setInterval(tickClock, 1000);
-  loadCurrent();
-  setInterval(loadCurrent, refreshMs); // 現在ビューのデータ更新
+  markDot();
+  if (!startStream()) startPolling();
   setInterval(rotate, rotateMs); // ビュー切替
 })();
@@ -1,7 +1,14 @@
 // KPIサマリーカードの描画(フェーズ2・E)。
-// /api/kpis を取得して #kpi-grid にカードを並べる。一定間隔で更新する。
+// /api/stream?kpis=1(SSE)で変化のたびに受け取り、#kpi-grid にカードを並べる。
+// SSE が使えない/切れた場合は /api/kpis を一定間隔でポーリングする。
 //
-// KPI 1 件の形: { key, title, value, display, unit, target, status }
+// KPI 1 件の形: { key, title, value, display, unit, target, status, stale,
+//                 updated_at, age }
+// stale はクエリが時間内に終わらなかった・失敗したため前回の値を表示していること。
+// サーバーは値・状態が変わったときだけ送るので、表示が変わったカードだけを作り直す。
+//
+// 直近の推移は /api/kpis/history(間引き済みの履歴)を 1 分ごとに取得し、
+// カードにスパークラインと前の期間からの増減(%)を添える。
 
 (function () {
   "use strict";
@@ -9,49 +16,156 @@
   const grid = document.getElementById("kpi-grid");
   if (!grid) return;
   const interval = parseInt(grid.dataset.refreshInterval || "5000", 10);
+  let etag = null;
+  let pollTimer = null;
+  const shown = new Map(); // key -> { sig, el }
+  const trends = new Map(); // key -> /api/kpis/history のカード
+  const HISTORY_MS = 60000;
+  let latest = [];
+
+  function signature(k) {
+    const t = trends.get(k.key);
+    const trend = t ? JSON.stringify([t.data, t.delta_pct]) : "";
+    return [k.title, k.display, k.unit, k.target, k.status, k.stale, trend].join(
+      "\u0000"
+    );
+  }
 
   function render(kpis) {
-    grid.replaceChildren();
-    kpis.forEach(function (k) {
-      const card = document.createElement("div");
-      card.className = "kpi-card " + (k.status || "neutral");
-
-      const title = document.createElement("div");
-      title.className = "kpi-title";
-      title.textContent = k.title;
-
-      const value = document.createElement("div");
-      value.className = "kpi-value";
-      value.textContent = k.display;
-      if (k.unit) {
-        const unit = document.createElement("span");
-        unit.className = "kpi-unit";
-        unit.textContent = k.unit;
-        value.appendChild(unit);
-      }
+    latest = kpis;
+    const cards = kpis.map(function (k) {
+      const sig = signature(k);
+      const prev = shown.get(k.key);
+      const el = prev && prev.sig === sig ? prev.el : build(k);
+      shown.set(k.key, { sig: sig, el: el });
+      return el;
+    });
+    const keys = new Set(kpis.map(function (k) { return k.key; }));
+    shown.forEach(function (_v, key) {
+      if (!keys.has(key)) shown.delete(key);
+    });
+    // 並びが同じで作り直したカードもなければ DOM に触れない。
+    const same =
+      cards.length === grid.children.length &&
+      cards.every(function (el, i) { return grid.children[i] === el; });
+    if (!same) grid.replaceChildren.apply(grid, cards);
+  }
 
-      card.appendChild(title);
-      card.appendChild(value);
-      if (k.target != null) {
-        const target = document.createElement("div");
-        target.className = "kpi-title";
-        target.textContent = "目標 " + k.target;
-        card.appendChild(target);
+  function build(k) {
+    const card = document.createElement("div");
+    card.className = "kpi-card " + (k.status || "neutral") + (k.stale ? " stale" : "");
+    if (k.stale) card.title = "更新できませんでした(前回の値を表示中)";
+
+    const title = document.createElement("div");
+    title.className = "kpi-title";
+    title.textContent = k.title;
+
+    const value = document.createElement("div");
+    value.className = "kpi-value";
+    value.textContent = k.display;
+    if (k.unit) {
+      const unit = document.createElement("span");
+      unit.className = "kpi-unit";
+      unit.textContent = k.unit;
+      value.appendChild(unit);
+    }
+
+    card.appendChild(title);
+    card.appendChild(value);
+    if (k.target != null) {
+      const target = document.createElement("div");
+      target.className = "kpi-title";
+      target.textContent = "目標 " + k.target;
+      card.appendChild(target);
+    }
+    const t = trends.get(k.key);
+    if (t) {
+      if (t.delta_pct != null) {
+        const delta = document.createElement("div");
+        delta.className = "kpi-title";
+        const pct = t.delta_pct;
+        delta.textContent =
+          "前期間比 " + (pct > 0 ? "+" : "") + pct.toFixed(1) + "%";
+        card.appendChild(delta);
       }
-      grid.appendChild(card);
+      const spark = sparkline(t.data || []);
+      if (spark) card.appendChild(spark);
+    }
+    return card;
+  }
+
+  // [[バケット開始時刻, 平均], ...] を 100x24 の SVG 折れ線にする。
+  function sparkline(data) {
+    const values = data
+      .map(function (d) { return d[1]; })
+      .filter(function (v) { return v != null; });
+    if (values.length < 2) return null;
+    const min = Math.min.apply(null, values);
+    const span = Math.max.apply(null, values) - min || 1;
+    const points = values.map(function (v, i) {
+      const x = (i / (values.length - 1)) * 100;
+      const y = 22 - ((v - min) / span) * 20;
+      return x.toFixed(1) + "," + y.toFixed(1);
     });
+    const ns = "http://www.w3.org/2000/svg";
+    const svg = document.createElementNS(ns, "svg");
+    svg.setAttribute("class", "kpi-spark");
+    svg.setAttribute("viewBox", "0 0 100 24");
+    svg.setAttribute("preserveAspectRatio", "none");
+    const line = document.createElementNS(ns, "polyline");
+    line.setAttribute("points", points.join(" "));
+    svg.appendChild(line);
+    return svg;
   }
 
-  async function load() {
+  async function loadHistory() {
     try {
-      const res = await fetch("/api/kpis");
+      const res = await fetch("/api/kpis/history", { cache: "no-store" });
       if (!res.ok) return;
+      trends.clear();
+      ((await res.json()).kpis || []).forEach(function (t) {
+        trends.set(t.key, t);
+      });
+      // 推移が変わったカードだけ signature が変わって作り直される。
+      render(latest);
+    } catch (e) {
+      /* 取得失敗時は前回表示を維持 */
+    }
+  }
+
+  async function load() {
+    try {
+      // 変化がなければ 304 が返るので、再描画せず前回表示を維持する。
+      const res = await fetch("/api/kpis", {
+        headers: etag ? { "If-None-Match": etag } : {},
+        cache: "no-store",
+      });
+      if (res.status === 304 || !res.ok) return;
+      etag = res.headers.get("ETag");
       render((await res.json()).kpis || []);
     } catch (e) {
       /* 取得失敗時は前回表示を維持 */
     }
   }
 
-  load();
-  setInterval(load, interval);
+  function startPolling() {
+    if (pollTimer) return;
+    load();
+    pollTimer = setInterval(load, interval);
+  }
+
+  loadHistory();
+  setInterval(loadHistory, HISTORY_MS);
+
+  if (window.EventSource) {
+    const source = new EventSource("/api/stream?kpis=1");
+    source.addEventListener("kpis", function (ev) {
+      render(JSON.parse(ev.data).kpis || []);
+    });
+    source.onerror = function () {
+      if (source.readyState === EventSource.CLOSED) startPolling();
+    };
+  } else {
+    startPolling();
+  }
 })();
@@ -0,0 +1,100 @@
+"""アラートのバックグラウンド評価(AlertScheduler)のテスト。"""
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects import postgresql
+
+from monitor_app import AlertRule, MonitorConfig, TableDef, ViewDef
+from monitor_app.main import create_app
+from monitor_app.services.alert_pushdown import ThresholdPushdown
+from monitor_app.services.alert_service import (
+    AlertEngine,
+    count_violations,
+    float_column,
+)
+from monitor_app.settings.runtime import AppSettings
+
+
+@pytest.fixture
+def alert_config():
+    return MonitorConfig(
+        tables={"temps": TableDef(columns=["id", "t"], primary_key="id")},
+        views={"temps_view": ViewDef(query="SELECT id, t FROM temps")},
+        alerts=[AlertRule(view="temps_view", column="t", op=">", value=80)],
+    )
+
+
+def _app(config, tmp_path, **settings):
+    url = f"sqlite:///{tmp_path / 'alerts.db'}"
+    return create_app(config, AppSettings(database_url=url, **settings))
+
+
+def test_evaluate_once_skips_unchanged_views(alert_config, tmp_path):
+    app = _app(alert_config, tmp_path)
+    state = app.state
+    notified = []
+    state.alert_engine._notify = lambda rule, alert: notified.append(alert.count)
+    scheduler = state.alert_scheduler
+    scheduler.on_change = lambda: notified.append("changed")
+
+    assert scheduler.evaluate_once() == ["temps_view"]
+    assert scheduler.evaluate_once() == []  # 行データが同じなら評価しない
+    TestClient(app).post("/api/tables/temps", json={"t": 90})
+    assert scheduler.evaluate_once() == ["temps_view"]
+    assert notified == [1, "changed"]  # 発火のエッジで 1 回だけ通知する
+    assert state.alert_engine.active_alerts()[0]["count"] == 1
+
+
+def test_alerts_fire_without_viewers(alert_config, tmp_path):
+    app = _app(alert_config, tmp_path, alert_interval=0.25)
+    engine = app.state.alert_engine
+    with TestClient(app) as client:
+        assert engine.scheduled
+        client.post("/api/tables/temps", json={"t": 95})
+        deadline = time.monotonic() + 5
+        while not client.get("/api/alerts").json()["alerts"]:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        # 表示側は評価せず、現在の状態を読むだけ
+        runs = app.state.alert_scheduler.evaluations
+        engine.evaluate_view = None
+        payload = client.get("/api/views/temps_view").json()
+        assert payload["alerts"][0]["count"] == 1
+        assert app.state.alert_scheduler.evaluations == runs
+    assert not engine.scheduled  # 停止後は表示時の評価に戻る
+
+
+def test_pushdown_counts_match_python(alert_config, tmp_path):
+    app = _app(alert_config, tmp_path)
+    client = TestClient(app)
+    for t in ["90", " 85 ", "abc", "", "70", "1e2", None]:
+        client.post("/api/tables/temps", json={"t": t})
+    rules = [
+        AlertRule(view="temps_view", column="t", op=op, value=value)
+        for op, value in ((">", 80), ("<=", 70), ("==", 90), ("!=", 90))
+    ]
+    pushdown = ThresholdPushdown(alert_config, app.state.db)
+    counts = pushdown.counts("temps_view", rules)
+
+    rows = app.state.view_service.get_view("temps_view")["data"]
+    column = float_column(row["t"] for row in rows)
+    expected = {
+        AlertEngine.rule_key(r): count_violations(r.op, column, r.value) for r in rules
+    }
+    assert counts == expected == dict(zip(expected, [3, 1, 1, 3]))
+
+
+def test_pushdown_falls_back(alert_config, tmp_path):
+    app = _app(alert_config, tmp_path)
+    pushdown = ThresholdPushdown(alert_config, app.state.db)
+    missing = [AlertRule(view="temps_view", column="nope", op=">", value=1)]
+    assert pushdown.counts("temps_view", missing) is None  # 列がない: Python で判定
+    assert not pushdown.supports("temps_view", missing)
+    nelson = [AlertRule(view="temps_view", column="t", kind="nelson", order_by="id")]
+    assert not pushdown.supports("temps_view", nelson)
+
+    stmt = pushdown.statement("temps_view", alert_config.alerts)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "DOUBLE PRECISION" in sql and "sum(CASE WHEN" in sql
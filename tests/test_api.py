@@ -32,6 +32,53 @@ class TestRead:
         assert res.json()["detail"]["code"] == "TABLE_NOT_FOUND"
 
 
+class TestPaging:
+    def _walk(self, client, url):
+        ids, cursor = [], None
+        while True:
+            page = client.get(url + (f"&after={cursor}" if cursor else "")).json()
+            ids += [r["id"] for r in page["data"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def test_keyset_walk(self, client):
+        assert self._walk(client, "/api/tables/users?limit=2") == [1, 2, 3, 4, 5]
+
+    def test_order_by_with_ties(self, client):
+        # amount: 2, 1, 5, 12, 4 / user_id に重複あり
+        url = "/api/tables/orders?limit=2&order_by=user_id&desc=true"
+        assert self._walk(client, url) == [4, 5, 2, 3, 1]
+
+    def test_typed_filters(self, client):
+        url = "/api/tables/orders?filter[amount__gte]=4&filter[user_id__in]=1,2"
+        rows = client.get(url).json()
+        assert sorted(r["id"] for r in rows["data"]) == [3, 5]
+        url = "/api/tables/users?filter[name]=Jane Smith"
+        assert client.get(url).json()["count"] == 1
+
+    def test_unknown_params_are_ignored(self, client):
+        # キャッシュ避けなど、filter[...] 以外のパラメータは従来どおり無視する
+        assert client.get("/api/tables/users?_=123&name=x").json()["count"] == 5
+
+    def test_invalid_filter(self, client):
+        assert client.get("/api/tables/users?filter[ghost]=1").status_code == 422
+        url = "/api/tables/orders?filter[amount__gte]=x"
+        assert client.get(url).status_code == 422
+        assert client.get("/api/tables/users?limit=1&after=%%%").status_code == 422
+
+    def test_cursor_is_bound_to_ordering(self, client):
+        url = "/api/tables/orders?limit=2&order_by=user_id"
+        cursor = client.get(url).json()["next_cursor"]
+        assert client.get(f"{url}&after={cursor}").status_code == 200
+        for other in (
+            "/api/tables/orders?limit=2&order_by=user_id&desc=true",
+            "/api/tables/orders?limit=2&order_by=amount",
+            "/api/tables/orders?limit=2",
+        ):
+            assert client.get(f"{other}&after={cursor}").status_code == 422
+
+
 class TestWrite:
     def test_create_filters_unknown_columns(self, client):
         res = client.post(
@@ -75,6 +122,30 @@ class TestViews:
         assert res.status_code == 404
         assert res.json()["detail"]["code"] == "VIEW_NOT_FOUND"
 
+    def test_columnar_format(self, client):
+        records = client.get("/api/views/orders_summary").json()
+        res = client.get("/api/views/orders_summary?format=columnar")
+        compact = res.json()
+        assert compact["format"] == "columnar"
+        assert compact["columns"] == records["columns"]
+        assert [dict(zip(compact["columns"], r)) for r in compact["data"]] == (
+            records["data"]
+        )
+        assert (
+            res.headers["etag"]
+            != client.get("/api/views/orders_summary").headers["etag"]
+        )
+
+    def test_etag_not_modified(self, client):
+        etag = client.get("/api/views/users_view").headers["etag"]
+        res = client.get("/api/views/users_view", headers={"If-None-Match": etag})
+        assert res.status_code == 304 and res.content == b""
+        assert res.headers["etag"] == etag
+
+        client.post("/api/tables/users", json={"name": "New", "email": "n@x"})
+        res = client.get("/api/views/users_view", headers={"If-None-Match": etag})
+        assert res.status_code == 200 and res.headers["etag"] != etag
+
 
 class TestOpenAPI:
     def test_docs_available(self, client):
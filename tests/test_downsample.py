@@ -0,0 +1,66 @@
+"""グラフ用の間引き(LTTB)のテスト。"""
+
+import math
+
+import pytest
+
+from monitor_app.services import downsample
+from monitor_app.services.downsample import downsample_payload, keep_points, lttb
+from monitor_app.settings.declarative import ChartDef
+
+
+def _series(n=1000):
+    x = [float(i) for i in range(n)]
+    y = [math.sin(i / 25) * 10 + (i % 13) * 0.1 for i in range(n)]
+    return x, y
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_lttb_keeps_ends_and_size(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(downsample, "np", None)
+    x, y = _series()
+    picked = lttb(x, y, 50)
+    assert len(picked) == 50
+    assert picked[0] == 0 and picked[-1] == len(y) - 1
+    assert picked == sorted(set(picked))
+    assert lttb(x, y[:40], 50) == list(range(40))
+
+
+def test_numpy_matches_python(monkeypatch):
+    pytest.importorskip("numpy")
+    x, y = _series(5000)
+    y[100] = math.nan
+    vectorized = lttb(x, y, 200)
+    monkeypatch.setattr(downsample, "np", None)
+    assert lttb(x, y, 200) == vectorized
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_keep_points_extremes_and_crossings(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(downsample, "np", None)
+    y = [0.0, 1.0, 9.0, 1.0, -5.0, 0.0, math.nan, 2.0]
+    kept = keep_points(y, ucl=5, lcl=-3, limit=100)
+    assert kept == [1, 2, 3, 4, 5]  # 最大・最小と、逸脱の直前・復帰点
+
+
+def test_payload_keeps_limit_violations():
+    rows = [(i, f"t{i}", 1.0 + (i % 5) * 0.01) for i in range(2000)]
+    rows[1234] = (1234, "t1234", 99.0)
+    payload = {
+        "columns": ["id", "label", "v"],
+        "data": rows,
+        "format": "columnar",
+        "view_name": "v",
+    }
+    chart = ChartDef(x="label", y="v", ucl=50, max_points=100)
+    out = downsample_payload(payload, chart)
+    assert out["columns"] == ["label", "v"] and out["total_rows"] == 2000
+    assert len(out["data"]) <= 110
+    assert ["t1234", 99.0] in out["data"]
+    assert out["view_name"] == "v"
@@ -1,5 +1,6 @@
 """v2.1 機能拡張(製造現場向け)のテスト。"""
 
+import threading
 from pathlib import Path
 
 import pytest
@@ -15,6 +16,7 @@ from monitor_app import (
     TableDef,
     ViewDef,
 )
+from monitor_app.exceptions import QueryExecutionError
 from monitor_app.main import create_app
 from monitor_app.services.alert_service import AlertEngine
 from monitor_app.services.importer import CsvImporter
@@ -105,6 +107,14 @@ class TestAlerts:
         alerts = fclient.get("/api/alerts").json()["alerts"]
         assert alerts and alerts[0]["level"] == "critical"
 
+    def test_stream_loader_evaluates_rule_views(self, fclient):
+        # /api/stream?alerts=1 のローダーはビューが誰にも表示されていなくても評価する
+        from monitor_app.api.routers.stream import alert_payload
+
+        state = fclient.app.state
+        alerts = alert_payload(state.view_service, state.alert_engine, "alerts")
+        assert alerts["alerts"][0]["message"] == "価格超過"
+
     def test_edge_detection(self):
         cfg = MonitorConfig(
             views={"v": ViewDef(query="SELECT 1")},
@@ -116,6 +126,32 @@ class TestAlerts:
         assert engine.evaluate_view("v", [{"t": 50}]) == []  # 復帰
         assert engine.active_alerts() == []
 
+    @pytest.mark.parametrize("vectorized", [True, False])
+    def test_rules_share_one_pass_per_column(self, monkeypatch, vectorized):
+        from monitor_app.services import alert_service
+
+        if not vectorized:
+            monkeypatch.setattr(alert_service, "np", None)
+        converted = []
+        real = alert_service.float_column
+        monkeypatch.setattr(
+            alert_service,
+            "float_column",
+            lambda values: converted.append(1) or real(values),
+        )
+        cfg = MonitorConfig(
+            views={"v": ViewDef(query="SELECT 1")},
+            alerts=[
+                AlertRule(view="v", column="t", op=op, value=80)
+                for op in (">", "<=", "!=")
+            ],
+        )
+        engine = AlertEngine(cfg, AppSettings())
+        rows = [[90], ["85"], [None], ["abc"], [float("nan")], [80], [True]]
+        counts = [a.count for a in engine.evaluate_view("v", rows, ["t"])]
+        assert counts == [2, 2, 3]  # NaN・読めない値・欠損は数えない
+        assert len(converted) == 1  # ルールが 3 つでも列の変換は 1 回
+
 
 # --- E KPI / D チャート ---------------------------------------------------
 class TestKpiChart:
@@ -124,10 +160,41 @@ class TestKpiChart:
         count = next(k for k in kpis if k["key"] == "count")
         assert count["value"] == 3.0 and count["status"] == "good"
 
+    def test_kpis_etag(self, fclient):
+        etag = fclient.get("/api/kpis").headers["etag"]
+        headers = {"If-None-Match": f"W/{etag}"}
+        assert fclient.get("/api/kpis", headers=headers).status_code == 304
+        fclient.post("/api/tables/products", json={"name": "N", "price": 1})
+        assert fclient.get("/api/kpis", headers=headers).status_code == 200
+
     def test_chart_embedded_in_page(self, fclient):
         html = fclient.get("/table/products_view").text
         assert 'id="chart"' in html and "chart-config" in html
 
+    def test_chart_endpoint_downsamples(self, fclient):
+        prices = [100 + (i % 7) * 10 for i in range(60)]
+        prices[30] = 6000  # ucl(5000)超え
+        fclient.post(
+            "/api/ingest/products",
+            json=[{"name": f"p{i}", "price": p} for i, p in enumerate(prices)],
+        )
+        res = fclient.get("/api/views/products_view/chart?max_points=10")
+        body = res.json()
+        assert body["columns"] == ["name", "price"]
+        assert body["total_rows"] == 63
+        assert len(body["data"]) < 20
+        assert ["p30", 6000.0] in body["data"]  # 逸脱点は間引かれない
+        headers = {"If-None-Match": res.headers["etag"]}
+        again = fclient.get(
+            "/api/views/products_view/chart?max_points=10", headers=headers
+        )
+        assert again.status_code == 304
+        full = fclient.get("/api/views/products_view/chart").json()
+        assert len(full["data"]) == 63
+
+    def test_chart_endpoint_requires_chart(self, client):
+        assert client.get("/api/views/users_view/chart").status_code == 404
+
 
 # --- B Kiosk --------------------------------------------------------------
 class TestKiosk:
@@ -170,3 +237,78 @@ class TestAuditExport:
         assert res.status_code == 200
         assert "attachment" in res.headers["content-disposition"]
         assert res.text.splitlines()[0] == "id,name,price"
+        assert len(res.text.splitlines()) == 1 + len(
+            fclient.get("/api/views/products_view").json()["data"]
+        )
+
+    def test_export_ndjson(self, fclient):
+        import json
+
+        res = fclient.get("/api/views/products_view/export?format=ndjson")
+        assert res.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in res.text.splitlines()]
+        assert rows == fclient.get("/api/views/products_view").json()["data"]
+
+    def test_export_unknown_view(self, fclient):
+        assert fclient.get("/api/views/ghost/export").status_code == 404
+
+    def test_stream_rows_batches(self, fclient):
+        service = fclient.app.state.view_service
+        batches = service.stream_rows("products_view", batch_size=2)
+        assert next(batches) == ["id", "name", "price"]
+        assert [len(b) for b in batches] == [2, 1]
+
+    def test_write_during_open_export(self, tmp_path):
+        # ファイルの SQLite でも、エクスポート中のカーソルが書き込みを止めない(WAL)
+        config = MonitorConfig(
+            tables={"items": TableDef(columns=["id", "name"], primary_key="id")},
+            views={"items_view": ViewDef(query="SELECT id, name FROM items")},
+        )
+        url = f"sqlite:///{tmp_path / 'export.db'}"
+        client = TestClient(create_app(config, AppSettings(database_url=url)))
+        rows = [{"name": f"n{i}"} for i in range(5)]
+        assert client.post("/api/ingest/items", json=rows).status_code == 200
+        service = client.app.state.view_service
+        batches = service.stream_rows("items_view", batch_size=2)
+        next(batches)
+        assert len(next(batches)) == 2  # カーソルが開いたまま
+        res = client.post("/api/ingest/items", json=[{"name": "late"}])
+        assert res.status_code == 200
+        assert sum(len(b) for b in batches) == 3
+        batches.close()
+
+    def test_export_bounds_pool_usage(self, fclient, monkeypatch):
+        import time
+
+        service = fclient.app.state.view_service
+        monkeypatch.setattr(service, "_export_slots", threading.BoundedSemaphore(1))
+        first = service.stream_rows("products_view", batch_size=1)
+        next(first)
+        # 1 本目がダウンロード中の間、2 本目は 503
+        res = fclient.get("/api/views/products_view/export")
+        assert res.status_code == 503
+        assert res.json()["detail"]["code"] == "SERVICE_BUSY"
+        first.close()  # 終われば枠が空く
+        assert fclient.get("/api/views/products_view/export").status_code == 200
+
+        # 制限時間を過ぎたら次のバッチを読む前に打ち切る
+        monkeypatch.setattr(service, "export_timeout", 0.01)
+        slow = service.stream_rows("products_view", batch_size=1)
+        next(slow)
+        time.sleep(0.02)
+        with pytest.raises(QueryExecutionError):
+            next(slow)
+        assert fclient.get("/api/views/products_view/export").status_code == 200
+
+    def test_export_xlsx_splits_sheets(self, fclient):
+        import io
+
+        openpyxl = pytest.importorskip("openpyxl")
+        fclient.app.state.settings.export_sheet_rows = 2
+        res = fclient.get("/api/views/products_view/export?format=xlsx")
+        assert res.headers["content-type"].startswith("application/vnd.openxml")
+        wb = openpyxl.load_workbook(io.BytesIO(res.content), read_only=True)
+        assert wb.sheetnames == ["products_view", "products_view (2)"]
+        rows = [list(ws.values) for ws in wb.worksheets]
+        assert [len(r) for r in rows] == [3, 2]  # ヘッダ + データ
+        assert rows[1][0] == ("id", "name", "price")
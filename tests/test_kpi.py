@@ -0,0 +1,201 @@
+"""KPI 評価(共有接続・並列評価・タイムアウト)のテスト。"""
+
+import asyncio
+import datetime
+import time
+import types
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select
+
+from monitor_app import KpiCard, MonitorConfig, TableDef
+from monitor_app.db.engine import Database
+from monitor_app.exceptions import InvalidPayloadError
+from monitor_app.main import create_app
+from monitor_app.services import kpi_history
+from monitor_app.services.kpi_history import KpiHistory
+from monitor_app.services.kpi_refresher import KpiRefresher
+from monitor_app.services.kpi_service import KpiService
+from monitor_app.settings.runtime import AppSettings
+
+SLOW = (
+    "WITH RECURSIVE r(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM r "
+    "WHERE i < 100000000) SELECT COUNT(*) FROM r"
+)
+
+
+def _config(**queries):
+    return MonitorConfig(
+        kpis={key: KpiCard(title=key, query=q) for key, q in queries.items()}
+    )
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(f"sqlite:///{tmp_path / 'kpi.db'}")
+    yield database
+    database.dispose()
+
+
+def test_cards_share_one_connection(db):
+    checkouts = []
+    event.listen(db.engine, "checkout", lambda *a: checkouts.append(1))
+    service = KpiService(_config(**{f"k{i}": f"SELECT {i}" for i in range(20)}), db)
+    kpis = service.evaluate_all()
+    assert [k["value"] for k in kpis] == [float(i) for i in range(20)]
+    assert len(checkouts) == 1
+    assert not any(k["stale"] for k in kpis)
+
+
+def test_slow_card_is_stale_and_others_fresh(db):
+    service = KpiService(_config(a="SELECT 1", slow="SELECT 2"), db, timeout=0.05)
+    service.evaluate_all()  # 前回の値を作る
+    service.config.kpis["slow"] = KpiCard(title="slow", query=SLOW)
+    started = time.monotonic()
+    fast, slow = service.evaluate_all()
+    assert time.monotonic() - started < 2
+    assert fast["value"] == 1.0 and not fast["stale"]
+    assert slow["stale"] and slow["value"] == 2.0  # 前回の値を表示する
+
+
+def test_parallel_evaluation(db):
+    service = KpiService(
+        _config(a="SELECT 1", b="SELECT 2", slow=SLOW), db, timeout=0.05
+    )
+    service.workers = 3  # SQLite では既定で無効。プールの経路を直接試す。
+    try:
+        kpis = service.evaluate_all()
+    finally:
+        service.close()
+    assert [k["value"] for k in kpis[:2]] == [1.0, 2.0]
+    assert kpis[2]["stale"] and kpis[2]["value"] is None
+    assert KpiService(_config(), db, workers=4).workers == 1  # SQLite は直列
+
+
+def test_snapshot_reuses_results_until_ttl(db):
+    queries = []
+    event.listen(db.engine, "before_cursor_execute", lambda *a: queries.append(a[2]))
+    config = _config(a="SELECT 1", b="SELECT 2")
+    config.kpis["b"].refresh_seconds = 0.05
+    service = KpiService(config, db, refresh=60)
+    first = service.snapshot()
+    assert [k["value"] for k in first] == [1.0, 2.0]
+    assert all("updated_at" in k and k["age"] >= 0 for k in first)
+    count = len(queries)
+    service.snapshot()
+    assert len(queries) == count  # 期限前はクエリしない
+    time.sleep(0.06)
+    assert service.due() == ["b"]
+    service.snapshot()
+    assert [q for q in queries[count:] if q.startswith("SELECT")] == ["SELECT 2"]
+
+
+def test_refresh_reports_changes_and_invalidate(db):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (v INTEGER)")
+    service = KpiService(_config(n="SELECT COUNT(*) FROM t", c="SELECT 1"), db)
+    service.dependencies["n"] = frozenset({"t"})
+    assert service.refresh_due() == ["n", "c"]
+    assert service.refresh_due() == []  # 期限前
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+    service.invalidate(frozenset({"t"}))
+    assert service.due() == ["n"]
+    assert service.refresh_due() == ["n"]
+    assert service.refresh_due(["c"]) == []  # 値が同じなら変化なし
+
+
+def test_refresher_notifies_on_change(db):
+    calls = []
+    service = KpiService(_config(a="SELECT 1"), db, refresh=60)
+    refresher = KpiRefresher(service, on_change=lambda: calls.append(1))
+
+    async def scenario():
+        return await refresher.refresh_once(), await refresher.refresh_once()
+
+    assert asyncio.run(scenario()) == (["a"], [])
+    assert calls == [1]
+
+
+def test_write_wakes_refresher(tmp_path):
+    config = MonitorConfig(
+        tables={"items": TableDef(columns=["id", "qty"], primary_key="id")},
+        kpis={"n": KpiCard(title="件数", query="SELECT COUNT(*) FROM items")},
+    )
+    settings = AppSettings(database_url=f"sqlite:///{tmp_path / 'app.db'}")
+    app = create_app(config, settings)
+    service = app.state.kpi_service
+    service.refresh = 60.0  # 期限では評価し直さない
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 2
+        while not service.snapshot():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        started = time.monotonic()
+        client.post("/api/tables/items", json={"qty": 1})
+        while service._snapshot["n"]["value"] != 1.0:
+            assert time.monotonic() - started < 1.0  # MAX_WAIT(5 秒)を待たない
+            time.sleep(0.01)
+
+
+def test_history_records_and_downsamples(db):
+    config = _config(a="SELECT 1", b="SELECT NULL")
+    history = KpiHistory(config, db, retention_days=7)
+    service = KpiService(config, db, history=history)
+    service.refresh_due()
+    now = datetime.datetime(2024, 1, 2, 12, 0)
+    rows = [
+        {"kpi_key": "a", "ts": now - datetime.timedelta(minutes=m), "value": v}
+        for m, v in ((90, 10.0), (30, 20.0), (20, 40.0))
+    ]
+    with db.connect() as conn:
+        conn.execute(history.table.insert(), rows)
+
+    out = history.series(["a"], end=now, hours=1, points=2)
+    assert out["bucket_seconds"] == 1800
+    (a,) = out["kpis"]
+    assert a["data"] == [["2024-01-02T11:30:00", 30.0]]
+    assert (a["current"], a["previous"], a["delta"]) == (30.0, 10.0, 20.0)
+    assert a["delta_pct"] == 200.0
+    recent = history.series(hours=1)["kpis"]
+    assert [k["current"] for k in recent] == [1.0, None]  # NULL は記録しない
+    with pytest.raises(InvalidPayloadError):
+        history.series(["missing"])
+
+
+def test_history_records_at_most_once_per_interval(db, monkeypatch):
+    config = _config(a="SELECT 1")
+    history = KpiHistory(config, db, retention_days=7, interval=60)
+    clock = [1000.0]
+    monkeypatch.setattr(
+        kpi_history, "time", types.SimpleNamespace(monotonic=lambda: clock[0])
+    )
+    result = [{"key": "a", "value": 1.0}]
+    for step in (0, 2, 30, 58, 2):  # 0・60 秒目だけ記録する
+        clock[0] += step
+        history.record(result)
+    with db.connect() as conn:
+        count = conn.execute(select(func.count()).select_from(history.table))
+        assert count.scalar() == 2
+
+
+def test_history_respects_init_db(tmp_path):
+    db = Database(f"sqlite:///{tmp_path / 'kpi.db'}")
+    config = _config(a="SELECT 1")
+    with pytest.raises(RuntimeError, match="_kpi_history"):
+        KpiHistory(config, db, retention_days=7, create=False)
+    KpiHistory(config, db, retention_days=0, create=False)  # 無効なら確認しない
+    KpiHistory(config, db, retention_days=7)  # 作成する
+    KpiHistory(config, db, retention_days=7, create=False)
+
+
+def test_history_endpoint(tmp_path):
+    settings = AppSettings(database_url=f"sqlite:///{tmp_path / 'app.db'}")
+    client = TestClient(create_app(_config(count="SELECT 3"), settings))
+    assert client.get("/api/kpis").json()["kpis"][0]["value"] == 3.0
+    out = client.get("/api/kpis/history?keys=count&hours=1").json()
+    card = out["kpis"][0]
+    assert card["key"] == "count" and card["current"] == 3.0
+    assert len(card["data"]) == 1
+    assert client.get("/api/kpis/history?keys=nope").status_code == 422
@@ -0,0 +1,107 @@
+"""Nelson ルールの逐次判定と、アラートエンジンへの組み込みのテスト。"""
+
+import pytest
+
+from monitor_app import AlertRule, ChartDef, MonitorConfig, ViewDef
+from monitor_app.services.alert_service import AlertEngine
+from monitor_app.services.nelson import NelsonDetector
+from monitor_app.settings.runtime import AppSettings
+
+
+def _fired(values, rule, center=0.0, sigma=1.0):
+    detector = NelsonDetector([rule])
+    return [bool(detector.push(v, center, sigma)) for v in values]
+
+
+@pytest.mark.parametrize(
+    "rule, values, first_hit",
+    [
+        (1, [0.5, -0.2, 3.5], 2),
+        (2, [0.3] * 9, 8),
+        (3, [0.1, 0.2, 0.3, 0.4, 0.5, 0.6], 5),
+        (4, [0.5, -0.5] * 7, 13),
+        (5, [2.5, 0.0, 2.2], 2),
+        (6, [1.5, 1.2, -0.3, 1.1, 1.4], 4),
+        (7, [0.1, -0.1] * 8, 14),
+        (8, [1.5, -1.5] * 4, 7),
+    ],
+)
+def test_each_rule_fires_on_its_pattern(rule, values, first_hit):
+    fired = _fired(values, rule)
+    assert fired.index(True) == first_hit
+
+
+def test_patterns_reset():
+    # 同じ側の連続は反対側の点で途切れる
+    assert not any(_fired([0.3] * 8 + [-0.3] + [0.3] * 8, 2))
+    # 2σ 超えでも反対側どうしは「同じ側の 3 点中 2 点」にならない
+    assert not any(_fired([2.5, 0.0, -2.5], 5))
+    # 片側だけの 1σ 外の連続はルール 8 にならない(ルール 2・6 の対象)
+    assert not any(_fired([1.5] * 10, 8))
+    assert _fired([1.5] * 7 + [-1.5], 8)[-1]
+
+
+def _engine(**rule):
+    cfg = MonitorConfig(
+        views={
+            "v": ViewDef(query="SELECT 1", title="v", chart=ChartDef(x="t", y="value"))
+        },
+        alerts=[AlertRule(view="v", column="value", kind="nelson", **rule)],
+    )
+    return AlertEngine(cfg, AppSettings())
+
+
+def test_engine_evaluates_only_new_rows():
+    engine = _engine(center=10, sigma=1, rules=[1])
+    rows = [{"t": i, "value": 10 + (i % 3) * 0.5} for i in range(20)]
+    assert engine.evaluate_view("v", rows) == []
+    rows.append({"t": 20, "value": 14.0})  # 3σ 超え
+    alerts = engine.evaluate_view("v", rows)
+    assert alerts[0].count == 1 and "ルール 1" in alerts[0].message
+    assert engine.evaluate_view("v", rows)  # 新しい行がない間は発火中のまま
+    rows.append({"t": 21, "value": 10.0})
+    assert engine.evaluate_view("v", rows) == []  # 新しい行に違反なし: 復帰
+    assert engine.active_alerts() == []
+
+
+def test_rules_with_different_parameters_are_separate():
+    cfg = MonitorConfig(
+        views={
+            "v": ViewDef(query="SELECT 1", title="v", chart=ChartDef(x="t", y="value"))
+        },
+        alerts=[
+            AlertRule(
+                view="v", column="value", kind="nelson", center=c, sigma=1, rules=[1]
+            )
+            for c in (10, 14)
+        ],
+    )
+    engine = AlertEngine(cfg, AppSettings())
+    keys = {engine.rule_key(rule) for rule in cfg.alerts}
+    assert len(keys) == 2
+    rows = [{"t": i, "value": 10.0} for i in range(5)]  # 中心線 14 からは 4σ 外
+    alerts = engine.evaluate_view("v", rows)
+    assert [a.count for a in alerts] == [5]
+    rows.append({"t": 5, "value": 12.0})
+    assert engine.evaluate_view("v", rows) == []  # どちらの系列も新しい 1 行だけを判定
+
+
+def test_engine_estimates_limits_and_accepts_columnar():
+    engine = _engine(rules=[3])  # 中心線と σ はデータから推定
+    data = [[i, 10 + (i % 2) * 0.4] for i in range(30)]
+    assert engine.evaluate_view("v", data, ["t", "value"]) == []
+    data += [[30 + i, 10.0 + i * 0.1] for i in range(6)]  # 6 点連続の増加
+    alerts = engine.evaluate_view("v", data, ["t", "value"])
+    assert alerts and alerts[0].level == "warning"
+
+
+def test_rule_validation():
+    with pytest.raises(ValueError):
+        AlertRule(view="v", column="c")  # 閾値ルールに op / value がない
+    with pytest.raises(ValueError):
+        AlertRule(view="v", column="c", kind="nelson", rules=[9])
+    with pytest.raises(ValueError):
+        MonitorConfig(
+            views={"v": ViewDef(query="SELECT 1")},
+            alerts=[AlertRule(view="v", column="c", kind="nelson")],
+        )
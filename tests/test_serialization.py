@@ -0,0 +1,44 @@
+"""JSON シリアライズ(orjson / 標準 json)のテスト。"""
+
+import datetime as dt
+import json
+from decimal import Decimal
+
+import pytest
+
+from monitor_app.services import serialization
+
+SAMPLE = {
+    "ts": dt.datetime(2024, 5, 1, 8, 30, 15, 250000),
+    "day": dt.date(2024, 5, 1),
+    "qty": Decimal("1.5"),
+    "row": (1, "赤", None),
+    "missing": [float("nan"), float("inf"), -float("inf"), Decimal("NaN")],
+}
+EXPECTED = {
+    "ts": "2024-05-01T08:30:15.250000",
+    "day": "2024-05-01",
+    "qty": 1.5,
+    "row": [1, "赤", None],
+    "missing": [None, None, None, None],
+}
+
+
+def test_backends_produce_identical_bytes(monkeypatch):
+    pytest.importorskip("orjson")
+    fast = serialization.dumps_bytes(SAMPLE, sort_keys=True)
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert serialization.dumps_bytes(SAMPLE, sort_keys=True) == fast
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_backends_agree(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(serialization, "orjson", None)
+    assert json.loads(serialization.dumps(SAMPLE)) == EXPECTED
+    # 64 ビットを超える整数もそのままの数値になる
+    big = {"id": 2**64 + 1, "v": float("nan")}
+    assert serialization.dumps(big) == '{"id":18446744073709551617,"v":null}'
+    assert serialization.dumps({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
@@ -0,0 +1,155 @@
+"""SPC 管理限界の自動計算のテスト。"""
+
+import asyncio
+import json
+import random
+import statistics
+
+import pytest
+from fastapi.testclient import TestClient
+
+from monitor_app import ChartDef, MonitorConfig, TableDef, ViewDef
+from monitor_app.api.routers.views import _append_events
+from monitor_app.main import create_app
+from monitor_app.services import spc
+from monitor_app.services.spc import SpcAccumulator, SpcService
+from monitor_app.services.stream_hub import StreamHub
+from monitor_app.settings.runtime import AppSettings
+
+
+def _values(n=200, seed=3):
+    rng = random.Random(seed)
+    return [rng.gauss(10, 1) for _ in range(n)]
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(spc, "np", None)
+
+
+def test_imr_matches_direct_formula(backend):
+    values = _values()
+    acc = SpcAccumulator("imr")
+    for i in range(0, len(values), 17):  # 少しずつ足し込んでも同じ
+        acc.extend(values[i : i + 17])
+    mean = statistics.fmean(values)
+    mr = statistics.fmean(abs(b - a) for a, b in zip(values, values[1:]))
+    limits = acc.limits()
+    assert limits["n"] == len(values)
+    assert limits["center"] == pytest.approx(mean)
+    assert limits["ucl"] == pytest.approx(mean + 2.66 * mr)
+    assert limits["lcl"] == pytest.approx(mean - 2.66 * mr)
+    assert limits["range"]["ucl"] == pytest.approx(3.267 * mr)
+
+
+def test_xbar_r_groups_across_chunks(backend):
+    values = _values(203)  # 端数の 3 点はまだ群にならない
+    acc = SpcAccumulator("xbar_r", subgroup_size=5)
+    for i in range(0, len(values), 7):
+        acc.extend(values[i : i + 7])
+    groups = [values[i : i + 5] for i in range(0, 200, 5)]
+    grand = statistics.fmean(statistics.fmean(g) for g in groups)
+    rbar = statistics.fmean(max(g) - min(g) for g in groups)
+    limits = acc.limits()
+    assert limits["n"] == 40
+    assert limits["ucl"] == pytest.approx(grand + 0.577 * rbar)
+    assert limits["range"]["ucl"] == pytest.approx(2.114 * rbar)
+
+
+def test_rolling_baseline(backend):
+    values = _values()
+    acc = SpcAccumulator("imr", baseline=50)
+    acc.extend(values[:120])
+    acc.extend(values[120:])
+    tail = SpcAccumulator("imr")
+    tail.extend(values[-51:])  # 直近 50 点と、その 50 個の移動範囲
+    assert acc.limits()["n"] == 50
+    assert acc.limits()["center"] == pytest.approx(statistics.fmean(values[-50:]))
+    assert acc.limits()["range"] == pytest.approx(tail.limits()["range"])
+    assert SpcAccumulator("imr").limits()["ucl"] is None
+
+
+def _config(**chart):
+    return MonitorConfig(
+        tables={
+            "readings": TableDef(
+                columns={"id": "int", "seq": "int", "v": "float"}, primary_key="id"
+            )
+        },
+        views={
+            "trend": ViewDef(
+                query="SELECT seq, v FROM readings ORDER BY seq",
+                title="トレンド",
+                chart=ChartDef(x="seq", y="v", **chart),
+            )
+        },
+    )
+
+
+def test_service_adds_only_new_rows(monkeypatch):
+    service = SpcService(_config(spc="imr"))
+    seen = []
+    original = SpcAccumulator.extend
+    monkeypatch.setattr(
+        SpcAccumulator,
+        "extend",
+        lambda self, values: (seen.append(list(values)), original(self, values)),
+    )
+    payload = {
+        "columns": ["seq", "v"],
+        "data": [[1, 1.0], [2, 3.0]],
+        "format": "columnar",
+    }
+    first = service.limits("trend", payload, "a")
+    assert service.limits("trend", payload, "a") is first  # 同じ内容は再計算しない
+    payload["data"] = payload["data"][1:] + [[3, 2.0]]  # 古い行が消え、新しい行が来た
+    service.limits("trend", payload, "b")
+    assert seen == [[1.0, 3.0], [2.0]]
+    assert SpcService(_config()).limits("trend", payload, "a") is None
+
+
+def test_service_rebuilds_when_rows_are_replaced():
+    service = SpcService(_config(spc="imr"))
+
+    def payload(rows):
+        return {"columns": ["seq", "v"], "data": rows, "format": "columnar"}
+
+    old = [[i, 100.0 + i % 2] for i in range(1, 21)]
+    assert service.limits("trend", payload(old), "a")["n"] == 20
+    # テーブルを置き換えた: x が 1 から振り直され、行数も減った
+    new = [[i, 10.0 + i % 3] for i in range(1, 6)]
+    limits = service.limits("trend", payload(new), "b")
+    assert limits["n"] == 5
+    assert limits["center"] == pytest.approx(statistics.fmean(v for _, v in new))
+    # 以降は新しい行だけを足し込む
+    assert service.limits("trend", payload(new + [[6, 11.0]]), "c")["n"] == 6
+
+
+def test_chart_endpoint_and_stream_publish_limits():
+    app = create_app(_config(spc="imr"), AppSettings(database_url="sqlite:///:memory:"))
+    client = TestClient(app)
+    values = _values(60)
+    rows = [{"seq": i, "v": v} for i, v in enumerate(values)]
+    client.post("/api/ingest/readings", json=rows)
+    body = client.get("/api/views/trend/chart").json()
+    assert body["limits"]["method"] == "imr" and body["limits"]["n"] == 60
+    assert body["limits"]["center"] == pytest.approx(statistics.fmean(values))
+
+    hub = StreamHub(
+        lambda v: app.state.view_service.get_view(v, columnar=True), interval=0.01
+    )
+    spc_service = app.state.spc_service
+
+    async def scenario():
+        events = _append_events(hub, "trend", "seq", True, spc_service)
+        first = [await anext(events), await anext(events)]
+        await events.aclose()
+        await hub.close()
+        return first
+
+    message, limits = asyncio.run(scenario())
+    assert message["event"] == "message" and limits["event"] == "limits"
+    assert json.loads(limits["data"]) == body["limits"]
@@ -0,0 +1,431 @@
+"""ビュー配信(共有ポーラー / SSE)のテスト。"""
+
+import asyncio
+import json
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from monitor_app.api.routers.stream import _format_positions, _parse_positions
+from monitor_app.api.routers.views import _append_events
+from monitor_app.db.changes import ChangeTracker
+from monitor_app.services.stream_hub import (
+    LatestWinsBuffer,
+    StreamHub,
+    ViewEvent,
+    merge,
+    parse_event_id,
+    payload_hash,
+)
+from monitor_app.services.view_delta import diff_rows
+
+
+def _payload(rows):
+    return {"view_name": "v", "columns": ["t"], "data": rows, "alerts": []}
+
+
+class TestStreamHub:
+    def test_one_poller_shared_by_subscribers(self):
+        calls = []
+
+        def loader(view):
+            calls.append(view)
+            return _payload([{"t": 1}])
+
+        async def scenario():
+            hub = StreamHub(loader, interval=0.01)
+            async with hub.subscribe("v") as a, hub.subscribe("v") as b:
+                first_a = await asyncio.wait_for(a.get(), 1)
+                first_b = await asyncio.wait_for(b.get(), 1)
+                assert first_a is first_b  # 同じイベントを共有する
+                stats = hub.stats()
+                assert stats["pollers"] == 1 and stats["subscribers"] == 2
+                await asyncio.sleep(0.05)
+                # 変化がなければ再送しない
+                assert a.queue.empty() and b.queue.empty()
+            assert hub.stats() == {"pollers": 0, "subscribers": 0, "views": {}}
+            return len(calls)
+
+        ticks = asyncio.run(scenario())
+        assert ticks >= 1
+
+    def test_poller_stops_after_last_subscriber(self):
+        calls = []
+
+        def loader(view):
+            calls.append(view)
+            return _payload([{"t": len(calls)}])
+
+        async def scenario():
+            hub = StreamHub(loader, interval=0.01)
+            async with hub.subscribe("v") as sub:
+                await asyncio.wait_for(sub.get(), 1)
+            stopped_at = len(calls)
+            await asyncio.sleep(0.05)
+            return stopped_at
+
+        stopped_at = asyncio.run(scenario())
+        assert len(calls) == stopped_at
+
+    def test_poller_survives_unexpected_errors(self):
+        calls = []
+
+        def loader(view):
+            calls.append(view)
+            if len(calls) == 1:
+                raise KeyError("t")  # MonitorAppError 以外の失敗
+            return _payload([{"t": 1}])
+
+        async def scenario():
+            hub = StreamHub(loader, interval=0.01)
+            async with hub.subscribe("v") as sub:
+                return await asyncio.wait_for(sub.get(), 1)
+
+        event = asyncio.run(scenario())
+        assert event.payload["data"] == [{"t": 1}] and len(calls) >= 2
+
+    def test_merge_multiplexes_hubs(self):
+        views = StreamHub(lambda v: _payload([{"t": v}]), interval=0.01)
+        kpis = StreamHub(lambda _: {"kpis": [1]}, interval=0.01, digest=payload_hash)
+
+        async def scenario():
+            async with (
+                views.subscribe("a") as a,
+                views.subscribe("b") as b,
+                kpis.subscribe("kpis") as k,
+            ):
+                seen = {}
+                stream = merge({("view", "a"): a, ("view", "b"): b, ("kpis", ""): k})
+                async for key, event in stream:
+                    seen[key] = event.payload
+                    if len(seen) == 3:
+                        break
+                await stream.aclose()
+            return seen
+
+        seen = asyncio.run(scenario())
+        assert seen[("view", "b")]["data"] == [{"t": "b"}]
+        assert seen[("kpis", "")] == {"kpis": [1]}
+
+
+class TestStreamApi:
+    def test_streams_endpoint(self, client):
+        stats = client.get("/api/streams").json()
+        assert stats["pollers"] == 0 and stats["kpis"]["pollers"] == 0
+
+    def test_stream_missing_view(self, client):
+        assert client.get("/api/views/ghost/stream").status_code == 404
+
+    def test_dashboard_stream_validation(self, client):
+        assert client.get("/api/stream?views=users_view,ghost").status_code == 404
+        assert client.get("/api/stream").status_code == 422
+
+
+class TestWebSocket:
+    def test_latest_wins_buffer(self):
+        async def scenario():
+            buf = LatestWinsBuffer()
+            for seq in (1, 2, 3):
+                buf.offer("a", ViewEvent("a", seq, {}, "d"))
+            buf.offer("b", ViewEvent("b", 1, {}, "d"))
+            first = await buf.get()
+            second = await buf.get()
+            buf.sent(first[1])
+            return first, second, buf.stats()
+
+        (k1, e1), (k2, _), stats = asyncio.run(scenario())
+        assert (k1, e1.seq, k2) == ("a", 3, "b")  # 途中の 1, 2 は送らない
+        assert stats["conflated"] == 2 and stats["delivered"] == 1
+
+    def test_ws_snapshot_and_stats(self, client):
+        with client.websocket_connect(
+            "/api/ws?views=users_view&kpis=1&format=columnar"
+        ) as ws:
+            msgs = {
+                m["type"]: m["data"] for m in (ws.receive_json(), ws.receive_json())
+            }
+            assert msgs["view"]["format"] == "columnar"
+            assert "kpis" in msgs["kpis"]
+            clients = client.get("/api/streams").json()["websockets"]
+            assert clients[0]["resources"] == ["view:users_view", "kpis:kpis"]
+        assert client.get("/api/streams").json()["websockets"] == []
+
+    def test_ws_rejects_unknown_view(self, client):
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect("/api/ws?views=ghost"):
+                pass
+        assert exc.value.code == 1008
+
+
+def _apply(old_rows, delta, key):
+    """app.js の applyDelta と同じ手順で差分を適用する。"""
+    gone = set(delta["deleted"])
+    changed = {r[key]: r for r in delta["updated"]}
+    rows = [changed.get(r[key], r) for r in old_rows if r[key] not in gone]
+    for item in delta["inserted"]:
+        rows.insert(item["index"], item["row"])
+    return rows
+
+
+class TestViewDelta:
+    def _view(self, rows):
+        return {"columns": ["id", "v"], "data": rows}
+
+    def test_insert_update_delete(self):
+        old = [{"id": i, "v": i} for i in range(1, 41)]
+        new = [r for r in old if r["id"] != 3]
+        new[0] = {"id": 1, "v": 100}
+        new.insert(5, {"id": 99, "v": 0})
+        new.append({"id": 100, "v": 0})
+        delta = diff_rows(self._view(old), self._view(new), "id")
+        assert delta["deleted"] == [3]
+        assert delta["updated"] == [{"id": 1, "v": 100}]
+        assert [i["index"] for i in delta["inserted"]] == [5, 40]
+        assert _apply(old, delta, "id") == new
+
+    def test_reorder_falls_back_to_snapshot(self):
+        old = [{"id": 1, "v": 1}, {"id": 2, "v": 2}]
+        new = [{"id": 2, "v": 2}, {"id": 1, "v": 1}]
+        assert diff_rows(self._view(old), self._view(new), "id") is None
+
+    def test_hub_attaches_delta(self):
+        rows = [{"id": 1, "v": 1}]
+
+        def loader(view):
+            return {"columns": ["id", "v"], "data": list(rows), "alerts": []}
+
+        async def scenario():
+            hub = StreamHub(loader, interval=0.01, key_columns={"v": "id"})
+            async with hub.subscribe("v") as sub:
+                first = await asyncio.wait_for(sub.get(), 1)
+                rows.append({"id": 2, "v": 2})
+                second = await asyncio.wait_for(sub.get(), 1)
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        assert first.delta is None
+        assert second.seq == first.seq + 1
+        assert second.delta["inserted"] == [{"index": 1, "row": {"id": 2, "v": 2}}]
+
+    def test_columnar_rows(self):
+        cols = ["id", "v"]
+        old = {"columns": cols, "format": "columnar", "data": [(1, 1), (2, 2)]}
+        new = {"columns": cols, "format": "columnar", "data": [(1, 5), (3, 3)]}
+        delta = diff_rows(old, new, "id")
+        assert delta == {
+            "inserted": [{"index": 1, "row": (3, 3)}],
+            "updated": [(1, 5)],
+            "deleted": [2],
+        }
+
+    def test_event_encodes_both_formats(self):
+        cols = ["id", "v"]
+        payload = {"columns": cols, "format": "columnar", "data": [(1, 5)]}
+        delta = {"inserted": [], "updated": [(1, 5)], "deleted": [2]}
+        event = ViewEvent("v", 2, payload, "d", delta)
+        assert json.loads(event.encoded)["data"] == [{"id": 1, "v": 5}]
+        assert "format" not in json.loads(event.encoded)
+        assert json.loads(event.encoded_columnar)["data"] == [[1, 5]]
+        assert json.loads(event.encoded_delta)["updated"] == [{"id": 1, "v": 5}]
+        assert json.loads(event.encoded_delta_columnar)["updated"] == [[1, 5]]
+
+
+class TestChangeToken:
+    def test_unchanged_token_skips_query(self):
+        calls = []
+        token = [0]
+
+        def loader(view):
+            calls.append(view)
+            return _payload([{"t": token[0]}])
+
+        async def scenario():
+            hub = StreamHub(
+                loader, interval=0.01, token=lambda v: token[0], max_idle=60
+            )
+            async with hub.subscribe("v") as sub:
+                await asyncio.wait_for(sub.get(), 1)
+                await asyncio.sleep(0.05)
+                idle_calls = len(calls)
+                token[0] += 1
+                await asyncio.wait_for(sub.get(), 1)
+                stats = hub.stats()["views"]["v"]
+            return idle_calls, stats
+
+        idle_calls, stats = asyncio.run(scenario())
+        assert idle_calls == 1
+        assert len(calls) == 2
+        assert stats["ticks"] > stats["queries"]
+
+    def test_view_service_token_follows_writes(self, app):
+        service = app.state.view_service
+        before = service.change_token("orders_summary")
+        app.state.crud_service.create_record("products", {"name": "x", "price": 1})
+        assert service.change_token("orders_summary") == before
+        app.state.crud_service.create_record("users", {"name": "y", "email": "e"})
+        assert service.change_token("orders_summary") != before
+
+
+class TestPush:
+    def _hub(self, calls, changes, **kwargs):
+        def loader(view):
+            calls.append(view)
+            return _payload([{"t": changes.version("t")}])
+
+        hub = StreamHub(
+            loader,
+            token=lambda v: changes.version("t"),
+            max_idle=60,
+            **kwargs,
+        )
+        hub.watch(changes, {"v": frozenset({"t"})})
+        return hub
+
+    def test_write_wakes_poller_without_polling(self):
+        calls = []
+        changes = ChangeTracker()
+        # interval は短いが、通知で起こせるポーラーは max_idle まで tick しない
+        hub = self._hub(calls, changes, interval=0.01)
+
+        async def scenario():
+            async with hub.subscribe("v") as sub:
+                await asyncio.wait_for(sub.get(), 1)
+                await asyncio.sleep(0.05)
+                idle = hub.stats()["views"]["v"]
+                # 書き込みは別スレッド(リクエストのスレッドプール)から通知される
+                await asyncio.to_thread(changes.mark, "t")
+                event = await asyncio.wait_for(sub.get(), 1)
+                return idle, event, hub.stats()["views"]["v"]
+
+        idle, event, stats = asyncio.run(scenario())
+        assert idle["ticks"] <= 2  # 通知待ちの間は interval ごとに tick しない
+        assert event.payload["data"] == [{"t": 1}]
+        assert stats["pushes"] == 1 and stats["queries"] == 2
+
+    def test_burst_is_coalesced(self):
+        calls = []
+        changes = ChangeTracker()
+        hub = self._hub(calls, changes, interval=60, coalesce=0.05)
+
+        async def scenario():
+            async with hub.subscribe("v") as sub:
+                await asyncio.wait_for(sub.get(), 1)
+                for _ in range(5):
+                    changes.mark("t")
+                    changes.mark("other")  # 依存外のテーブルは起こさない
+                event = await asyncio.wait_for(sub.get(), 1)
+                await asyncio.sleep(0.1)
+                return event
+
+        event = asyncio.run(scenario())
+        assert event.payload["data"] == [{"t": 5}]
+        assert len(calls) == 2
+
+
+class TestResume:
+    def _run(self, last_event_id=None, changes=2, replay=8, epoch=None):
+        rows = [{"id": 1, "v": 1}]
+
+        def loader(view):
+            return {"columns": ["id", "v"], "data": list(rows), "alerts": []}
+
+        async def scenario():
+            hub = StreamHub(
+                loader,
+                interval=0.01,
+                key_columns={"v": "id"},
+                replay=replay,
+                linger=60,
+            )
+            async with hub.subscribe("v") as sub:
+                first = await asyncio.wait_for(sub.get(), 1)
+            # 切断中の変化(linger 中のポーラーが差分を記録する)
+            for i in range(changes):
+                rows.append({"id": i + 2, "v": 0})
+                while hub._pollers["v"].latest.seq < first.seq + i + 1:
+                    await asyncio.sleep(0.01)
+            last = last_event_id or (epoch or first.epoch) + f"-{first.seq}"
+            async with hub.subscribe("v", last, replay=True) as sub:
+                missed = []
+                while not sub.queue.empty():
+                    missed.append(sub.queue.get_nowait())
+                resume_seq = sub.resume_seq
+            await hub.close()
+            return first, resume_seq, missed
+
+        return asyncio.run(scenario())
+
+    def test_replays_missed_deltas(self):
+        first, resume_seq, missed = self._run()
+        assert resume_seq == first.seq
+        assert [e.seq for e in missed] == [first.seq + 1, first.seq + 2]
+        assert not missed[0].has_snapshot  # 再送バッファは行データを持たない
+        assert missed[-1].has_snapshot and missed[-1].delta is not None
+        assert missed[-1].id == f"{first.epoch}-{first.seq + 2}"
+
+    def test_up_to_date_client_gets_nothing(self):
+        first, resume_seq, missed = self._run(changes=0)
+        assert resume_seq == first.seq and missed == []
+
+    def test_unknown_epoch_or_large_gap_sends_snapshot(self):
+        _, resume_seq, missed = self._run(epoch="other")
+        assert resume_seq is None and len(missed) == 1 and missed[0].has_snapshot
+        first, resume_seq, missed = self._run(changes=6)
+        assert resume_seq == first.seq
+        assert len(missed) == 1 and missed[0].seq == first.seq + 6
+
+    def test_multiplexed_positions_roundtrip(self):
+        positions = {("view", "a"): "18f-3", ("kpis", "kpis"): "190-12"}
+        assert _parse_positions(_format_positions(positions)) == positions
+        assert _parse_positions("garbage") == {}
+        assert parse_event_id("18f-3", "18f") == 3
+        assert parse_event_id("18f-x", "18f") is None
+
+
+class TestAppend:
+    def test_rows_after_bisects_sorted_index(self):
+        payload = {
+            "columns": ["t", "v"],
+            "data": [[3, "c"], [1, "a"], [None, "-"], [2, "b"]],
+            "format": "columnar",
+        }
+        event = ViewEvent("v", 1, payload, "d")
+        assert event.rows_after("t") == ([[1, "a"], [2, "b"], [3, "c"]], 3)
+        assert event.rows_after("t", 1) == ([[2, "b"], [3, "c"]], 3)
+        assert event.rows_after("t", 3) == ([], 3)
+        assert event.rows_after("t", "x") is None  # 比較できない
+        assert event.rows_after("missing") is None
+        rows, _ = event.rows_after("t", 2)
+        assert json.loads(event.encode_rows(rows, columnar=False)) == {
+            "columns": ["t", "v"],
+            "data": [{"t": 3, "v": "c"}],
+        }
+
+    def test_sends_only_new_rows(self):
+        rows = [{"t": 1, "v": 10}, {"t": 2, "v": 20}]
+
+        def loader(view):
+            return {"columns": ["t", "v"], "data": list(rows), "alerts": []}
+
+        async def scenario():
+            hub = StreamHub(loader, interval=0.01)
+            events = _append_events(hub, "v", "t", columnar=True)
+            first = await asyncio.wait_for(anext(events), 1)
+            rows.extend([{"t": 4, "v": 40}, {"t": 3, "v": 30}])
+            second = await asyncio.wait_for(anext(events), 1)
+            rows[0]["v"] = 99  # 既存行の変更は送らない
+            rows.append({"t": 5, "v": 50})
+            third = await asyncio.wait_for(anext(events), 1)
+            await events.aclose()
+            return first, second, third
+
+        first, second, third = asyncio.run(scenario())
+        assert first["event"] == "message"
+        assert len(json.loads(first["data"])["data"]) == 2
+        assert second["event"] == "append"
+        assert json.loads(second["data"])["data"] == [[3, 30], [4, 40]]
+        assert json.loads(third["data"])["data"] == [[5, 50]]
+
+    def test_append_requires_chart(self, client):
+        res = client.get("/api/views/users_view/stream?append=1")
+        assert res.status_code == 422
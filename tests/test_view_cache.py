@@ -0,0 +1,82 @@
+"""ビュー結果キャッシュと依存テーブル推定のテスト。"""
+
+import threading
+import time
+
+from monitor_app import ViewDef
+from monitor_app.services.view_cache import ViewCache
+from monitor_app.services.view_service import view_dependencies
+
+
+class TestDependencies:
+    def test_parsed_from_query(self):
+        vdef = ViewDef(
+            query=(
+                "SELECT o.id, u.name FROM orders o JOIN Users u ON o.user_id = u.id "
+                "WHERE u.name <> 'products' -- products"
+            )
+        )
+        deps = view_dependencies(vdef, ["users", "products", "orders"])
+        assert deps == {"orders", "users"}
+
+    def test_declared_wins(self):
+        vdef = ViewDef(query="SELECT * FROM v_external", depends_on=["orders"])
+        assert view_dependencies(vdef, ["orders"]) == {"orders"}
+
+
+class TestViewCache:
+    def test_single_flight(self):
+        cache = ViewCache(ttl=60)
+        calls = []
+        gate = threading.Event()
+
+        def loader():
+            calls.append(1)
+            gate.wait(1)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get_or_load("v", loader))
+            )
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        gate.set()
+        for t in threads:
+            t.join()
+        assert results == ["value"] * 5
+        assert len(calls) == 1
+
+    def test_ttl_and_invalidate(self):
+        now = [0.0]
+        cache = ViewCache(ttl=5, clock=lambda: now[0])
+        counter = iter(range(100))
+        assert cache.get_or_load("v", lambda: next(counter)) == 0
+        assert cache.get_or_load("v", lambda: next(counter)) == 0
+        cache.invalidate(["v"])
+        assert cache.get_or_load("v", lambda: next(counter)) == 1
+        now[0] = 6
+        assert cache.get_or_load("v", lambda: next(counter)) == 2
+
+    def test_lru_limit(self):
+        cache = ViewCache(ttl=60, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.get_or_load(key, lambda: key)
+        assert cache.stats()["entries"] == 2
+
+
+class TestWriteInvalidation:
+    def test_crud_write_invalidates_view(self, client):
+        assert len(client.get("/api/views/users_view").json()["data"]) == 5
+        client.post("/api/tables/users", json={"name": "New", "email": "n@x"})
+        assert len(client.get("/api/views/users_view").json()["data"]) == 6
+
+    def test_ingest_invalidates_joined_view(self, client):
+        before = len(client.get("/api/views/orders_summary").json()["data"])
+        client.post("/api/ingest/orders", json={"user_id": 1, "amount": 2})
+        after = len(client.get("/api/views/orders_summary").json()["data"])
+        assert after == before + 1